@@ -1,10 +1,12 @@
-from .novelty_mnist import NoveltyMNISTDataModule
-from .lunar_analogue import LunarAnalogueDataModule, LunarAnalogueDataGenerator
-from .curiosity import CuriosityDataModule
+from utils.registry import LazyRegistry, module_getattr, module_all
 
-supported_datamodules = {
-    'LunarAnalogueDataModule': LunarAnalogueDataModule,
-    'LunarAnalogueDataGenerator': LunarAnalogueDataGenerator,
-    'NoveltyMNISTDataModule': NoveltyMNISTDataModule,
-    'CuriosityDataModule': CuriosityDataModule
-}
\ No newline at end of file
+# DataModules are imported on first lookup
+supported_datamodules = LazyRegistry({
+    'LunarAnalogueDataModule': 'datasets.lunar_analogue:LunarAnalogueDataModule',
+    'LunarAnalogueDataGenerator': 'datasets.lunar_analogue:LunarAnalogueDataGenerator',
+    'NoveltyMNISTDataModule': 'datasets.novelty_mnist:NoveltyMNISTDataModule',
+    'CuriosityDataModule': 'datasets.curiosity:CuriosityDataModule'
+})
+
+__getattr__ = module_getattr(__name__, supported_datamodules)
+__all__ = module_all(supported_datamodules, eager=('supported_datamodules',))
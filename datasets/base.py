@@ -1,7 +1,63 @@
+import os
+import time
+import torch
 from utils.dtypes import *
+from utils import preprocessing, cache
 import pytorch_lightning as pl
 
 
+def split_indices(
+        n_samples: int,
+        train_fraction: float,
+        seed: int = 42,
+        cache_dir: Optional[str] = None,
+        key_parts: tuple = (),
+        shuffle: bool = True) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the (train, val) index arrays of a seeded random split of n_samples into train_fraction and
+    the remainder, or of a contiguous split (the first train_fraction of the samples and the remainder) if
+    shuffle is False. The split only depends on its arguments, so every process and every run computes the
+    same one. With a cache_dir the index arrays are also persisted, keyed by the arguments and key_parts
+    (which should identify the dataset, e.g. its root path and glob pattern). The indices are sorted, so
+    the order samples are trained on is left to the train DataLoader, which shuffles them.
+    """
+    index_cache, key = None, None
+    if cache_dir is not None:
+        index_cache = cache.ArrayCache(cache_dir, 'splits')
+        key = cache.fingerprint(n_samples, train_fraction, seed, shuffle, *key_parts)
+        split = index_cache.get_arrays(key)
+        if split is not None:
+            return split['train'], split['val']
+
+    train_size = int(np.floor(n_samples * train_fraction))
+    if shuffle:
+        permutation = np.random.default_rng(seed).permutation(n_samples)
+    else:
+        permutation = np.arange(n_samples)
+    train_idxs, val_idxs = np.sort(permutation[:train_size]), np.sort(permutation[train_size:])
+
+    if index_cache is not None:
+        index_cache.put_arrays(key, train=train_idxs, val=val_idxs)
+    return train_idxs, val_idxs
+
+
+def shard_indices(indices: np.ndarray, rank: Optional[int] = None, world_size: Optional[int] = None) -> np.ndarray:
+    """
+    Returns the share of indices belonging to a rank, such that every rank gets the same number of samples.
+    Rank and world size default to those of the initialized process group, or of the RANK and WORLD_SIZE
+    environment variables.
+    """
+    if rank is None or world_size is None:
+        if torch.distributed.is_available() and torch.distributed.is_initialized():
+            rank, world_size = torch.distributed.get_rank(), torch.distributed.get_world_size()
+        else:
+            rank, world_size = int(os.environ.get('RANK', 0)), int(os.environ.get('WORLD_SIZE', 1))
+    assert 0 <= rank < world_size, 'Rank must be in [0, world_size)'
+
+    n_per_rank = len(indices) // world_size
+    return indices[rank:n_per_rank * world_size:world_size]
+
+
 class BaseDataModule(pl.LightningDataModule):
     def __init__(self) -> None:
         super().__init__()
@@ -18,6 +74,138 @@ class BaseDataModule(pl.LightningDataModule):
     def val_dataloader(self) -> DataLoader:
         raise NotImplementedError
 
+    def _set_dataloader_options(self, kwargs: dict) -> None:
+        """
+        Reads the DataLoader options from the data-parameters of a configuration file. Options that are
+        missing or null are auto-detected from the cores this process may run on and the available devices.
+        """
+        try:
+            n_cores = len(os.sched_getaffinity(0))
+        except AttributeError:
+            n_cores = os.cpu_count() or 1
+
+        num_workers = kwargs.get('num_workers')
+        self._num_workers = num_workers if num_workers is not None else min(max(n_cores - 1, 0), 16)
+        pin_memory = kwargs.get('pin_memory')
+        self._pin_memory = pin_memory if pin_memory is not None else torch.cuda.is_available()
+        persistent_workers = kwargs.get('persistent_workers')
+        self._persistent_workers = persistent_workers if persistent_workers is not None else self._num_workers > 0
+        self._prefetch_factor = kwargs.get('prefetch_factor')
+        report_throughput = kwargs.get('report_throughput')
+        self._report_throughput = report_throughput if report_throughput is not None else False
+
+        if self._num_workers == 0:
+            assert not self._persistent_workers, 'persistent_workers requires num_workers > 0'
+            assert self._prefetch_factor is None, 'prefetch_factor requires num_workers > 0'
+
+    def _set_split_options(self, kwargs: dict) -> None:
+        """Reads the options of the train/validation split from the data-parameters of a configuration file"""
+        split_seed = kwargs.get('split_seed')
+        self._split_seed = split_seed if split_seed is not None else 42
+        shard_across_ranks = kwargs.get('shard_across_ranks')
+        self._shard_across_ranks = shard_across_ranks if shard_across_ranks is not None else False
+
+    def _split_trainval(self, trainval_set, key_parts: tuple = ()) -> tuple:
+        """
+        Splits a dataset into (train, val) subsets with split_indices, persisting the split in the cache_dir
+        if there is one. With shard_across_ranks each rank only keeps its own share of both subsets, in that
+        case the Trainer must not add a DistributedSampler (replace_sampler_ddp=False, which the trainers
+        set when shard_across_ranks is enabled).
+        """
+        train_idxs, val_idxs = split_indices(
+            len(trainval_set),
+            self._train_fraction,
+            seed=self._split_seed,
+            cache_dir=getattr(self, '_cache_dir', None),
+            key_parts=key_parts)
+
+        if self._shard_across_ranks:
+            train_idxs, val_idxs = shard_indices(train_idxs), shard_indices(val_idxs)
+        return torch.utils.data.Subset(trainval_set, train_idxs), torch.utils.data.Subset(trainval_set, val_idxs)
+
+    def _dataloader(
+            self,
+            dataset,
+            drop_last: bool,
+            collate_fn: Optional[Callable] = None,
+            shuffle: bool = False) -> DataLoader:
+        options = {}
+        if self._prefetch_factor is not None:
+            options['prefetch_factor'] = self._prefetch_factor
+        if collate_fn is not None:
+            options['collate_fn'] = collate_fn
+        return torch.utils.data.DataLoader(
+            dataset,
+            batch_size=self._batch_size,
+            shuffle=shuffle,
+            drop_last=drop_last,
+            num_workers=self._num_workers,
+            pin_memory=self._pin_memory,
+            persistent_workers=self._persistent_workers,
+            **options)
+
+    def _in_memory_dataloader(self, dataset, drop_last: bool, shuffle: bool = False) -> DataLoader:
+        """
+        DataLoader for datasets resident in memory whose __getitem__ also accepts a sequence of indices and returns
+        a whole batch. Batches are sliced directly out of the resident tensors in the main process, which avoids
+        the per-sample calls, collation and worker processes (each holding a copy of the data) of _dataloader.
+        The batches are sampled by this loader itself, so Lightning can't swap in a DistributedSampler: use
+        shard_across_ranks for distributed training.
+        """
+        if shuffle:
+            sampler = torch.utils.data.RandomSampler(dataset)
+        else:
+            sampler = torch.utils.data.SequentialSampler(dataset)
+        sampler = torch.utils.data.BatchSampler(sampler, batch_size=self._batch_size, drop_last=drop_last)
+        return torch.utils.data.DataLoader(
+            dataset,
+            sampler=sampler,
+            batch_size=None,
+            num_workers=0,
+            pin_memory=self._pin_memory)
+
+    def report_throughput(self, stage: Optional[str] = None, n_batches: int = 20) -> None:
+        """
+        Prints the samples/sec of the dataloaders of a stage (all stages if None), measured over their first
+        n_batches. Called at the end of setup when report_throughput is set in the data-parameters.
+        """
+        loaders = {
+            'train': ('_train_set', self.train_dataloader),
+            'val': ('_val_set', self.val_dataloader),
+            'test': ('_test_set', self.test_dataloader)
+        }
+        if stage == 'fit' or stage == 'train':
+            names = ['train', 'val']
+        elif stage == 'test':
+            names = ['test']
+        else:
+            names = list(loaders)
+
+        for name in names:
+            attr, make_loader = loaders[name]
+            if not hasattr(self, attr):
+                continue
+            loader = make_loader()
+            n_samples = 0
+            # Worker start up is included in the timing, as it is paid by every epoch without persistent workers
+            start = time.perf_counter()
+            for i, (images, _) in enumerate(loader):
+                n_samples += len(images)
+                if i + 1 == n_batches:
+                    break
+            elapsed = time.perf_counter() - start
+            print(f'{self.name} {name} loader: {n_samples / elapsed:.1f} samples/sec '
+                  f'({n_samples} samples, num_workers={self._num_workers})')
+
+    def on_after_batch_transfer(self, batch, dataloader_idx: int = 0):
+        # Pipelines created with defer_normalization=True leave normalization to this point, where it is
+        # applied to the whole collated batch at once on the device the batch was moved to
+        normalize_batch = preprocessing.deferred_normalization(getattr(self, '_data_transforms', None))
+        if normalize_batch is None:
+            return batch
+        images, labels = batch
+        return normalize_batch(images), labels
+
     @property
     def name(self) -> str:
         return self.__class__.__name__
@@ -33,8 +221,11 @@ class BaseDataModule(pl.LightningDataModule):
         return len(self._val_set)
 
     @property
-    def test_size(self) -> int:
+    def test_size(self) -> Optional[int]:
+        """The number of test samples, None if testing on a stream (an IterableDataset) of unknown length"""
         assert hasattr(self, '_test_set'), 'Need to setup data before getting dataset length'
+        if isinstance(self._test_set, torch.utils.data.IterableDataset):
+            return None
         return len(self._test_set)
 
     @property
@@ -49,7 +240,11 @@ class BaseDataModule(pl.LightningDataModule):
             # First [0] accesses image from (image,label) tuple, second [0] accesses batch element
             data_shape = self._train_set[0][0].shape
         except AttributeError:
-            data_shape = self._test_set[0][0].shape
+            if isinstance(self._test_set, torch.utils.data.IterableDataset):
+                # Streams can't be indexed, so the shape is that of their first sample (which may wait for it)
+                data_shape = next(iter(self._test_set))[0].shape
+            else:
+                data_shape = self._test_set[0][0].shape
 
         if len(data_shape) == 3:
             return data_shape
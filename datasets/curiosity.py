@@ -12,61 +12,138 @@ Assumes data is structured as follows:
             test_novel/
                 all/
                 ...<novelty subclasses (eg. bedrock)>/
+        packed/  (optional, created by pack_curiosity_dataset)
+            trainval.npy, trainval_index.npz
+            test.npy, test_index.npz
+
+To pack the data run: python -m datasets.curiosity <root_data_path>
 
 Author: Braden Stefanuk
 Created: Mar. 18, 2021
 """
+import sys
 import torch
 import numpy as np
 
-from utils import tools
+from pathlib import Path
+from utils import tools, preprocessing
 from datasets.base import BaseDataModule
 from utils.dtypes import *
 
 
+PACKED_DIR = 'packed'
+
+
+def label_from_path(path) -> int:
+    path_string = str(path)
+    if 'typical' in path_string:
+        return 0
+    elif 'novel' in path_string:
+        return 1
+    else:
+        raise ValueError('Cannot find typical/ or novel/ in file path')
+
+
 class CuriosityDataset(torch.utils.data.Dataset):
+    # Number of images preprocessed at once by get_split
+    SPLIT_CHUNK_SIZE = 1024
+
     def __init__(
             self,
             root_data_path: str,
             train: bool = True,
-            data_transforms=None):
+            data_transforms=None,
+            packed: bool = False,
+            cache_dir: Optional[str] = None):
         super().__init__()
 
-        if train:
-            self._list_of_image_paths = tools.PathGlobber(root_data_path).glob('trainval/**/*.npy')
+        split = 'trainval' if train else 'test'
+        self._packed_images = None
+        if packed:
+            # Read from the contiguous array written by pack_curiosity_dataset, samples are zero-copy slices
+            packed_path = Path(root_data_path) / PACKED_DIR
+            assert (packed_path / f'{split}.npy').is_file(), \
+                f'No packed data found in {packed_path}, run: python -m datasets.curiosity {root_data_path}'
+            self._packed_images = np.load(packed_path / f'{split}.npy', mmap_mode='r')
+            index = np.load(packed_path / f'{split}_index.npz')
+            self._list_of_image_paths = [Path(root_data_path) / f for f in index['filenames']]
+            self._packed_labels = index['labels']
+        elif train:
+            self._list_of_image_paths = tools.PathGlobber(root_data_path, cache_dir).glob('trainval/**/*.npy')
         else:
-            self._list_of_image_paths = tools.PathGlobber(root_data_path).multiglob(
+            self._list_of_image_paths = tools.PathGlobber(root_data_path, cache_dir).multiglob(
                 (f'test/{p}*.npy' for p in ['test_typical/', 'test_novel/all/']))
         self._train = train
         self._data_transforms = data_transforms
 
+        # Build the novelty labels once, so no path parsing is needed when fetching samples
+        if self._packed_images is not None:
+            self._labels = self._packed_labels
+        else:
+            self._labels = np.array([label_from_path(p) for p in self._list_of_image_paths], dtype=np.int64)
+
     def __len__(self):
         return len(self._list_of_image_paths)
 
     def __getitem__(self, idx: int):
-        image = np.load(self._list_of_image_paths[idx]).astype(np.float32)
+        if self._packed_images is not None:
+            image = self._packed_images[idx]
+        else:
+            image = np.load(self._list_of_image_paths[idx]).astype(np.float32)
         if self._data_transforms:
             image = self._data_transforms(image)
 
         return image, self.get_label(idx)
 
     def get_label(self, idx: int):
-        if 'typical' in str(self._list_of_image_paths[idx]):
-            return 0
-        elif 'novel' in str(self._list_of_image_paths[idx]):
-            return 1
+        return int(self._labels[idx])
+
+    def get_labels(self) -> np.ndarray:
+        return self._labels
+
+    def get_split(self, mmap_path: Optional[str] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns all (preprocessed) images and novelty labels of the split. Preprocessing is applied to chunks
+        of stacked images at once (see preprocessing.apply_batched) and images stay float32 throughout.
+        If mmap_path is given, the images are written to and returned as a memory-mapped .npy file there.
+        """
+        labels = self.get_labels()
+        if self._packed_images is not None and not self._data_transforms and mmap_path is None:
+            # The packed array already is the split, so return a view rather than a copy
+            return self._packed_images, labels
+
+        dummy_images = self._preprocess_batch(self._load_images(0, 1))
+        shape = (len(self), *dummy_images.shape[1:])
+        if mmap_path is not None:
+            all_images = np.lib.format.open_memmap(mmap_path, mode='w+', dtype=np.float32, shape=shape)
         else:
-            raise ValueError('Cannot find typical/ or novel/ in file path')
+            all_images = np.empty(shape, dtype=np.float32)
+
+        for start, chunk in zip(range(0, len(self), self.SPLIT_CHUNK_SIZE), self.iter_split()):
+            all_images[start:start + len(chunk)] = chunk
+        return all_images, labels
+
+    def iter_split(self, chunk_size: Optional[int] = None) -> Iterable[np.ndarray]:
+        """Yields the images of get_split in order, chunk_size (default SPLIT_CHUNK_SIZE) images at a time"""
+        chunk_size = chunk_size if chunk_size is not None else self.SPLIT_CHUNK_SIZE
+        for start in range(0, len(self), chunk_size):
+            stop = min(start + chunk_size, len(self))
+            yield np.asarray(self._preprocess_batch(self._load_images(start, stop)), dtype=np.float32)
 
-    def get_split(self) -> Tuple[np.ndarray, np.ndarray]:
-        dummy_image, _ = self[0]
-        all_images = np.empty((len(self), *dummy_image.shape))
-        all_labels = np.empty((len(self), ))
-        for i in range(len(self)):
-            image, label = self[i]
-            all_images[i] = image.numpy()
-            all_labels[i] = label
-        return all_images, all_labels
+    def _load_images(self, start: int, stop: int) -> np.ndarray:
+        if self._packed_images is not None:
+            return self._packed_images[start:stop]
+
+        paths = self._list_of_image_paths[start:stop]
+        images = np.empty((len(paths), *np.load(paths[0], mmap_mode='r').shape), dtype=np.float32)
+        for i, pth in enumerate(paths):
+            images[i] = np.load(pth)
+        return images
+
+    def _preprocess_batch(self, images: np.ndarray) -> np.ndarray:
+        if self._data_transforms:
+            return preprocessing.apply_batched(self._data_transforms, images)
+        return images
 
 
 class CuriosityDataModule(BaseDataModule):
@@ -76,6 +153,8 @@ class CuriosityDataModule(BaseDataModule):
             data_transforms: Compose,
             batch_size: int = 8,
             train_fraction: float = 0.85,
+            use_packed_data: bool = False,
+            cache_dir: Optional[str] = None,
             **kwargs):
         super().__init__()
 
@@ -84,6 +163,10 @@ class CuriosityDataModule(BaseDataModule):
         self._train_fraction = train_fraction if train_fraction is not None else 0.85
         self._root_data_path = root_data_path
         self._val_fraction = 1 - self._train_fraction
+        self._use_packed_data = use_packed_data if use_packed_data is not None else False
+        self._cache_dir = cache_dir
+        self._set_dataloader_options(kwargs)
+        self._set_split_options(kwargs)
 
         assert (data_transforms is not None), \
             'Data transforms must be defined in the training script. See utils/__init__.py.'
@@ -99,41 +182,79 @@ class CuriosityDataModule(BaseDataModule):
             trainval_set = CuriosityDataset(
                 self._root_data_path,
                 train=True,
-                data_transforms=self._data_transforms)
-            # Since setup is called from every process, setting state here is okay
-            train_size = int(np.floor(len(trainval_set) * self._train_fraction))
-            val_size = len(trainval_set) - train_size
-
-            self._train_set, self._val_set = torch.utils.data.random_split(trainval_set, [train_size, val_size])
+                data_transforms=self._data_transforms,
+                packed=self._use_packed_data,
+                cache_dir=self._cache_dir)
+            # The split is seeded, so every process (and run) gets the same one
+            self._train_set, self._val_set = self._split_trainval(trainval_set, key_parts=(self._root_data_path,))
 
         if stage == 'test' or stage is None:
             # Setup testing data as well
             self._test_set = CuriosityDataset(
                 self._root_data_path,
                 train=False,
-                data_transforms=self._data_transforms)
+                data_transforms=self._data_transforms,
+                packed=self._use_packed_data,
+                cache_dir=self._cache_dir)
+
+        if self._report_throughput:
+            self.report_throughput(stage)
 
     def train_dataloader(self):
-        return torch.utils.data.DataLoader(
-            self._train_set,
-            batch_size=self._batch_size,
-            drop_last=True,
-            num_workers=8)
+        return self._dataloader(self._train_set, drop_last=True, shuffle=True)
 
     def val_dataloader(self):
-        return torch.utils.data.DataLoader(
-            self._val_set,
-            batch_size=self._batch_size,
-            drop_last=True,
-            num_workers=8)
+        return self._dataloader(self._val_set, drop_last=True)
 
     def test_dataloader(self):
-        return torch.utils.data.DataLoader(
-            self._test_set,
-            batch_size=self._batch_size,
-            drop_last=False,
-            num_workers=8)
-
-    def split(self, train: bool) -> Tuple[np.ndarray, np.ndarray]:
-        ds = CuriosityDataset(self._root_data_path, train=train, data_transforms=self._data_transforms)
-        return ds.get_split()
+        return self._dataloader(self._test_set, drop_last=False)
+
+    def split(self, train: bool, mmap_path: Optional[str] = None) -> Tuple[np.ndarray, np.ndarray]:
+        ds = CuriosityDataset(
+            self._root_data_path,
+            train=train,
+            data_transforms=self._data_transforms,
+            packed=self._use_packed_data,
+            cache_dir=self._cache_dir)
+        return ds.get_split(mmap_path=mmap_path)
+
+    def split_chunks(self, train: bool, chunk_size: int) -> Iterable[np.ndarray]:
+        """Yields the images of split in order, chunk_size images at a time"""
+        ds = CuriosityDataset(
+            self._root_data_path,
+            train=train,
+            data_transforms=self._data_transforms,
+            packed=self._use_packed_data,
+            cache_dir=self._cache_dir)
+        return ds.iter_split(chunk_size)
+
+
+def pack_curiosity_dataset(root_data_path: str) -> None:
+    """
+    Consolidates the thousands of small .npy files of each split into a single contiguous float32 array,
+    <root_data_path>/packed/<split>.npy, which is memory-mapped when the dataset is created with packed=True.
+    The side-car <split>_index.npz holds the novelty labels and the original filenames (relative to
+    root_data_path), aligned with the first axis of the array.
+    """
+    packed_path = Path(root_data_path) / PACKED_DIR
+    packed_path.mkdir(exist_ok=True)
+
+    for split, train in (('trainval', True), ('test', False)):
+        ds = CuriosityDataset(root_data_path, train=train)
+        dummy_image, _ = ds[0]
+        images = np.lib.format.open_memmap(
+            packed_path / f'{split}.npy', mode='w+', dtype=np.float32, shape=(len(ds), *dummy_image.shape))
+        labels = np.empty(len(ds), dtype=np.int64)
+        for i in range(len(ds)):
+            images[i], labels[i] = ds[i]
+        images.flush()
+
+        filenames = np.array([str(p.relative_to(root_data_path)) for p in ds._list_of_image_paths])
+        np.savez(packed_path / f'{split}_index.npz', labels=labels, filenames=filenames)
+        print(f'Packed {len(ds)} {split} samples into {packed_path / f"{split}.npy"}')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        raise ValueError('Usage: python -m datasets.curiosity <root_data_path>')
+    pack_curiosity_dataset(sys.argv[1])
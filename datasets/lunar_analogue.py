@@ -1,17 +1,23 @@
 # Datasets used in Novelty detection experiments
 # Author: Braden Stefanuk
 # Created: Dec 17, 2020
+import os
 import json
+import time
+import zlib
+import fnmatch
 import torch
+import cv2 as cv
 import numpy as np
 
 from pathlib import Path
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from torch.utils.data.dataloader import default_collate
 from skimage import io
-from sklearn.model_selection import train_test_split
-from utils import preprocessing
+from utils import preprocessing, cache, tools, proposals
 from utils.dtypes import *
-from datasets.base import BaseDataModule
+from datasets.base import BaseDataModule, split_indices
 
 
 def collate_nre(batch):
@@ -54,23 +60,60 @@ class LunarAnalogueDataset(torch.utils.data.Dataset):
             root_data_path: str,
             glob_pattern: str,
             train: bool = True,
-            data_transforms=None
+            data_transforms=None,
+            cache_dir: Optional[str] = None
     ):
         super().__init__()
         # We handle the training and testing data with various glob patterns, this helps
         # adapt and implement alternative labelling schemes.
-        self._list_of_image_paths = list(Path(root_data_path).glob(glob_pattern))
+        self._list_of_image_paths = tools.PathGlobber(root_data_path, cache_dir=cache_dir).glob(glob_pattern)
         self._data_transforms = data_transforms
         self._train = train
 
+        # Optionally cache the output of the deterministic part of the preprocessing (decoding, resizing,
+        # equalization, etc.) on disk. The namespace is a fingerprint of the transform parameters, so
+        # changing the configuration only invalidates the entries that depend on it.
+        self._cache = None
+        if cache_dir is not None:
+            cached_transforms, uncached_transforms = preprocessing.split_deterministic(data_transforms)
+            if cached_transforms is not None:
+                self._cached_transforms = cached_transforms
+                self._uncached_transforms = uncached_transforms
+                self._cache = cache.ArrayCache(
+                    cache_dir, f'preprocessed/{cache.fingerprint(repr(cached_transforms))}')
+
+        # In NRE mode, also store the region proposals of each image, so that later epochs only crop and warp
+        # the regions. They can be precomputed ahead of time with: python -m utils.proposals
+        # Proposals that depend on the processing order (warm_start clustering) are recomputed every time.
+        proposers = [
+            t for t in getattr(data_transforms, 'transforms', []) if isinstance(t, preprocessing.RegionProposal)]
+        self._proposal_store = None
+        if cache_dir is not None and proposers and proposers[0].reproducible:
+            self._proposal_store = proposals.ProposalStore(cache_dir, data_transforms)
+
+        # Build the novelty labels once, so that fetching a sample needs no path parsing. Ground truth boxes are
+        # only read in NRE mode, where they are indexed once too (and persisted with a cache_dir, keyed on the
+        # bbox/ files so that editing the annotations invalidates the index)
+        self._labels = np.array([self._whole_image_label(pth) for pth in self._list_of_image_paths], dtype=np.int64)
+        self._gt_bboxes = None
+        if proposers:
+            self._gt_bboxes = self._load_gt_bbox_index(root_data_path, glob_pattern, cache_dir)
+
     def __len__(self):
         return len(self._list_of_image_paths)
 
     def __getitem__(self, idx: int):
-        image = io.imread(str(self._list_of_image_paths[idx]))
+        if self._cache is not None:
+            image = self._load_preprocessed(idx)
+            data_transforms = self._uncached_transforms
+        else:
+            image = io.imread(str(self._list_of_image_paths[idx]))
+            data_transforms = self._data_transforms
 
-        if self._data_transforms:
-            image = self._data_transforms(image)
+        if self._proposal_store is not None:
+            image = self._extract_regions(idx, image, data_transforms)
+        elif data_transforms:
+            image = data_transforms(image)
 
         if len(image) == 2 and isinstance(image, tuple):
             # Then we're working with NRE data
@@ -81,23 +124,53 @@ class LunarAnalogueDataset(torch.utils.data.Dataset):
 
         return image, label
 
-    def get_label_nre(self, cr_bbox, idx: int):
+    def _load_preprocessed(self, idx: int) -> np.ndarray:
+        """Reads the preprocessed image from the cache, computing and storing it on a miss"""
         pth = self._list_of_image_paths[idx]
+        key = cache.file_fingerprint(pth)
 
-        if 'typical' in str(pth) or 'trainval' in str(pth):
-            gt_bbox = np.array([0, 0, 0, 0])
-        elif 'novel' in str(pth):
-            with open(pth.parent.parent / 'bbox' / f'{pth.stem}.json', 'r') as f:
-                gt_bbox_list = json.load(f)
-            # Take only the first ground truth box, for simplicity
-            gt_bbox = np.array([v for v in gt_bbox_list[0].values()])
-        else:
-            raise ValueError('Cannot find typical/ or novel/ in file path')
-
-        return {'filepath': [str(pth)], 'gt_bbox': gt_bbox, 'cr_bboxes': cr_bbox}
+        image = self._cache.get(key)
+        if image is None:
+            image = self._cached_transforms(io.imread(str(pth)))
+            self._cache.put(key, image)
+        return image
 
-    def get_label_whole_image(self, idx: int):
-        path_string = str(self._list_of_image_paths[idx])
+    def _extract_regions(self, idx: int, image: np.ndarray, data_transforms) -> tuple:
+        """Applies an NRE transform, reusing the stored region proposals of the image when there are some"""
+        pth = self._list_of_image_paths[idx]
+        preprocessing_transforms, proposer = proposals.split_proposer(data_transforms)
+        if preprocessing_transforms is not None:
+            image = preprocessing_transforms(image)
+
+        crop_bboxes = self._proposal_store.get(pth)
+        if crop_bboxes is None:
+            crop_bboxes = proposer.propose(image)
+            self._proposal_store.put(pth, crop_bboxes)
+        return proposer.crop(image, crop_bboxes), crop_bboxes
+
+    def _load_gt_bbox_index(self, root_data_path: str, glob_pattern: str, cache_dir: Optional[str]) -> np.ndarray:
+        novel_idxs = np.flatnonzero(self._labels)
+        index_cache, key = None, None
+        if cache_dir is not None:
+            index_cache = cache.ArrayCache(cache_dir, 'index')
+            key = cache.fingerprint(
+                root_data_path, glob_pattern, *self._list_of_image_paths,
+                *(cache.file_fingerprint(self._gt_bbox_path(self._list_of_image_paths[idx])) for idx in novel_idxs))
+            index = index_cache.get_arrays(key)
+            if index is not None:
+                return index['gt_bboxes']
+
+        gt_bboxes = np.zeros((len(self._labels), 4))
+        for idx in novel_idxs:
+            gt_bboxes[idx] = self._read_gt_bbox(self._list_of_image_paths[idx])
+
+        if index_cache is not None:
+            index_cache.put_arrays(key, gt_bboxes=gt_bboxes)
+        return gt_bboxes
+
+    @staticmethod
+    def _whole_image_label(pth: Path) -> int:
+        path_string = str(pth)
 
         if 'typical' in path_string or 'train' in path_string:
             return 0
@@ -106,6 +179,161 @@ class LunarAnalogueDataset(torch.utils.data.Dataset):
         else:
             raise ValueError('Cannot find typical/ or novel/ in file path')
 
+    @staticmethod
+    def _gt_bbox_path(pth: Path) -> Path:
+        return pth.parent.parent / 'bbox' / f'{pth.stem}.json'
+
+    @classmethod
+    def _read_gt_bbox(cls, pth: Path) -> np.ndarray:
+        with open(cls._gt_bbox_path(pth), 'r') as f:
+            gt_bbox_list = json.load(f)
+        # Take only the first ground truth box, for simplicity
+        return np.array([v for v in gt_bbox_list[0].values()])
+
+    def get_label_nre(self, cr_bbox, idx: int):
+        pth = self._list_of_image_paths[idx]
+        if self._gt_bboxes is not None:
+            gt_bbox = self._gt_bboxes[idx]
+        else:
+            # NRE transforms without a region proposal step are not indexed, read the box when it is needed
+            gt_bbox = self._read_gt_bbox(pth) if self._labels[idx] == 1 else np.zeros(4)
+        return {'filepath': [str(pth)], 'gt_bbox': gt_bbox, 'cr_bboxes': cr_bbox}
+
+    def get_label_whole_image(self, idx: int):
+        return int(self._labels[idx])
+
+    @property
+    def labels(self) -> np.ndarray:
+        return self._labels
+
+
+class LunarAnalogueStream(torch.utils.data.IterableDataset):
+    """
+    Iterable dataset of frames arriving from a rover camera, either as image files written to a directory
+    (e.g. the *_left.jpeg frames of a stereo pair) or as a video/frame-sequence container readable by OpenCV.
+    Frames are read, preprocessed and handed over one at a time, so no upfront glob is needed and memory use
+    does not grow with the length of the stream.
+
+    Directories are tailed in filename order, so frame names must sort in the order they are written (e.g. by
+    timestamp or sequence number). Each poll lists the directory and only stats the matching files named after
+    the last frame yielded. A file is only read once its size and mtime are the same on two consecutive polls,
+    so frames still being written are never decoded. Frames named before the last one yielded when they
+    appear are skipped. With follow=True the directory keeps being polled for new frames until none arrived
+    for idle_timeout seconds (forever if None), otherwise iteration ends once the frames present are exhausted.
+    With several DataLoader workers, every frame is read by the one worker its name hashes to.
+
+    Samples are (image, label) pairs like those of LunarAnalogueDataset. Frames whose path does not contain
+    typical/ or novel/ are unlabelled and get the label -1.
+    """
+    def __init__(
+            self,
+            source: str,
+            pattern: str = '*_left.jpeg',
+            data_transforms=None,
+            follow: bool = False,
+            poll_interval: float = 1.,
+            idle_timeout: Optional[float] = None):
+        super().__init__()
+        self._source = Path(source)
+        assert self._source.exists(), f'Stream source {source} does not exist'
+        self._pattern = pattern
+        self._data_transforms = data_transforms
+        self._follow = follow
+        self._poll_interval = poll_interval
+        self._idle_timeout = idle_timeout
+
+    def __iter__(self):
+        worker_info = torch.utils.data.get_worker_info()
+        worker_id, num_workers = (worker_info.id, worker_info.num_workers) if worker_info is not None else (0, 1)
+
+        if self._source.is_dir():
+            frames = self._tail_directory(worker_id, num_workers)
+        else:
+            frames = self._read_container(worker_id, num_workers)
+
+        for name, image in frames:
+            if image is not None:
+                yield self._to_sample(name, image)
+
+    def _tail_directory(self, worker_id: int, num_workers: int):
+        """Yields (path, image) for every new frame file, or (path, None) for the frames of other workers"""
+        last_name = ''
+        # Size and mtime of the frames seen on the previous poll that have not been yielded yet
+        pending = {}
+        last_frame_time = time.monotonic()
+        while True:
+            with os.scandir(self._source) as entries:
+                names = sorted(
+                    entry.name for entry in entries
+                    if entry.name > last_name and fnmatch.fnmatch(entry.name, self._pattern) and entry.is_file())
+
+            seen, ready = {}, []
+            for name in names:
+                try:
+                    stat = os.stat(self._source / name)
+                except FileNotFoundError:
+                    break
+                seen[name] = (stat.st_size, stat.st_mtime_ns)
+                # Frames are yielded in name order, so a frame still being written holds back the ones after it
+                if stat.st_size == 0 or seen[name] != pending.get(name) or len(ready) < len(seen) - 1:
+                    continue
+                ready.append(name)
+            previous, pending = pending, seen
+
+            for name in ready:
+                pth = self._source / name
+                # Only the worker a frame belongs to decodes it
+                owner = zlib.crc32(name.encode('utf-8')) % num_workers
+                yield str(pth), io.imread(str(pth)) if owner == worker_id else None
+                del pending[name]
+
+            if ready:
+                last_name = ready[-1]
+                last_frame_time = time.monotonic()
+            # Without follow, iteration ends once a poll finds nothing new (e.g. only empty files are left)
+            if not self._follow and not ready and seen == previous:
+                return
+            if self._follow and self._idle_timeout is not None \
+                    and time.monotonic() - last_frame_time > self._idle_timeout:
+                return
+            # Stability is judged between polls, so they are always apart
+            time.sleep(self._poll_interval)
+
+    def _read_container(self, worker_id: int, num_workers: int):
+        """Yields (name, RGB image) for every frame of a video container, or (name, None) for the frames of other workers"""
+        capture = cv.VideoCapture(str(self._source))
+        assert capture.isOpened(), f'Unable to open {self._source} as a video'
+        try:
+            i = 0
+            while True:
+                # grab() advances without converting the frame, which is only retrieved by the worker it belongs to
+                if not capture.grab():
+                    return
+                name = f'{self._source}#{i}'
+                if i % num_workers == worker_id:
+                    success, image = capture.retrieve()
+                    yield name, cv.cvtColor(image, cv.COLOR_BGR2RGB) if success else None
+                else:
+                    yield name, None
+                i += 1
+        finally:
+            capture.release()
+
+    def _to_sample(self, name: str, image: np.ndarray) -> tuple:
+        if self._data_transforms:
+            image = self._data_transforms(image)
+
+        try:
+            label = LunarAnalogueDataset._whole_image_label(Path(name))
+        except ValueError:
+            label = -1
+
+        if isinstance(image, tuple) and len(image) == 2:
+            # NRE data, frames of a stream have no ground truth boxes
+            image, cr_bbox = image
+            return image, {'filepath': [name], 'gt_bbox': np.zeros(4), 'cr_bboxes': cr_bbox}
+        return image, label
+
 
 class LunarAnalogueDataModule(BaseDataModule):
     """For use with Pytorch models only"""
@@ -129,15 +357,33 @@ class LunarAnalogueDataModule(BaseDataModule):
             self._use_nre_collation = True
         else:
             self._use_nre_collation = False
+        assert not (self._use_nre_collation and preprocessing.deferred_normalization(data_transforms)), \
+            'Deferred (batched) normalization is not supported with novel region extraction'
+        self._set_dataloader_options(kwargs)
+        self._set_split_options(kwargs)
 
         # Handle the default and optionally passed additional kwargs
         self._glob_pattern_train = 'trainval/**/*.jpeg'
         self._glob_pattern_test = 'test/**/*.jpeg'
+        self._cache_dir = None
         for key in kwargs:
             if key == 'glob_pattern_train' and kwargs[key] is not None:
                 self._glob_pattern_train = kwargs[key]
             elif key == 'glob_pattern_test' and kwargs[key] is not None:
                 self._glob_pattern_test = kwargs[key]
+            elif key == 'cache_dir' and kwargs[key] is not None:
+                self._cache_dir = kwargs[key]
+            elif key == 'region_clustering' and kwargs[key] is not None:
+                self._data_transforms = preprocessing.with_region_clustering(self._data_transforms, kwargs[key])
+            elif key == 'region_batched_crops' and kwargs[key] is not None:
+                self._data_transforms = preprocessing.with_batched_crops(self._data_transforms, kwargs[key])
+
+        # Optionally test on a stream of frames (a directory being written to, or a video) instead of a glob
+        self._stream_source = kwargs.get('stream_source')
+        self._stream_follow = kwargs.get('stream_follow') if kwargs.get('stream_follow') is not None else False
+        self._stream_idle_timeout = kwargs.get('stream_idle_timeout')
+        stream_pattern = kwargs.get('stream_pattern')
+        self._stream_pattern = stream_pattern if stream_pattern is not None else '*_left.jpeg'
 
     def prepare_data(self, **kwargs):
         pass
@@ -154,53 +400,53 @@ class LunarAnalogueDataModule(BaseDataModule):
                 self._root_data_path,
                 self._glob_pattern_train,
                 train=True,
-                data_transforms=self._data_transforms
+                data_transforms=self._data_transforms,
+                cache_dir=self._cache_dir
             )
-            # Since setup is called from every process, setting state here is okay
-            train_size = int(np.floor(len(trainval_set) * self._train_fraction))
-            val_size = len(trainval_set) - train_size
-
-            self._train_set, self._val_set = torch.utils.data.random_split(trainval_set, [train_size, val_size])
-
-        if stage == 'test' or stage is None:
+            # The split is seeded, so every process (and run) gets the same one
+            self._train_set, self._val_set = self._split_trainval(
+                trainval_set, key_parts=(self._root_data_path, self._glob_pattern_train))
+
+        if (stage == 'test' or stage is None) and self._stream_source is not None:
+            self._test_set = LunarAnalogueStream(
+                self._stream_source,
+                pattern=self._stream_pattern,
+                data_transforms=self._data_transforms,
+                follow=self._stream_follow,
+                idle_timeout=self._stream_idle_timeout
+            )
+        elif stage == 'test' or stage is None:
             # Setup testing data as well
             self._test_set = LunarAnalogueDataset(
                 self._root_data_path,
                 self._glob_pattern_test,
                 train=False,
-                data_transforms=self._data_transforms
+                data_transforms=self._data_transforms,
+                cache_dir=self._cache_dir
             )
 
+        if self._report_throughput:
+            self.report_throughput(stage)
+
     def train_dataloader(self):
-        return torch.utils.data.DataLoader(
-            self._train_set,
-            batch_size=self._batch_size,
-            drop_last=True,
-            num_workers=12,
-            collate_fn=collate_nre if self._use_nre_collation else default_collate
-        )
+        return self._dataloader(self._train_set, drop_last=True, shuffle=True,
+                                collate_fn=collate_nre if self._use_nre_collation else default_collate)
 
     def val_dataloader(self):
-        return torch.utils.data.DataLoader(
-            self._val_set,
-            batch_size=self._batch_size,
-            drop_last=True,
-            num_workers=12,
-            collate_fn=collate_nre if self._use_nre_collation else default_collate
-        )
+        return self._dataloader(self._val_set, drop_last=True,
+                                collate_fn=collate_nre if self._use_nre_collation else default_collate)
 
     def test_dataloader(self):
-        return torch.utils.data.DataLoader(
-            self._test_set,
-            batch_size=self._batch_size,
-            drop_last=True,
-            num_workers=12,
-            collate_fn=collate_nre if self._use_nre_collation else default_collate
-        )
+        return self._dataloader(self._test_set, drop_last=True,
+                                collate_fn=collate_nre if self._use_nre_collation else default_collate)
 
 
 class LunarAnalogueDataGenerator:
-    """For use with sklearn models and other CPU-based algorithms"""
+    """
+    For use with sklearn models and other CPU-based algorithms. Batches are produced as numpy float32 arrays
+    by a pool of threads that decode and preprocess the images of the next prefetch_batches batches while the
+    current one is being consumed. Every batch is a freshly allocated array, so batches may be kept around.
+    """
     # TODO: Make datagenerator comptabile with BaseDataModule parent class
     def __init__(
             self,
@@ -208,20 +454,36 @@ class LunarAnalogueDataGenerator:
             glob_pattern_train: str,
             glob_pattern_test: str,
             batch_size: int = 8,
-            train_fraction: float = 0.8
+            train_fraction: float = 0.8,
+            data_transforms=None,
+            cache_dir: Optional[str] = None,
+            split_seed: int = 42,
+            num_workers: Optional[int] = None,
+            prefetch_batches: int = 2
     ):
         super(LunarAnalogueDataGenerator, self).__init__()
         print(f'Loading {self.__class__.__name__}\n------')
 
-        self._batch_size = batch_size
-        self._train_fraction = train_fraction
-        self._val_fraction = 1 - train_fraction
+        # Handle NoneTypes (defaults) passed from configuration file
+        self._batch_size = batch_size if batch_size is not None else 8
+        self._train_fraction = train_fraction if train_fraction is not None else 0.8
         self._glob_pattern_train = glob_pattern_train
         self._glob_pattern_test = glob_pattern_test
         self._root_data_path = root_data_path
+        self._cache_dir = cache_dir
+        self._split_seed = split_seed if split_seed is not None else 42
+        self._num_workers = num_workers if num_workers is not None else (os.cpu_count() or 1)
+        self._prefetch_batches = prefetch_batches if prefetch_batches is not None else 2
+        assert self._prefetch_batches >= 1, 'At least one batch must be prefetched'
 
         # Define preprocessing pipeline
-        self._data_transforms = preprocessing.LunarAnaloguePreprocessingPipeline()
+        if data_transforms is None:
+            data_transforms = preprocessing.LunarAnaloguePreprocessingPipeline()
+        self._data_transforms = data_transforms
+
+    @property
+    def name(self) -> str:
+        return self.__class__.__name__
 
     def setup(self, stage: str):
 
@@ -231,20 +493,20 @@ class LunarAnalogueDataGenerator:
                 self._root_data_path,
                 self._glob_pattern_train,
                 train=True,
-                data_transforms=self._data_transforms
+                data_transforms=self._data_transforms,
+                cache_dir=self._cache_dir
             )
-            # Set training and validation split
-            train_size = np.floor(len(self._trainval_set) * self._train_fraction).astype(int)
-            val_size = np.floor(len(self._trainval_set) * self._val_fraction).astype(int)
-
-            self._train_idxs, self._val_idxs = train_test_split(
-                np.arange(len(self._trainval_set), dtype=int),
-                test_size=val_size,
-                train_size=train_size,
-                random_state=42,
+            # Set a contiguous training and validation split, consecutive frames are highly correlated so
+            # sklearn models are validated on a part of the traverse they were not fit on
+            self._train_idxs, self._val_idxs = split_indices(
+                len(self._trainval_set),
+                self._train_fraction,
+                seed=self._split_seed,
+                cache_dir=self._cache_dir,
+                key_parts=(self._root_data_path, self._glob_pattern_train),
                 shuffle=False
             )
-            print(f'Training samples: {train_size}\nValidation samples: {val_size}\n')
+            print(f'Training samples: {len(self._train_idxs)}\nValidation samples: {len(self._val_idxs)}\n')
 
         elif stage == 'test':
             # Setup testing data as well
@@ -252,7 +514,8 @@ class LunarAnalogueDataGenerator:
                 self._root_data_path,
                 self._glob_pattern_test,
                 train=False,
-                data_transforms=self._data_transforms
+                data_transforms=self._data_transforms,
+                cache_dir=self._cache_dir
             )
             print(f'Testing samples: {len(self._test_set)}\n')
 
@@ -260,8 +523,9 @@ class LunarAnalogueDataGenerator:
             raise ValueError('Only accepts the following stages: \'train\', \'test\'.')
 
     def trainval_generator(self, stage: str):
-        self.setup('train')
-        assert hasattr(self, '_trainval_set'), 'Need to instantiate datagenerator with stage=\'train\'.'
+        """Yields (batch_size, ...) float32 batches of training or validation images"""
+        if not hasattr(self, '_trainval_set'):
+            self.setup('train')
 
         if stage == 'train':
             idxs = self._train_idxs
@@ -270,30 +534,37 @@ class LunarAnalogueDataGenerator:
         else:
             raise ValueError('Generator only accepts \'train\' and \'val\' stages.')
 
-        batch_out = np.empty((self._batch_size, *self._trainval_set[0].shape))
-        batch_nb = 0
-
-        while batch_nb < (len(idxs) // self._batch_size):
-            # Use sliding batch number approach to select which data to generate
-            for i, idx in enumerate(idxs[batch_nb * self._batch_size: (batch_nb + 1) * self._batch_size]):
-                batch_out[i] = self._trainval_set[idx]
-
-            batch_nb += 1
+        for batch_out, _ in self._generate(self._trainval_set, idxs):
             yield batch_out
 
     def test_generator(self):
-        self.setup('test')
-        assert hasattr(self, '_test_set'), 'Need to instantiate datagenerator with stage=\'test\'.'
-
-        batch_out = np.empty((self._batch_size, *self._test_set[0].shape))
-        label_out = np.empty((self._batch_size,))
-        batch_nb = 0
-
-        while batch_nb < (len(self._test_set) // self._batch_size):
-            for i in range(self._batch_size):
-                # Use sliding batch number approach to select which data to generate
-                batch_out[i] = self._test_set[batch_nb * self._batch_size + i]
-                label_out[i] = self._test_set.get_label(batch_nb * self._batch_size + i)
-
-            batch_nb += 1
-            yield batch_out, label_out
+        """Yields (images, labels) pairs of (batch_size, ...) float32 and (batch_size,) int64 test batches"""
+        if not hasattr(self, '_test_set'):
+            self.setup('test')
+
+        yield from self._generate(self._test_set, np.arange(len(self._test_set)))
+
+    def _generate(self, dataset: LunarAnalogueDataset, idxs: np.ndarray):
+        # Like before, a trailing partial batch is dropped
+        n_batches = len(idxs) // self._batch_size
+        batches = [idxs[i * self._batch_size: (i + 1) * self._batch_size] for i in range(n_batches)]
+
+        # Decoding and preprocessing mostly happen in OpenCV and libjpeg, which release the GIL, so threads
+        # give true parallelism here without the copies of a process pool
+        with ThreadPoolExecutor(max_workers=self._num_workers) as executor:
+            in_flight = deque()
+            for batch_idxs in batches[:self._prefetch_batches]:
+                in_flight.append([executor.submit(dataset.__getitem__, idx) for idx in batch_idxs])
+
+            for batch_nb in range(n_batches):
+                futures = in_flight.popleft()
+                if batch_nb + self._prefetch_batches < n_batches:
+                    batch_idxs = batches[batch_nb + self._prefetch_batches]
+                    in_flight.append([executor.submit(dataset.__getitem__, idx) for idx in batch_idxs])
+
+                samples = [future.result() for future in futures]
+                batch_out = np.empty((len(samples), *np.shape(samples[0][0])), dtype=np.float32)
+                for i, (image, _) in enumerate(samples):
+                    batch_out[i] = image
+                label_out = np.array([label for _, label in samples], dtype=np.int64)
+                yield batch_out, label_out
@@ -3,15 +3,23 @@ import torch
 import numpy as np
 
 from utils.dtypes import *
+from utils import preprocessing
 
 from datasets.base import BaseDataModule
 
+# MNIST digits treated as typical and novel respectively
+TYPICAL_CLASSES = (0, 1, 3, 4, 5, 6, 8, 9)
+NOVEL_CLASSES = (2, 7)
+
 
 class NoveltyMNISTDataset(torch.utils.data.Dataset):
     """
     Fundemental class for importing Novelty MNIST data. This class should *never* be instantiated directly. Any
     calls to the class should be handled implicitly through the associated DataModule.
     """
+    # Number of images preprocessed at once by get_split
+    SPLIT_CHUNK_SIZE = 4096
+
     def __init__(
             self,
             root_data_path: str,
@@ -26,11 +34,15 @@ class NoveltyMNISTDataset(torch.utils.data.Dataset):
 
         self._images, self._class_labels = torch.load(data_path)
         self._data_transforms = data_transforms
+        self._labels = torch.from_numpy(self.get_labels())
 
     def __len__(self):
         return len(self._class_labels)
 
-    def __getitem__(self, idx: int):
+    def __getitem__(self, idx):
+        if np.ndim(idx) > 0:
+            # A sequence of indices, see get_batch
+            return self.get_batch(idx)
 
         image = self._images[idx][None]  # Unsqueeze 2d array to carry a single channel
 
@@ -39,22 +51,66 @@ class NoveltyMNISTDataset(torch.utils.data.Dataset):
 
         return image, self.get_label(idx)
 
+    def get_batch(self, idxs) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Returns the (images, labels) of a sequence of indices as (N, 1, 28, 28) and (N,) tensors, equal to collating
+        the individual samples. Steps of the transforms with a .batch() method are applied to the whole batch at once.
+        """
+        idxs = torch.as_tensor(np.asarray(idxs), dtype=torch.long)
+        images = self._images[idxs][:, None]
+
+        if self._data_transforms:
+            steps = getattr(self._data_transforms, 'transforms', [self._data_transforms])
+            for step in steps:
+                if hasattr(step, 'batch'):
+                    images = step.batch(images)
+                else:
+                    images = torch.stack([step(image) for image in images])
+
+        return images, self._labels[idxs]
+
     def get_label(self, idx: int):
+        class_label = int(self._class_labels[idx])
 
-        if any([self._class_labels[idx] == nb for nb in [0, 1, 3, 4, 5, 6, 8, 9]]):
+        if class_label in TYPICAL_CLASSES:
             return 0
-        elif any([self._class_labels[idx] == nb for nb in [2, 7]]):
+        elif class_label in NOVEL_CLASSES:
             return 1
         else:
             raise ValueError('No matching class label was found')
 
-    def get_split(self) -> Tuple[np.ndarray, np.ndarray]:
-        novelty_labels = np.empty(len(self._class_labels))
-        for i in range(len(novelty_labels)):
-            novelty_labels[i] = self.get_label(i)
-        images = self._images.numpy()
+    def get_labels(self) -> np.ndarray:
+        class_labels = self._class_labels.numpy()
+        if not np.isin(class_labels, TYPICAL_CLASSES + NOVEL_CLASSES).all():
+            raise ValueError('No matching class label was found')
+        return np.isin(class_labels, NOVEL_CLASSES).astype(np.int64)
+
+    def get_split(self, mmap_path: Optional[str] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns all images and novelty labels of the split. If data transforms are defined they are applied
+        to chunks of stacked images at once (see preprocessing.apply_batched). If mmap_path is given, the
+        images are written to and returned as a memory-mapped .npy file there, one chunk at a time.
+        """
+        shape = (len(self), *self._preprocess_batch(self._images[:1]).shape[1:])
+        if mmap_path is not None:
+            images = np.lib.format.open_memmap(mmap_path, mode='w+', dtype=np.float32, shape=shape)
+        else:
+            images = np.empty(shape, dtype=np.float32)
 
-        return images, novelty_labels
+        for start, chunk in zip(range(0, len(self), self.SPLIT_CHUNK_SIZE), self.iter_split()):
+            images[start:start + len(chunk)] = chunk
+        return images, self.get_labels()
+
+    def iter_split(self, chunk_size: Optional[int] = None) -> Iterable[np.ndarray]:
+        """Yields the images of get_split in order, chunk_size (default SPLIT_CHUNK_SIZE) images at a time"""
+        chunk_size = chunk_size if chunk_size is not None else self.SPLIT_CHUNK_SIZE
+        for start in range(0, len(self), chunk_size):
+            yield self._preprocess_batch(self._images[start:start + chunk_size]).astype(np.float32, copy=False)
+
+    def _preprocess_batch(self, images: torch.Tensor) -> np.ndarray:
+        if self._data_transforms:
+            return np.asarray(preprocessing.apply_batched(self._data_transforms, images[:, None]))
+        return images.numpy()
 
 
 class NoveltyMNISTDataModule(BaseDataModule):
@@ -64,12 +120,19 @@ class NoveltyMNISTDataModule(BaseDataModule):
             data_transforms: Compose,
             batch_size: int = 8,
             train_fraction: float = 0.8,
+            in_memory_batches: bool = True,
             **kwargs):
         super().__init__()
 
         self._root_data_path = root_data_path
         self._batch_size = batch_size if batch_size is not None else 8
         self._train_fraction = train_fraction if train_fraction is not None else 0.8
+        # Slice whole batches out of the resident tensors in the main process instead of using worker processes
+        self._in_memory_batches = in_memory_batches if in_memory_batches is not None else True
+        # Only used to persist the train/validation split
+        self._cache_dir = kwargs.get('cache_dir')
+        self._set_dataloader_options(kwargs)
+        self._set_split_options(kwargs)
 
         assert (data_transforms is not None), \
             'Changes have been made. Data transforms must now be defined in the training script. See utils/__init__.py.'
@@ -86,10 +149,8 @@ class NoveltyMNISTDataModule(BaseDataModule):
                 train=True,
                 data_transforms=self._data_transforms)
 
-            train_size = int(len(self._trainval_set) * self._train_fraction)
-            val_size = len(self._trainval_set) - train_size
-            self._train_set, self._val_set = torch.utils.data.random_split(
-                self._trainval_set, [train_size, val_size])
+            self._train_set, self._val_set = self._split_trainval(
+                self._trainval_set, key_parts=(self._root_data_path,))
 
         elif stage == 'test':
             self._test_set = NoveltyMNISTDataset(
@@ -100,27 +161,28 @@ class NoveltyMNISTDataModule(BaseDataModule):
         else:
             raise ValueError('Only accepts \'train\', \'test\', or None for stage.')
 
+        if self._report_throughput:
+            self.report_throughput(stage)
+
     def train_dataloader(self):
-        return torch.utils.data.DataLoader(
-            self._train_set,
-            batch_size=self._batch_size,
-            drop_last=True,
-            num_workers=8)
+        return self._loader(self._train_set, drop_last=True, shuffle=True)
 
     def val_dataloader(self):
-        return torch.utils.data.DataLoader(
-            self._val_set,
-            batch_size=self._batch_size,
-            drop_last=True,
-            num_workers=8)
+        return self._loader(self._val_set, drop_last=True)
 
     def test_dataloader(self):
-        return torch.utils.data.DataLoader(
-            self._test_set,
-            batch_size=self._batch_size,
-            drop_last=False,
-            num_workers=8)
+        return self._loader(self._test_set, drop_last=False)
+
+    def _loader(self, dataset, drop_last: bool, shuffle: bool = False):
+        if self._in_memory_batches:
+            return self._in_memory_dataloader(dataset, drop_last=drop_last, shuffle=shuffle)
+        return self._dataloader(dataset, drop_last=drop_last, shuffle=shuffle)
+
+    def split(self, train: bool, mmap_path: Optional[str] = None) -> Tuple[np.ndarray, np.ndarray]:
+        ds = NoveltyMNISTDataset(self._root_data_path, train=train)
+        return ds.get_split(mmap_path=mmap_path)
 
-    def split(self, train: bool) -> Tuple[np.ndarray, np.ndarray]:
+    def split_chunks(self, train: bool, chunk_size: int) -> Iterable[np.ndarray]:
+        """Yields the images of split in order, chunk_size images at a time"""
         ds = NoveltyMNISTDataset(self._root_data_path, train=train)
-        return ds.get_split()
+        return ds.iter_split(chunk_size)
@@ -1,12 +1,13 @@
-import pickle
 import torch
 
 from datasets import supported_datamodules
 from models import supported_models
+from models.pca import load_archived_pca
 from modules.pca_base_module import PCABaseModule
 from modules.cae_base_module import CAEBaseModule
 from modules.aae_base_module import AAEBaseModule
 from modules.vae_base_module import VAEBaseModule
+from modules.ensemble_scorer import EnsembleScorer, EnsembleResult
 from utils import tools, supported_preprocessing_transforms
 from utils.dtypes import *
 
@@ -33,9 +34,7 @@ def load_modules(paths_to_archived_models: List[Path]) -> dict:
 
             _, pca_test_labels = datamodule.split(train=False)
 
-            with open(pth / 'fitted_model.p', 'rb') as f:
-                model = pickle.load(f)
-                module = PCABaseModule(model)
+            module = PCABaseModule(load_archived_pca(pth))
         else:
             ckpt_path = next(iter((pth / 'checkpoints').glob('val_*')))
 
@@ -68,4 +67,12 @@ def load_modules(paths_to_archived_models: List[Path]) -> dict:
 
     if 'pca_test_labels' in locals():
         return module_catalog, datamodule, pca_test_labels
-    return module_catalog, datamodule, -1
\ No newline at end of file
+    return module_catalog, datamodule, -1
+
+
+def score_catalog(module_catalog: dict, datamodule) -> EnsembleResult:
+    # Score the test set with every module of the catalog in a single pass over it (see modules/ensemble_scorer.py),
+    # PCA modules score the test split of the datamodule they were fitted on
+    datamodule.setup('test')
+    ensemble = EnsembleScorer.from_catalog(module_catalog)
+    return ensemble.run(datamodule.test_dataloader(), datamodule.on_after_batch_transfer, datamodule=datamodule)
@@ -1,17 +1,19 @@
-from .aae_simple import SimpleAAE, BaselineAAE
-from .vae import SimpleVAE, BaselineVAE
-from .cae_baseline import BaselineCAE
-from .cae_compression import CompressionCAEMidCapacity, CompressionCAEHighCapacity
-from .pca import IncrementalPCA, StandardPCA
+from utils.registry import LazyRegistry, module_getattr, module_all
 
-supported_models = {
-    'SimpleAAE': SimpleAAE,
-    'BaselineAAE': BaselineAAE,
-    'SimpleVAE': SimpleVAE,
-    'BaselineVAE': BaselineVAE,
-    'BaselineCAE': BaselineCAE,
-    'CompressionCAEMidCapacity': CompressionCAEMidCapacity,
-    'CompressionCAEHighCapacity': CompressionCAEHighCapacity,
-    'StandardPCA': StandardPCA,
-    'IncrementalPCA': IncrementalPCA
-}
\ No newline at end of file
+# Models are imported on first lookup, e.g. StandardPCA and IncrementalPCA don't import torch (RandomizedPCA does)
+# and the torch models don't import scikit-learn
+supported_models = LazyRegistry({
+    'SimpleAAE': 'models.aae_simple:SimpleAAE',
+    'BaselineAAE': 'models.aae_simple:BaselineAAE',
+    'SimpleVAE': 'models.vae:SimpleVAE',
+    'BaselineVAE': 'models.vae:BaselineVAE',
+    'BaselineCAE': 'models.cae_baseline:BaselineCAE',
+    'CompressionCAEMidCapacity': 'models.cae_compression:CompressionCAEMidCapacity',
+    'CompressionCAEHighCapacity': 'models.cae_compression:CompressionCAEHighCapacity',
+    'StandardPCA': 'models.pca:StandardPCA',
+    'IncrementalPCA': 'models.pca:IncrementalPCA',
+    'RandomizedPCA': 'models.randomized_pca:RandomizedPCA'
+})
+
+__getattr__ = module_getattr(__name__, supported_models)
+__all__ = module_all(supported_models, eager=('supported_models',))
@@ -1,8 +1,6 @@
 import torch
 import torch.nn as nn
 
-import logging
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 from utils.dtypes import *
 
 
@@ -1,7 +1,5 @@
 import torch.nn as nn
 
-import logging
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 
 from utils.dtypes import *
 
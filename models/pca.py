@@ -1,3 +1,117 @@
+import json
+import pickle
+import numpy as np
+
+from pathlib import Path
 from sklearn.decomposition import PCA, IncrementalPCA
 IncrementalPCA = IncrementalPCA
 StandardPCA = PCA
+
+
+# Version of the layout written by save_pca, bumped whenever it changes
+PCA_FORMAT_VERSION = 1
+PCA_HEADER = 'pca.json'
+_PCA_ARRAYS = ('components_', 'mean_', 'explained_variance_', 'singular_values_')
+
+
+class FittedPCA:
+    """
+    A fitted PCA loaded with load_pca. Holds the fitted attributes of the saved model, as read-only memory-maps
+    unless loaded with mmap=False, and can transform and inverse transform with them, but not be fitted further.
+    """
+    def __init__(self, header: dict, arrays: dict):
+        self.header = header
+        for name, array in arrays.items():
+            setattr(self, name, array)
+        self.n_components_ = header['n_components_']
+        self.n_features_in_ = header['n_features_in_']
+        # None if the saved model didn't know how many samples it was fitted on
+        self.n_samples_seen_ = header.get('n_samples_seen_')
+        self._whiten = bool(header['params'].get('whiten', False))
+
+    def transform(self, x: np.ndarray) -> np.ndarray:
+        x = np.asarray(x, dtype=self.components_.dtype)
+        mean = getattr(self, 'mean_', None)
+        z = (x - mean if mean is not None else x) @ self.components_.T
+        return z / np.sqrt(self.explained_variance_) if self._whiten else z
+
+    def inverse_transform(self, z: np.ndarray) -> np.ndarray:
+        z = np.asarray(z, dtype=self.components_.dtype)
+        x = (z * np.sqrt(self.explained_variance_) if self._whiten else z) @ self.components_
+        mean = getattr(self, 'mean_', None)
+        return x + mean if mean is not None else x
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.header["model"]}, n_components_={self.n_components_})'
+
+
+def save_pca(model, directory) -> Path:
+    """
+    Saves the fitted attributes of a PCA model (StandardPCA, IncrementalPCA or RandomizedPCA) to directory, as one
+    float32 .npy file per array and a small JSON header, instead of pickling the estimator. The header is written
+    last, so an interrupted save leaves no loadable artefact. Returns the path of the header.
+    """
+    assert hasattr(model, 'components_'), 'Only fitted PCA models can be saved'
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    arrays = {}
+    for name in _PCA_ARRAYS:
+        if getattr(model, name, None) is None:
+            continue
+        array = np.ascontiguousarray(getattr(model, name), dtype=np.float32)
+        np.save(directory / f'{name}.npy', array)
+        arrays[name] = {'file': f'{name}.npy', 'dtype': 'float32', 'shape': list(array.shape)}
+
+    n_components, n_features = model.components_.shape
+    # PCA only records the samples of its last fit, as n_samples_
+    n_samples_seen = getattr(model, 'n_samples_seen_', getattr(model, 'n_samples_', None))
+    header = {
+        'format_version': PCA_FORMAT_VERSION,
+        'model': type(model).__name__,
+        # Constructor parameters, of which FittedPCA only uses whiten
+        'params': {
+            key: value for key, value in vars(model).items()
+            if not key.startswith('_') and not key.endswith('_') and isinstance(value, (bool, int, float, str))
+        },
+        'n_components_': int(n_components),
+        'n_features_in_': int(getattr(model, 'n_features_in_', n_features)),
+        'arrays': arrays
+    }
+    if n_samples_seen is not None:
+        header['n_samples_seen_'] = int(np.max(n_samples_seen))
+    with open(directory / PCA_HEADER, 'w') as f:
+        json.dump(header, f, indent=2)
+    return directory / PCA_HEADER
+
+
+def load_pca(directory, mmap: bool = True) -> FittedPCA:
+    """
+    Loads a PCA model saved with save_pca. With mmap set, the arrays are memory-mapped read-only rather than read,
+    so loading is near-instant and processes scoring with the same model share its pages.
+    """
+    directory = Path(directory)
+    with open(directory / PCA_HEADER, 'r') as f:
+        header = json.load(f)
+    assert header.get('format_version') == PCA_FORMAT_VERSION, \
+        f'Unsupported PCA format version {header.get("format_version")}, expected {PCA_FORMAT_VERSION}'
+
+    arrays = {}
+    for name, spec in header['arrays'].items():
+        array = np.load(directory / spec['file'], mmap_mode='r' if mmap else None)
+        assert array.dtype == np.dtype(spec['dtype']) and list(array.shape) == spec['shape'], \
+            f'{spec["file"]} does not match the header, expected {spec["dtype"]} {spec["shape"]}'
+        arrays[name] = array
+    return FittedPCA(header, arrays)
+
+
+def load_archived_pca(path_to_archived_model, mmap: bool = True):
+    """
+    Loads the fitted PCA model of an archived training run (a version directory), saved with save_pca to its
+    fitted_model/ directory, or pickled to fitted_model.p by runs archived before save_pca existed.
+    """
+    path = Path(path_to_archived_model)
+    if (path / 'fitted_model' / PCA_HEADER).exists():
+        return load_pca(path / 'fitted_model', mmap=mmap)
+    with open(path / 'fitted_model.p', 'rb') as f:
+        return pickle.load(f)
@@ -0,0 +1,122 @@
+import math
+import numpy as np
+import torch
+
+from contextlib import contextmanager
+
+
+class RandomizedPCA:
+    """
+    PCA fitted with a randomized low-rank SVD (torch.svd_lowrank) on float32 tensors, on the CPU with multithreaded
+    BLAS. Has the fit/partial_fit/transform/inverse_transform interface and fitted attributes of scikit-learn's PCA,
+    but only stores numpy arrays, so fitted models pickle without scikit-learn.
+
+    partial_fit updates the fit with each new batch like IncrementalPCA does, by taking the SVD of the current
+    components (scaled by their singular values), the new centred batch, and a mean correction stacked together.
+    """
+    def __init__(
+            self,
+            n_components: int = None,
+            n_oversamples: int = 10,
+            n_iter: int = 4,
+            random_state: int = 0,
+            num_threads: int = None):
+        self.n_components = n_components
+        self.n_oversamples = n_oversamples
+        self.n_iter = n_iter
+        self.random_state = random_state
+        self.num_threads = num_threads
+
+    def fit(self, x: np.ndarray):
+        """Fits the model on all the (n_samples, n_features) samples in x at once"""
+        with self._threads():
+            x = self._as_tensor(x)
+            mean = x.mean(dim=0)
+            s, v = self._svd(x - mean, self._n_components(x))
+            self._set_fit(s, v, mean, n_samples_seen=len(x))
+        return self
+
+    def partial_fit(self, x: np.ndarray):
+        """Updates the fit with a batch of (n_samples, n_features) samples"""
+        if not hasattr(self, 'components_'):
+            return self.fit(x)
+
+        with self._threads():
+            x = self._as_tensor(x)
+            n_seen, n_new = self.n_samples_seen_, len(x)
+            n_total = n_seen + n_new
+            assert n_new >= self.n_components_, \
+                f'Batches must have at least n_components ({self.n_components_}) samples, got {n_new}'
+
+            old_mean = torch.from_numpy(self.mean_)
+            new_mean = x.mean(dim=0)
+            mean = old_mean + (new_mean - old_mean) * (n_new / n_total)
+            stacked = torch.cat([
+                torch.from_numpy(self.singular_values_)[:, None] * torch.from_numpy(self.components_),
+                x - new_mean,
+                (math.sqrt(n_seen * n_new / n_total) * (old_mean - new_mean))[None]
+            ])
+            s, v = self._svd(stacked, self.n_components_)
+            self._set_fit(s, v, mean, n_samples_seen=n_total)
+        return self
+
+    def transform(self, x: np.ndarray) -> np.ndarray:
+        x = np.asarray(x, dtype=np.float32)
+        return (x - self.mean_) @ self.components_.T
+
+    def inverse_transform(self, z: np.ndarray) -> np.ndarray:
+        z = np.asarray(z, dtype=np.float32)
+        return z @ self.components_ + self.mean_
+
+    def fit_transform(self, x: np.ndarray) -> np.ndarray:
+        return self.fit(x).transform(x)
+
+    def _n_components(self, x: torch.Tensor) -> int:
+        n_max = min(x.shape)
+        if self.n_components is None:
+            return n_max
+        assert 0 < self.n_components <= n_max, \
+            f'n_components must be in [1, {n_max}] for {x.shape[0]} samples of {x.shape[1]} features'
+        return self.n_components
+
+    def _svd(self, x: torch.Tensor, n_components: int):
+        """Returns the top n_components singular values and (n_features, n_components) right singular vectors"""
+        q = min(n_components + self.n_oversamples, *x.shape)
+        with torch.random.fork_rng(devices=[]):
+            torch.manual_seed(self.random_state)
+            _, s, v = torch.svd_lowrank(x, q=q, niter=self.n_iter)
+        return s[:n_components], v[:, :n_components]
+
+    def _set_fit(self, s: torch.Tensor, v: torch.Tensor, mean: torch.Tensor, n_samples_seen: int) -> None:
+        components = v.T
+        # Like scikit-learn, flip the sign of each component so that its largest entry is positive
+        signs = torch.sign(components.gather(1, components.abs().argmax(dim=1, keepdim=True)))
+        components = components * torch.where(signs == 0, torch.ones_like(signs), signs)
+
+        self.components_ = components.contiguous().numpy()
+        self.singular_values_ = s.numpy()
+        self.explained_variance_ = (s ** 2 / max(n_samples_seen - 1, 1)).numpy()
+        self.mean_ = mean.numpy()
+        self.n_components_ = len(s)
+        self.n_features_in_ = components.shape[1]
+        self.n_samples_seen_ = n_samples_seen
+
+    @staticmethod
+    def _as_tensor(x: np.ndarray) -> torch.Tensor:
+        return torch.as_tensor(np.asarray(x, dtype=np.float32))
+
+    @contextmanager
+    def _threads(self):
+        if self.num_threads is None:
+            yield
+            return
+        previous = torch.get_num_threads()
+        torch.set_num_threads(self.num_threads)
+        try:
+            yield
+        finally:
+            torch.set_num_threads(previous)
+
+    def __repr__(self):
+        return (f'{self.__class__.__name__}(n_components={self.n_components}, n_oversamples={self.n_oversamples}, '
+                f'n_iter={self.n_iter}, random_state={self.random_state}, num_threads={self.num_threads})')
@@ -3,6 +3,7 @@ import torch.nn as nn
 import torchvision.utils as vutils
 import pytorch_lightning as pl
 
+from utils import losses
 from utils.dtypes import *
 
 
@@ -13,6 +14,8 @@ class AAEBaseModule(pl.LightningModule):
             learning_rate: float = 0.001,
             weight_decay_coefficient: float = 0.01,
             batch_size: int = 8,
+            novelty_metric: str = 'mse',
+            channel_weights: Optional[list] = None,
             **kwargs):
         super().__init__()
 
@@ -27,6 +30,8 @@ class AAEBaseModule(pl.LightningModule):
         self.lr = learning_rate if learning_rate is not None else 0.001
         self.wd = weight_decay_coefficient if weight_decay_coefficient is not None else 0.01
         self._batch_size = batch_size if batch_size is not None else 8
+        self.novelty_metric = novelty_metric if novelty_metric is not None else 'mse'
+        self.channel_weights = channel_weights
 
     def configure_optimizers(self):
         opt_reconstruction = torch.optim.AdamW(
@@ -85,10 +90,8 @@ class AAEBaseModule(pl.LightningModule):
         batch_rc = self.decoder(batch_lt)
         loss = nn.MSELoss()(batch_rc, batch_in)
 
-        # Calculate individual novelty scores
-        batch_scores = []
-        for x_nb, (x_rc, x_in) in enumerate(zip(batch_rc, batch_in)):
-            batch_scores.append(nn.MSELoss()(x_rc, x_in))
+        # Calculate individual novelty scores, one per image (or region)
+        batch_scores = losses.novelty_scores(batch_in, batch_rc, self.novelty_metric, self.channel_weights)
 
         return {
             'test_loss': loss,
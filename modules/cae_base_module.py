@@ -2,10 +2,9 @@ import torch
 import torch.nn as nn
 import pytorch_lightning as pl
 
+from utils import losses
 from utils.dtypes import *
 
-import logging
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 
 
 class CAEBaseModule(pl.LightningModule):
@@ -13,13 +12,17 @@ class CAEBaseModule(pl.LightningModule):
             self,
             model: nn.Module,
             learning_rate: float = 0.001,
-            weight_decay_coefficient: float = 0.01):
+            weight_decay_coefficient: float = 0.01,
+            novelty_metric: str = 'mse',
+            channel_weights: Optional[list] = None):
         super(CAEBaseModule, self).__init__()
 
         self.model = model
 
         self.lr = learning_rate if learning_rate is not None else 0.001
         self.wd = weight_decay_coefficient if weight_decay_coefficient is not None else 0.01
+        self.novelty_metric = novelty_metric if novelty_metric is not None else 'mse'
+        self.channel_weights = channel_weights
 
         # Return a callable torch.nn.XLoss object
         # TODO: Add the ability to quickly change the loss function being implemented (e.g. SSIM)
@@ -58,11 +61,8 @@ class CAEBaseModule(pl.LightningModule):
         batch_rc = self.model.decoder(batch_lt)
         loss = self.loss_function(batch_rc, batch_in)
 
-        # Calculate individual novelty scores
-        batch_scores = []#torch.empty(len(batch_labels), dtype=torch.float)
-        for x_nb, (x_rc, x_in) in enumerate(zip(batch_rc, batch_in)):
-            # batch_scores[x_nb] = self.loss_function(x_rc, x_in)
-            batch_scores.append(self.loss_function(x_rc, x_in))
+        # Calculate individual novelty scores, one per image (or region)
+        batch_scores = losses.novelty_scores(batch_in, batch_rc, self.novelty_metric, self.channel_weights)
 
         self.log('test_loss', loss)
         return {
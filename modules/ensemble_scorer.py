@@ -0,0 +1,196 @@
+"""
+Scores a dataset with several models in a single pass over it. Each batch is loaded, preprocessed (including any
+region proposals) and normalized once, then fanned out to every model of the ensemble:
+
+    ensemble = EnsembleScorer.from_catalog(module_catalog)  # as returned by experiments/helpers.load_modules
+    result = ensemble.run(datamodule.test_dataloader(), datamodule.on_after_batch_transfer, datamodule=datamodule)
+    fused = result.fuse('rank')
+
+PCA models are fitted on the data of datamodule.split (or of a datagenerator), which is laid out and normalized
+differently from the batches of the dataloaders, so they score the test split of the datamodule instead.
+"""
+import time
+import torch
+import numpy as np
+
+from functools import partial
+from modules.novelty_scorer import NoveltyScorer
+from utils.dtypes import *
+
+
+class EnsembleResult:
+    """
+    Columnar results of an ensemble run, the (N,) scores of each model aligned with the (N,) labels. Labels that
+    are dictionaries (e.g. from the NRE collation) are kept as one column per key, each concatenated along the
+    batch dim.
+    """
+    def __init__(self, scores: dict, labels, seconds: Optional[dict] = None):
+        self.scores = scores
+        self.labels = labels
+        self.seconds = seconds if seconds is not None else {}
+
+    @property
+    def names(self) -> List[str]:
+        return list(self.scores)
+
+    def __len__(self):
+        return len(next(iter(self.scores.values()))) if self.scores else 0
+
+    def standardized(self, name: str) -> np.ndarray:
+        """Returns the scores of a model as z-scores, so that the scores of different models are comparable"""
+        scores = self.scores[name]
+        std = scores.std()
+        return (scores - scores.mean()) / (std if std > 0 else 1.)
+
+    def fuse(self, method: str = 'mean', names: Optional[Iterable[str]] = None) -> np.ndarray:
+        """
+        Returns the (N,) fusion of the scores of the given models (all if None), by one of:
+            'mean': mean of the z-scores of each model
+            'max': max of the z-scores of each model
+            'rank': mean of the ranks of each model, scaled to [0, 1]
+        """
+        names = list(names) if names is not None else self.names
+        assert len(names) > 0, 'Need at least one model to fuse'
+
+        if method == 'mean':
+            return np.mean([self.standardized(name) for name in names], axis=0)
+        elif method == 'max':
+            return np.max([self.standardized(name) for name in names], axis=0)
+        elif method == 'rank':
+            ranks = [np.argsort(np.argsort(self.scores[name], kind='stable'), kind='stable') for name in names]
+            return np.mean(ranks, axis=0) / max(len(self) - 1, 1)
+        else:
+            raise ValueError(f'Unknown fusion method {method!r}, expected one of: mean, max, rank')
+
+    def as_result_catalog(self) -> dict:
+        """Returns the results in the {name: {'scores': ..., 'labels': ...}} format of the detection notebooks"""
+        return {name: {'scores': scores, 'labels': self.labels} for name, scores in self.scores.items()}
+
+    def to_dataframe(self):
+        """Returns the scores and labels as a pandas DataFrame, one column per model (and per label key)"""
+        import pandas as pd
+
+        labels = self.labels if isinstance(self.labels, dict) else {'labels': self.labels}
+        columns = {**self.scores}
+        for key, values in labels.items():
+            # Only one dimensional label columns fit in a frame
+            if np.ndim(values) == 1 and len(values) == len(self):
+                columns[key] = values
+        return pd.DataFrame(columns)
+
+
+class EnsembleScorer:
+    """
+    Scores batches with every model of an ensemble. Members are NoveltyScorers, or any object with a
+    score(batch) method returning the (B,) np.ndarray scores of a normalized (B, C, H, W) batch. Members with a
+    transform_pipeline (PCABaseModule) are not handed the batches, they score the test split of the datamodule
+    given to run, which must hold the same samples in the same order as the dataloader.
+    """
+    def __init__(self, members: dict, device: Optional[Union[str, torch.device]] = None):
+        assert len(members) > 0, 'An ensemble needs at least one member'
+        self.members = members
+        self._device = torch.device(device if device is not None else 'cuda' if torch.cuda.is_available() else 'cpu')
+        # Batches are normalized once by the ensemble, not again by each scorer
+        self._score_fns = {
+            name: partial(member.score, normalized=True) if isinstance(member, NoveltyScorer) else member.score
+            for name, member in members.items() if not hasattr(member, 'transform_pipeline')
+        }
+        self._split_members = {
+            name: member for name, member in members.items() if hasattr(member, 'transform_pipeline')
+        }
+
+    @classmethod
+    def from_catalog(cls, module_catalog: dict, device: Optional[Union[str, torch.device]] = None):
+        """
+        Returns an ensemble of all the modules of a {model_type: {model_name: module}} catalog, as returned by
+        experiments/helpers.load_modules. Members are named '<model_type>/<model_name>'.
+        """
+        members = {}
+        for model_type, modules in module_catalog.items():
+            for model_name, module in modules.items():
+                if hasattr(module, 'score'):
+                    member = module
+                else:
+                    # CAEBaseModule and VAEBaseModule hold their model as .model, AAEBaseModule holds its parts
+                    member = NoveltyScorer(
+                        getattr(module, 'model', module),
+                        novelty_metric=getattr(module, 'novelty_metric', None),
+                        channel_weights=getattr(module, 'channel_weights', None),
+                        device=device)
+                members[f'{model_type}/{model_name}'] = member
+        return cls(members, device=device)
+
+    def score(self, batch_in) -> dict:
+        """Returns the {name: (B,) scores} of a normalized batch for every member"""
+        return {name: score_fn(batch_in) for name, score_fn in self._score_fns.items()}
+
+    def run(
+            self,
+            dataloader: Iterable,
+            normalize_batch: Optional[Callable] = None,
+            n_batches: Optional[int] = None,
+            datamodule=None) -> EnsembleResult:
+        """
+        Scores the (images, labels) batches of dataloader (up to n_batches, all if None) with every member.
+        Batches are moved to the device and passed through normalize_batch (e.g. the on_after_batch_transfer of
+        the loader's datamodule, to apply deferred normalization) once, before being fanned out to the members.
+        PCA members score the test split of datamodule, which is required if there are any.
+        """
+        assert datamodule is not None or not self._split_members, \
+            'PCA members score the test split of a datamodule, pass the datamodule of the dataloader'
+        scores = {name: [] for name in self._score_fns}
+        seconds = {name: 0. for name in self.members}
+        labels = []
+
+        with torch.inference_mode():
+            for batch_nb, batch in enumerate(dataloader):
+                if n_batches is not None and batch_nb == n_batches:
+                    break
+                images, batch_labels = batch
+                images = torch.as_tensor(images).to(self._device, non_blocking=True)
+                if normalize_batch is not None:
+                    images, batch_labels = normalize_batch((images, batch_labels))
+                if images.dim() == 5:
+                    images = images.flatten(0, 1)
+
+                for name, score_fn in self._score_fns.items():
+                    start = time.perf_counter()
+                    scores[name].append(np.asarray(score_fn(images)).reshape(-1))
+                    seconds[name] += time.perf_counter() - start
+                labels.append(batch_labels)
+
+        assert len(labels) > 0, 'The dataloader yielded no batches'
+        scores = {name: np.concatenate(batch_scores) for name, batch_scores in scores.items()}
+        n_samples = len(next(iter(scores.values()))) if scores else None
+
+        for name, member in self._split_members.items():
+            start = time.perf_counter()
+            split_scores = member.transform_pipeline(datamodule)
+            seconds[name] += time.perf_counter() - start
+            if isinstance(split_scores, tuple):
+                # Datagenerators also return their labels
+                split_scores = split_scores[0]
+            split_scores = np.asarray(split_scores).reshape(-1)
+
+            if n_samples is not None:
+                # With n_batches only the first samples of the split were scored by the other members
+                if len(split_scores) < n_samples or (n_batches is None and len(split_scores) != n_samples):
+                    raise ValueError(
+                        f'{name} scored {len(split_scores)} samples of the test split, but the dataloader '
+                        f'yielded {n_samples}, so their scores can\'t be aligned')
+                split_scores = split_scores[:n_samples]
+            scores[name] = split_scores
+
+        return EnsembleResult(
+            {name: scores[name] for name in self.members},
+            _concatenate_labels(labels),
+            seconds)
+
+
+def _concatenate_labels(labels: list):
+    """Concatenates the labels of each batch along the batch dim, key by key for dictionaries"""
+    if isinstance(labels[0], dict):
+        return {key: _concatenate_labels([batch_labels[key] for batch_labels in labels]) for key in labels[0]}
+    return np.concatenate([
+        batch_labels.cpu().numpy() if isinstance(batch_labels, torch.Tensor) else np.asarray(batch_labels)
+        for batch_labels in labels])
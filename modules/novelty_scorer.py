@@ -0,0 +1,216 @@
+"""
+Inference-only novelty scoring of the reconstruction based models (CAE, AAE and VAE), without a LightningModule or
+a DataModule. A scorer is meant to be created once, e.g. at the start of a long-running process, and then called on
+every incoming batch:
+
+    scorer = NoveltyScorer.from_archive('logs/CuriosityDataModule/BaselineCAE/version_0', in_shape=(6, 64, 64))
+    scores = scorer(batch)                        # np.ndarray (B,)
+    scores, maps = scorer(batch, return_maps=True)  # and the (B, C, H, W) error maps
+"""
+import yaml
+import torch
+import torch.nn as nn
+import numpy as np
+
+from utils import losses
+from utils.dtypes import *
+
+
+class NoveltyScorer:
+    """
+    Scores batches with the reconstruction error of a model's encoder and decoder, the same score as the test_step
+    of the corresponding training module. Only the model is kept, in eval mode on a single device, and scoring runs
+    under torch.inference_mode, so nothing is tracked for autograd and no inputs or reconstructions are retained
+    between calls.
+
+    Variational models (those defining encode and decode) are scored deterministically by decoding the mean of
+    q(z|x), rather than a sample of it as in VAEBaseModule.test_step.
+
+    The model can also be a reconstruction graph exported with utils/export.py (see from_export, which sets
+    exported), in which case none of the model classes of this repo are needed.
+    """
+    def __init__(
+            self,
+            model: nn.Module,
+            data_transforms: Optional[Compose] = None,
+            novelty_metric: str = 'mse',
+            channel_weights: Optional[list] = None,
+            device: Optional[Union[str, torch.device]] = None,
+            exported: bool = False):
+        # Models are reconstructed through their encoder and decoder, exports are callables returning the
+        # reconstruction of a batch
+        self._exported = exported
+        if exported:
+            assert callable(model), 'An exported model must be callable'
+        else:
+            assert hasattr(model, 'encoder') and hasattr(model, 'decoder'), 'The model must have an encoder and a decoder'
+
+        self._device = torch.device(device if device is not None else 'cuda' if torch.cuda.is_available() else 'cpu')
+        self._variational = hasattr(model, 'encode') and hasattr(model, 'decode')
+        self.model = model.to(self._device).eval() if isinstance(model, nn.Module) else model
+        self._data_transforms = data_transforms
+        self.novelty_metric = novelty_metric if novelty_metric is not None else 'mse'
+        self.channel_weights = channel_weights
+
+        # Set when loaded from an archive or an export, and saved along with exports
+        self.in_shape = None
+        self.preprocessing = None
+
+    @classmethod
+    def from_checkpoint(cls, model: nn.Module, ckpt_path: Union[str, Path], **kwargs):
+        """
+        Loads the weights of a training module's checkpoint into model, and returns a scorer for it. The keyword
+        arguments are passed on to the constructor.
+        """
+        checkpoint = torch.load(str(ckpt_path), map_location='cpu')
+        state_dict = checkpoint.get('state_dict', checkpoint)
+        # CAEBaseModule and VAEBaseModule hold the model as .model, AAEBaseModule holds its parts directly
+        state_dict = {
+            (key[len('model.'):] if key.startswith('model.') else key): value for key, value in state_dict.items()
+        }
+        model.load_state_dict(state_dict)
+        return cls(model, **kwargs)
+
+    @classmethod
+    def from_archive(
+            cls,
+            path_to_archived_model: Union[str, Path],
+            in_shape: Optional[Iterable[int]] = None,
+            device: Optional[Union[str, torch.device]] = None):
+        """
+        Returns a scorer for an archived training run (a version directory with a configuration.yaml and a
+        checkpoints/val_* file, as loaded by experiments/helpers.load_modules). The model, preprocessing and
+        novelty metric are taken from the configuration. The (C, H, W) in_shape of the model's input should be
+        given, otherwise the datamodule of the configuration is set up once to find it.
+        """
+        from datasets import supported_datamodules
+        from models import supported_models
+        from utils import supported_preprocessing_transforms
+
+        path = Path(path_to_archived_model)
+        with open(path / 'configuration.yaml', 'r') as f:
+            config = yaml.full_load(f)
+        exp_params, data_params = config['experiment-parameters'], config['data-parameters']
+        module_params = config.get('module-parameters') or {}
+        data_transforms = supported_preprocessing_transforms[data_params['preprocessing']]
+
+        if in_shape is None:
+            datamodule = supported_datamodules[exp_params['datamodule']](
+                data_transforms=data_transforms,
+                **data_params)
+            datamodule.setup('test')
+            in_shape = datamodule.data_shape
+
+        model_type = exp_params['model']
+        if 'CAE' in model_type:
+            model = supported_models[model_type](in_shape=torch.Size(in_shape))
+        elif 'AAE' in model_type or 'VAE' in model_type:
+            model = supported_models[model_type](
+                in_shape=torch.Size(in_shape),
+                latent_nodes=module_params['latent_nodes'])
+        else:
+            raise ValueError(f'Only CAE, AAE and VAE models can be scored, got {model_type}')
+
+        scorer = cls.from_checkpoint(
+            model,
+            next(iter((path / 'checkpoints').glob('val_*'))),
+            data_transforms=data_transforms,
+            novelty_metric=module_params.get('novelty_metric'),
+            channel_weights=module_params.get('channel_weights'),
+            device=device)
+        scorer.in_shape = tuple(int(s) for s in in_shape)
+        scorer.preprocessing = data_params['preprocessing']
+        return scorer
+
+    @classmethod
+    def from_export(cls, path_to_export: Union[str, Path], device: Union[str, torch.device] = 'cpu'):
+        """
+        Returns a scorer running a reconstruction graph exported with utils/export.py, either TorchScript
+        (<name>.pt) or ONNX (<name>.onnx, CPU only, requires onnxruntime). The preprocessing and novelty metric
+        are read from the <name>.json saved with the export.
+        """
+        from utils import export, supported_preprocessing_transforms
+
+        metadata = export.load_export_metadata(path_to_export)
+        preprocessing = metadata.get('preprocessing')
+        scorer = cls(
+            export.load_exported(path_to_export, device=device),
+            data_transforms=supported_preprocessing_transforms[preprocessing] if preprocessing is not None else None,
+            novelty_metric=metadata.get('novelty_metric'),
+            channel_weights=metadata.get('channel_weights'),
+            device=device,
+            exported=True)
+        scorer.in_shape = tuple(metadata['in_shape'])
+        scorer.preprocessing = preprocessing
+        return scorer
+
+    @property
+    def device(self) -> torch.device:
+        return self._device
+
+    def export_metadata(self) -> dict:
+        """Returns what is needed, besides the reconstruction graph, to score with an export of this scorer"""
+        return {
+            'preprocessing': self.preprocessing,
+            'novelty_metric': self.novelty_metric,
+            'channel_weights': self.channel_weights
+        }
+
+    def reconstruct(self, batch_in: Tensor) -> Tensor:
+        """Returns the reconstruction of a (N, C, H, W) batch that is already on the scorer's device"""
+        if self._exported:
+            return self.model(batch_in).to(self._device)
+        if self._variational:
+            mu, _ = self.model.encode(batch_in)
+            return self.model.decode(mu)
+        return self.model.decoder(self.model.encoder(batch_in))
+
+    def score(self, batch, return_maps: bool = False, normalized: bool = False):
+        """
+        Returns the novelty scores of a batch of preprocessed images, as an np.ndarray of shape (B,), along with
+        the (B, C, H, W) error maps if return_maps is set. The batch is an array or tensor of shape (B, C, H, W),
+        or (B, R, C, H, W) for region extraction (in which case there is one score per region), as produced by
+        the datamodule of the preprocessing. Normalization deferred by the preprocessing is applied here, unless
+        the batch is already normalized.
+        """
+        if normalized:
+            return self._score(batch, None, return_maps)
+        # Imported on first use, utils.preprocessing loads OpenCV
+        from utils.preprocessing import deferred_normalization
+        return self._score(batch, deferred_normalization(self._data_transforms), return_maps)
+
+    __call__ = score
+
+    def score_images(self, images: np.ndarray, return_maps: bool = False):
+        """
+        Preprocesses a stacked batch of raw (B, H, W, C) images with the scorer's data_transforms, then scores it.
+        Only for whole image preprocessing, region extraction batches are scored with score.
+        """
+        from utils.preprocessing import apply_batched
+
+        assert self._data_transforms is not None, 'Scoring raw images requires data_transforms'
+        return self._score(apply_batched(self._data_transforms, images), None, return_maps)
+
+    def score_dataloader(self, dataloader: DataLoader) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns the concatenated (scores, labels) of all the batches of a DataLoader"""
+        scores, labels = [], []
+        for batch_in, batch_labels in dataloader:
+            scores.append(self.score(batch_in))
+            labels.append(np.asarray(batch_labels).reshape(-1))
+        return np.concatenate(scores), np.concatenate(labels)
+
+    def _score(self, batch, normalize_batch: Optional[Callable], return_maps: bool):
+        with torch.inference_mode():
+            batch_in = torch.as_tensor(batch).to(self._device, non_blocking=True)
+            if batch_in.dim() == 5:
+                batch_in = batch_in.flatten(0, 1)
+            assert batch_in.dim() == 4, f'Batch must have 4 or 5 dims, got {batch_in.dim()}'
+            if normalize_batch is not None:
+                batch_in = normalize_batch(batch_in)
+            batch_in = batch_in.float()
+
+            error = losses.novelty_error(batch_in, self.reconstruct(batch_in), self.novelty_metric, self.channel_weights)
+            scores = error.flatten(1).mean(dim=1).cpu().numpy()
+            if return_maps:
+                return scores, error.cpu().numpy()
+            return scores
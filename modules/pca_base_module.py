@@ -2,56 +2,70 @@
 Defines base module for PCA experiments.
 Class must be instantiated with an sklearn model that has the following 
 methods: .partial_fit, .transform, .inverse_transform
+and the fitted attributes .components_ (orthonormal rows) and .mean_, which are used for scoring.
 """
 import numpy as np
 
-from utils import losses, tools
+from pathlib import Path
+from utils import tools
 
 
 class PCABaseModule(object):
-    def __init__(self, model):
+    def __init__(self, model, chunk_size: int = None, mmap_dir: str = None):
+        """
+        With a chunk_size, datamodules are consumed in chunks of that many samples: the model is fitted with
+        .partial_fit on each chunk (e.g. IncrementalPCA), and the test set is scored chunk by chunk, so memory
+        use doesn't grow with the size of the dataset. Chunks are drawn from the same data as datamodule.split,
+        either straight from its dataset, or if mmap_dir is given, from the splits written there as memory-mapped
+        .npy files.
+        """
         self.model = model
+        self._chunk_size = chunk_size
+        self._mmap_dir = mmap_dir
+        if chunk_size is not None:
+            assert chunk_size > 0, 'chunk_size must be positive'
+            assert hasattr(model, 'partial_fit'), 'Fitting in chunks requires a model with .partial_fit'
 
     def fit_pipeline(self, datamodule, fast_dev_run: int=0):
         """
         Uses the class's training and validation generator to iteratively fit/validate the PCA model.
         """
         if 'module' in datamodule.name.lower():
+            self._check_split(datamodule)
+
+        if 'module' in datamodule.name.lower() and self._chunk_size is not None:
+            for chunk_nb, x in enumerate(self._chunks(datamodule, train=True)):
+                x = self._reshape_batch(x)
+                if len(x) < self._min_chunk_rows():
+                    # Only the last chunk can be this short, partial_fit needs at least n_components samples
+                    print(f'[CHUNK {chunk_nb}] Skipping the last {len(x)} samples')
+                    continue
+                print(f'[CHUNK {chunk_nb}] Fitting...')
+                self.model.partial_fit(x)
+
+                if fast_dev_run > 0 and chunk_nb == (fast_dev_run - 1):
+                    break
+
+        elif 'module' in datamodule.name.lower():
             x, y = datamodule.split(train=True)
             self.model.fit(self._reshape_batch(x))
 
         elif 'generator' in datamodule.name.lower():
             assert hasattr(datamodule, 'trainval_generator')
-            novelty_scores = []
 
             # Grab a batch from the training set
             for batch_nb, batch_tr_in in enumerate(datamodule.trainval_generator('train')):
                 print(f'[BATCH {batch_nb}] Fitting...')
                 self.model.partial_fit(self._reshape_batch(batch_tr_in))
 
-                batch_novelty_scores = []
-                # Grab a batch from the validation set
-                for batch_vl_in in self.dg.trainval_generator('val'):
-                    batch_vl_rd = self.model.transform(self._reshape_batch(batch_vl_in))
-                    batch_vl_rc = self.model.inverse_transform(batch_vl_rd).reshape(batch_vl_in.shape)
-
-                    # Run validation on batch
-                    for x_nb, (x_rc, x_in) in enumerate(zip(batch_vl_rc, batch_vl_in)):
-                        assert len(x_rc.shape) == 3, 'Only accepts H,W,C image-data'
-                        image_novelty_score = losses.squared_error(
-                            x_in,
-                            x_rc,
-                            show_plot=(True if all([batch_nb % 10 == 0, x_nb == 4]) else False),
-                            return_map=False
-                        )
-                        batch_novelty_scores.append(image_novelty_score)
-
-                print(f'[BATCH {batch_nb}] Validation novelty score {np.mean(batch_novelty_scores)}')
-                novelty_scores.append(batch_novelty_scores)
-
                 if fast_dev_run > 0 and batch_nb == (fast_dev_run - 1):
                     break
 
+            # Validate the fitted model once, on the whole validation set
+            novelty_scores = np.concatenate([
+                self.score(batch_vl_in) for batch_vl_in in datamodule.trainval_generator('val')])
+            print(f'Validation novelty score {np.mean(novelty_scores)}')
+
         else:
             raise ValueError('Something went wrong when loading the datamodule...')
 
@@ -61,45 +75,88 @@ class PCABaseModule(object):
         trained PCA model.
         """
         if 'module' in datamodule.name.lower():
-            x_test_in, y_test_in = datamodule.split(train=False)
-            x_test_reduced = self.model.transform(self._reshape_batch(x_test_in))
-            x_test_rc = self.model.inverse_transform(x_test_reduced).reshape(x_test_in.shape)
+            self._check_split(datamodule)
 
+        if 'module' in datamodule.name.lower() and self._chunk_size is not None:
             novelty_scores = []
-            for x_nb, (x_in, x_rc) in enumerate(zip(x_test_in, x_test_rc)):
-                novelty_score = losses.squared_error(x_in, x_rc, show_plot=False, return_map=False)
-                novelty_scores.append(novelty_score)
+            for chunk_nb, x_test_in in enumerate(self._chunks(datamodule, train=False)):
+                novelty_scores.append(self.score(x_test_in))
+
+                if fast_dev_run > 0 and chunk_nb == (fast_dev_run - 1):
+                    break
 
-            return novelty_scores
+            return np.concatenate(novelty_scores)
+
+        elif 'module' in datamodule.name.lower():
+            x_test_in, y_test_in = datamodule.split(train=False)
+            return self.score(x_test_in)
 
         elif 'generator' in datamodule.name.lower():
             novelty_scores = []
             novelty_labels = []
-            for batch_nb, (batch_in, batch_lbl) in enumerate(self.dg.test_generator()):
-
-                # Compute batch-wise reduction and reconstruction
-                batch_rd = self.model.transform(self._reshape_batch(batch_in))
-                batch_rc = self.model.inverse_transform(batch_rd).reshape(batch_in.shape)
-
-                # Operate on each image-pair independently, looping over the batch
-                for x_nb, (x_rc, x_in, x_lbl) in enumerate(zip(batch_rc, batch_in, batch_lbl)):
-                    assert len(x_rc.shape) == 3, 'Can only operate on H,W,C image-data'
-                    # TODO: Consider using alternative losses here
-                    x_novelty_score = losses.squared_error(
-                        x_in,
-                        x_rc,
-                        show_plot=(True if all([batch_nb % 10 == 0, x_nb == 0]) else False),
-                        return_map=False
-                    )
-                    novelty_scores.append(x_novelty_score)
-                    novelty_labels.append(x_lbl)
-
+            for batch_nb, (batch_in, batch_lbl) in enumerate(datamodule.test_generator()):
+                novelty_scores.append(self.score(batch_in))
+                novelty_labels.append(batch_lbl)
                 print(f'[BATCH {batch_nb}] Transforming...')
 
                 if fast_dev_run > 0 and batch_nb == (fast_dev_run - 1):
                     break
 
-            return novelty_scores, novelty_labels
+            return np.concatenate(novelty_scores), np.concatenate(novelty_labels)
+
+    def score(self, batch_in, return_maps: bool = False):
+        """
+        Returns the (B,) novelty scores of a batch, the mean squared error of the reconstruction of each image,
+        along with the squared error maps (shaped like the batch) if return_maps is set. The images are flattened
+        as they are, so the batch must be laid out and normalized like the data the model was fitted on.
+
+        The residual of the reconstruction is computed in the reduced space, as ||x - mean||^2 - ||W (x - mean)||^2
+        for the orthonormal components W, so reconstructions are only materialized for the error maps.
+        """
+        if hasattr(batch_in, 'cpu'):
+            batch_in = batch_in.cpu().numpy()
+        batch_in = np.asarray(batch_in)
+        components = self.model.components_
+
+        x = self._reshape_batch(batch_in).astype(components.dtype, copy=False)
+        mean = getattr(self.model, 'mean_', None)
+        if mean is not None:
+            x = x - mean
+        z = x @ components.T
+
+        # Rounding can make the residual of well reconstructed images slightly negative
+        residual = np.einsum('ij,ij->i', x, x) - np.einsum('ij,ij->i', z, z)
+        scores = np.maximum(residual, 0) / x.shape[1]
+        if return_maps:
+            return scores, ((x - z @ components) ** 2).reshape(batch_in.shape)
+        return scores
+
+    @staticmethod
+    def _check_split(datamodule):
+        assert hasattr(datamodule, 'split') and hasattr(datamodule, 'split_chunks'), \
+            f'{datamodule.name} has no split, use a datamodule that does (e.g. CuriosityDataModule) or a datagenerator'
+
+    def _chunks(self, datamodule, train: bool):
+        """
+        Yields chunks of chunk_size images (the last one may be shorter) of the trainval or test split of a
+        datamodule, as numpy arrays. They are the images of datamodule.split, in the same order and preprocessed
+        the same way, so chunked and whole fits are on the same data. Only one chunk is held in memory at a time.
+        """
+        if self._mmap_dir is not None:
+            split = 'trainval' if train else 'test'
+            Path(self._mmap_dir).mkdir(parents=True, exist_ok=True)
+            images, _ = datamodule.split(
+                train=train, mmap_path=str(Path(self._mmap_dir) / f'{datamodule.name}_{split}.npy'))
+            for start in range(0, len(images), self._chunk_size):
+                yield np.asarray(images[start:start + self._chunk_size])
+            return
+
+        yield from datamodule.split_chunks(train=train, chunk_size=self._chunk_size)
+
+    def _min_chunk_rows(self) -> int:
+        # Once fitted, the number of components is fixed and every chunk needs at least that many samples
+        n_components = getattr(self.model, 'n_components_', None) or getattr(self.model, 'n_components', None)
+        return n_components if n_components is not None else 1
 
     def _reshape_batch(self, batch_in):
         # Keep the batch/n_sample dimension, take product of other remaining dimensions
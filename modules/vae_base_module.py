@@ -1,6 +1,7 @@
 import torch.nn as nn
 import pytorch_lightning as pl
 
+from utils import losses
 from utils.dtypes import *
 
 
@@ -13,6 +14,8 @@ class VAEBaseModule(pl.LightningModule):
             learning_rate: float = 0.001,
             weight_decay_coefficient: float = 0.01,
             batch_size: int = 8,
+            novelty_metric: str = 'mse',
+            channel_weights: Optional[list] = None,
             **kwargs):
         super().__init__()
 
@@ -22,6 +25,8 @@ class VAEBaseModule(pl.LightningModule):
         self._train_size = train_size
         self._val_size = val_size
         self._batch_size = batch_size
+        self.novelty_metric = novelty_metric if novelty_metric is not None else 'mse'
+        self.channel_weights = channel_weights
 
     def forward(self, x: Tensor, **kwargs) -> list:
         return self.model.forward(x, **kwargs)
@@ -58,10 +63,8 @@ class VAEBaseModule(pl.LightningModule):
         image_shape = batch_in.shape
         batch_rc, mu, log_var, batch_lt = self.model.generate_for_testing(batch_in)
 
-        # Calculate individual novelty scores
-        batch_scores = []
-        for x_nb, (x_rc, x_in) in enumerate(zip(batch_rc, batch_in)):
-            batch_scores.append(nn.MSELoss()(x_rc, x_in))
+        # Calculate individual novelty scores, one per image (or region)
+        batch_scores = losses.novelty_scores(batch_in, batch_rc, self.novelty_metric, self.channel_weights)
 
         results = {
             'scores': batch_scores,
@@ -0,0 +1,59 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+
+from pathlib import Path
+from utils import cache
+
+
+class TestArrayCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache = cache.ArrayCache(self.tmp_dir.name, 'preprocessed/test')
+        self.array = np.random.default_rng(0).random((4, 8, 3)).astype(np.float32)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_put_get_round_trip(self):
+        key = cache.fingerprint('image.jpeg')
+        self.assertIsNone(self.cache.get(key))
+        self.assertNotIn(key, self.cache)
+
+        self.cache.put(key, self.array)
+        self.assertIn(key, self.cache)
+        cached = self.cache.get(key)
+        self.assertEqual(cached.dtype, np.float32)
+        self.assertTrue(np.array_equal(cached, self.array))
+
+        # Cached arrays are copy-on-write, writing to them leaves the entry unchanged
+        cached[:] = 0
+        self.assertTrue(np.array_equal(self.cache.get(key), self.array))
+
+    def test_put_arrays_round_trip(self):
+        key = cache.fingerprint('index')
+        self.assertIsNone(self.cache.get_arrays(key))
+        self.cache.put_arrays(key, labels=np.arange(4), gt_bboxes=self.array[0])
+        arrays = self.cache.get_arrays(key)
+        self.assertTrue(np.array_equal(arrays['labels'], np.arange(4)))
+        self.assertTrue(np.array_equal(arrays['gt_bboxes'], self.array[0]))
+
+    def test_entries_are_versioned(self):
+        self.assertEqual(self.cache.path.parent.parent.name, f'v{cache.CACHE_VERSION}')
+
+    def test_changed_file_misses(self):
+        pth = Path(self.tmp_dir.name) / 'image.jpeg'
+        pth.write_bytes(b'frame')
+        self.cache.put(cache.file_fingerprint(pth), self.array)
+        self.assertIn(cache.file_fingerprint(pth), self.cache)
+
+        stat = os.stat(pth)
+        os.utime(pth, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+        self.assertNotIn(cache.file_fingerprint(pth), self.cache)
+        self.assertIsNone(self.cache.get(cache.file_fingerprint(pth)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import tempfile
+import unittest
+import numpy as np
+
+from pathlib import Path
+from datasets.curiosity import CuriosityDataset, pack_curiosity_dataset
+
+
+class TestPackedCuriosityData(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp_dir.name)
+        rng = np.random.default_rng(0)
+        for subdir, n_images in (('trainval/train_typical', 5), ('trainval/validation_typical', 2),
+                                 ('test/test_typical', 3), ('test/test_novel/all', 2)):
+            (self.root / subdir).mkdir(parents=True)
+            for i in range(n_images):
+                image = rng.integers(0, 4096, size=(8, 8, 6)).astype(np.uint16)
+                np.save(self.root / subdir / f'sample_{i}.npy', image)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_packed_samples_match_files(self):
+        pack_curiosity_dataset(str(self.root))
+
+        for train in (True, False):
+            files = CuriosityDataset(str(self.root), train=train)
+            packed = CuriosityDataset(str(self.root), train=train, packed=True)
+            self.assertEqual(len(packed), len(files))
+            self.assertTrue(np.array_equal(packed.get_labels(), files.get_labels()))
+            self.assertEqual(packed._list_of_image_paths, files._list_of_image_paths)
+            for idx in range(len(files)):
+                image, label = packed[idx]
+                expected_image, expected_label = files[idx]
+                self.assertEqual(image.dtype, np.float32)
+                self.assertTrue(np.array_equal(image, expected_image))
+                self.assertEqual(label, expected_label)
+
+        # The test split holds both typical and novel samples
+        self.assertEqual(sorted(set(packed.get_labels())), [0, 1])
+
+    def test_packed_split_is_a_view(self):
+        pack_curiosity_dataset(str(self.root))
+        images, labels = CuriosityDataset(str(self.root), train=True, packed=True).get_split()
+        self.assertIsInstance(images, np.memmap)
+        self.assertEqual(images.shape, (7, 8, 8, 6))
+        self.assertTrue(np.array_equal(labels, np.zeros(7)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import tempfile
+import unittest
+import numpy as np
+import torch
+
+from pathlib import Path
+from datasets import supported_datamodules
+from models import supported_models
+from models.cae_baseline import BaselineCAE
+from modules.cae_base_module import CAEBaseModule
+from modules.ensemble_scorer import EnsembleScorer, EnsembleResult
+from modules.novelty_scorer import NoveltyScorer
+from modules.pca_base_module import PCABaseModule
+from utils import supported_preprocessing_transforms
+
+
+class MeanScorer:
+    """Stand-in member scoring each image by its mean"""
+    def __init__(self):
+        self.n_calls = 0
+
+    def score(self, batch_in):
+        self.n_calls += 1
+        return batch_in.flatten(1).mean(dim=1).cpu().numpy()
+
+
+class TestEnsembleScorer(unittest.TestCase):
+
+    def test_single_pass_over_batches(self):
+        batches = [(torch.rand(4, 1, 8, 8), torch.tensor([0, 1, 0, 1])) for _ in range(3)]
+        members = {'a': MeanScorer(), 'b': MeanScorer()}
+        result = EnsembleScorer(members, device='cpu').run(
+            iter(batches), normalize_batch=lambda batch: (batch[0] * 2, batch[1]))
+
+        expected = np.concatenate([2 * images.flatten(1).mean(dim=1).numpy() for images, _ in batches])
+        self.assertEqual(len(result), 12)
+        self.assertTrue(np.allclose(result.scores['a'], expected))
+        self.assertTrue(np.array_equal(result.labels, np.array([0, 1, 0, 1] * 3)))
+        self.assertEqual([member.n_calls for member in members.values()], [3, 3])
+
+    def test_fusion(self):
+        result = EnsembleResult(
+            {'a': np.array([1., 2., 3., 4.]), 'b': np.array([40., 30., 20., 10.])}, np.array([0, 0, 1, 1]))
+        self.assertTrue(np.allclose(result.fuse('mean'), 0))
+        self.assertTrue(np.allclose(result.fuse('rank'), 0.5))
+        self.assertTrue(np.allclose(result.fuse('max'), np.abs(result.standardized('a'))))
+        with self.assertRaises(ValueError):
+            result.fuse('median')
+
+
+class TestEnsembleCatalog(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        generator = torch.Generator().manual_seed(0)
+        for split in ('trainval', 'test'):
+            images = torch.randint(0, 256, (40, 28, 28), dtype=torch.uint8, generator=generator)
+            torch.save((images, torch.arange(40) % 10), Path(self.tmp_dir.name) / f'{split}.pt')
+        self.datamodule = supported_datamodules['NoveltyMNISTDataModule'](
+            root_data_path=self.tmp_dir.name,
+            data_transforms=supported_preprocessing_transforms['NoveltyMNISTPreprocessing'],
+            batch_size=8)
+        self.datamodule.setup('test')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_members_score_like_standalone_modules(self):
+        # PCA is fitted on the raw split, the CAE on the normalized batches of the dataloaders
+        images, _ = self.datamodule.split(train=True)
+        pca_module = PCABaseModule(supported_models['StandardPCA'](n_components=4).fit(images.reshape(40, -1)))
+        torch.manual_seed(0)
+        cae_module = CAEBaseModule(BaselineCAE(torch.Size([1, 28, 28])))
+        catalog = {'StandardPCA': {'version_0': pca_module}, 'BaselineCAE': {'version_0': cae_module}}
+
+        result = EnsembleScorer.from_catalog(catalog, device='cpu').run(
+            self.datamodule.test_dataloader(), self.datamodule.on_after_batch_transfer, datamodule=self.datamodule)
+
+        pca_scores = pca_module.transform_pipeline(self.datamodule)
+        cae_scores, labels = NoveltyScorer(cae_module.model, device='cpu').score_dataloader(
+            self.datamodule.test_dataloader())
+        self.assertTrue(np.allclose(result.scores['StandardPCA/version_0'], pca_scores))
+        self.assertTrue(np.allclose(result.scores['BaselineCAE/version_0'], cae_scores, atol=1e-6))
+        self.assertTrue(np.array_equal(result.labels, labels))
+
+        standardized = [(scores - scores.mean()) / scores.std() for scores in (pca_scores, cae_scores)]
+        self.assertTrue(np.allclose(result.fuse('mean'), np.mean(standardized, axis=0), atol=1e-5))
+
+        with self.assertRaises(AssertionError):
+            EnsembleScorer.from_catalog(catalog, device='cpu').run(self.datamodule.test_dataloader())
+        # Without n_batches, a dataloader yielding fewer samples than the test split can't be aligned with it
+        first_batch = next(iter(self.datamodule.test_dataloader()))
+        with self.assertRaises(ValueError):
+            EnsembleScorer.from_catalog(catalog, device='cpu').run(iter([first_batch]), datamodule=self.datamodule)
+        result = EnsembleScorer.from_catalog(catalog, device='cpu').run(
+            iter([first_batch]), n_batches=1, datamodule=self.datamodule)
+        self.assertTrue(np.allclose(result.scores['StandardPCA/version_0'], pca_scores[:8]))
+
+
+if __name__ == '__main__':
+    unittest.main()
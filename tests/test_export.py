@@ -0,0 +1,76 @@
+import tempfile
+import unittest
+import torch
+import numpy as np
+
+from models.cae_baseline import BaselineCAE
+from models.vae import SimpleVAE
+from modules.novelty_scorer import NoveltyScorer
+from utils import export
+
+
+class TestExport(unittest.TestCase):
+
+    def setUp(self):
+        torch.manual_seed(0)
+        self.model = BaselineCAE(torch.Size([3, 64, 64]))
+        # Non-trivial batch-norm statistics, so that folding is actually exercised
+        for module in self.model.modules():
+            if isinstance(module, torch.nn.BatchNorm2d):
+                module.running_mean.uniform_(-1, 1)
+                module.running_var.uniform_(0.5, 2)
+        self.model.eval()
+        self.batch = torch.rand(3, 3, 64, 64)
+
+    def test_prepare_for_inference(self):
+        prepared = export.prepare_for_inference(self.model)
+        self.assertFalse(any(isinstance(m, (torch.nn.BatchNorm2d, torch.nn.Dropout2d)) for m in prepared.modules()))
+        with torch.no_grad():
+            self.assertTrue(torch.allclose(prepared(self.batch), self.model(self.batch), atol=1e-5))
+
+    def test_torchscript_roundtrip(self):
+        with tempfile.TemporaryDirectory() as export_dir:
+            (path,) = export.export_model(self.model, (3, 64, 64), export_dir, 'cae', formats=('torchscript',))
+            exported = export.load_exported(path)
+            self.assertEqual(export.load_export_metadata(path)['in_shape'], [3, 64, 64])
+
+        with torch.no_grad():
+            # The batch dim of the traced graph is dynamic
+            self.assertEqual(exported(torch.rand(5, 3, 64, 64)).shape, (5, 3, 64, 64))
+            self.assertTrue(torch.allclose(exported(self.batch), self.model(self.batch), atol=1e-5))
+
+    def test_scorer_from_export(self):
+        scorer = NoveltyScorer(self.model, novelty_metric='mse', device='cpu')
+        with tempfile.TemporaryDirectory() as export_dir:
+            (path,) = export.export_model(
+                self.model, (3, 64, 64), export_dir, 'cae', formats=('torchscript',),
+                metadata=scorer.export_metadata())
+            exported_scorer = NoveltyScorer.from_export(path)
+
+        self.assertEqual(exported_scorer.in_shape, (3, 64, 64))
+        self.assertEqual(exported_scorer.novelty_metric, 'mse')
+        scores, maps = exported_scorer(self.batch, return_maps=True, normalized=True)
+        expected_scores, expected_maps = scorer(self.batch, return_maps=True, normalized=True)
+        self.assertEqual(scores.shape, (3,))
+        self.assertTrue(np.allclose(scores, expected_scores, atol=1e-5))
+        self.assertTrue(np.allclose(maps, expected_maps, atol=1e-5))
+
+    def test_variational_reconstruction_roundtrip(self):
+        torch.manual_seed(0)
+        model = SimpleVAE(torch.Size([3, 64, 64]), latent_nodes=16).eval()
+        with torch.no_grad():
+            mu, _ = model.encode(self.batch)
+            expected = model.decode(mu)
+
+        with tempfile.TemporaryDirectory() as export_dir:
+            (path,) = export.export_model(model, (3, 64, 64), export_dir, 'vae', formats=('torchscript',))
+            exported = export.load_exported(path)
+
+        with torch.no_grad():
+            # The mean of q(z|x) is decoded, so the exported reconstruction is deterministic
+            self.assertTrue(torch.allclose(exported(self.batch), expected, atol=1e-5))
+            self.assertTrue(torch.allclose(exported(self.batch), exported(self.batch)))
+
+
+if __name__ == '__main__':
+    unittest.main()
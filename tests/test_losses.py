@@ -0,0 +1,39 @@
+import unittest
+import torch
+import torch.nn as nn
+
+from utils import losses
+
+
+class TestNoveltyScores(unittest.TestCase):
+
+    def setUp(self):
+        torch.manual_seed(0)
+        self.x = torch.rand(8, 3, 16, 16)
+        self.x_hat = torch.rand(8, 3, 16, 16)
+
+    def test_mse_matches_per_image_loss(self):
+        expected = torch.stack([nn.MSELoss()(x_rc, x_in) for x_rc, x_in in zip(self.x_hat, self.x)])
+        scores = losses.novelty_scores(self.x, self.x_hat)
+        self.assertEqual(scores.shape, (8,))
+        self.assertTrue(torch.allclose(scores, expected, atol=1e-6))
+
+    def test_l1_matches_per_image_loss(self):
+        expected = torch.stack([nn.L1Loss()(x_rc, x_in) for x_rc, x_in in zip(self.x_hat, self.x)])
+        self.assertTrue(torch.allclose(losses.novelty_scores(self.x, self.x_hat, 'l1'), expected, atol=1e-6))
+
+    def test_channel_weights(self):
+        # Equal weights leave the scores unchanged, a single non-zero weight scores only that channel
+        unweighted = losses.novelty_scores(self.x, self.x_hat)
+        self.assertTrue(torch.allclose(losses.novelty_scores(self.x, self.x_hat, channel_weights=[2, 2, 2]), unweighted))
+        only_first = losses.novelty_scores(self.x, self.x_hat, channel_weights=[1, 0, 0])
+        expected = losses.novelty_scores(self.x[:, :1], self.x_hat[:, :1])
+        self.assertTrue(torch.allclose(only_first, expected, atol=1e-6))
+
+    def test_unknown_metric(self):
+        with self.assertRaises(ValueError):
+            losses.novelty_scores(self.x, self.x_hat, 'ssim')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,11 +1,16 @@
+import json
+import os
+import tempfile
 import unittest
 import torch
+import cv2 as cv
 import numpy as np
 
 from os import path
+from pathlib import Path
 from utils import tools, supported_preprocessing_transforms
 from datasets import supported_datamodules
-from datasets.lunar_analogue import LunarAnalogueDataset
+from datasets.lunar_analogue import LunarAnalogueDataset, LunarAnalogueStream, LunarAnalogueDataGenerator
 
 
 class TestLunarAnalogueData(unittest.TestCase):
@@ -59,5 +64,123 @@ class TestLunarAnalogueData(unittest.TestCase):
         self.assertEqual(labels['cr_bboxes'].shape, (batch_size, 16, 4))
 
 
+def write_frames(directory: Path, names, seed: int = 0):
+    directory.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    for name in names:
+        cv.imwrite(str(directory / name), rng.integers(0, 256, size=(32, 48, 3)).astype(np.uint8))
+
+
+class TestLunarAnalogueDataset(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp_dir.name) / 'data'
+        write_frames(self.root / 'test' / 'typical', ['img0_left.jpeg', 'img1_left.jpeg'])
+        write_frames(self.root / 'test' / 'novel', ['img2_left.jpeg'])
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_whole_image_needs_no_bboxes(self):
+        ds = LunarAnalogueDataset(str(self.root), 'test/**/*.jpeg', train=False)
+        self.assertEqual(sorted(ds.labels), [0, 0, 1])
+        image, label = ds[int(np.flatnonzero(ds.labels)[0])]
+        self.assertEqual(image.shape, (32, 48, 3))
+        self.assertEqual(label, 1)
+
+    def test_gt_bbox_index_follows_annotations(self):
+        bbox_path = self.root / 'test' / 'bbox' / 'img2_left.json'
+        bbox_path.parent.mkdir()
+        cache_dir = str(Path(self.tmp_dir.name) / 'cache')
+        ds = LunarAnalogueDataset(str(self.root), 'test/**/*.jpeg', train=False)
+        novel_idx = int(np.flatnonzero(ds.labels)[0])
+
+        for bbox in ([10, 20, 30, 40], [1, 2, 3, 4]):
+            with open(bbox_path, 'w') as f:
+                json.dump([dict(zip('yxhw', bbox))], f)
+            # Editing an annotation changes its mtime, which invalidates the persisted index
+            os.utime(bbox_path, ns=(0, bbox[0] * 1_000_000_000))
+            gt_bboxes = ds._load_gt_bbox_index(str(self.root), 'test/**/*.jpeg', cache_dir)
+            self.assertEqual(list(gt_bboxes[novel_idx]), bbox)
+            self.assertEqual(np.count_nonzero(gt_bboxes), 4)
+
+
+class TestLunarAnalogueDataGenerator(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp_dir.name) / 'data'
+        write_frames(self.root / 'train', [f'img{i}_left.jpeg' for i in range(7)])
+        write_frames(self.root / 'test' / 'typical', ['img7_left.jpeg', 'img8_left.jpeg'])
+        write_frames(self.root / 'test' / 'novel', ['img9_left.jpeg'])
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def generator(self, prefetch_batches: int) -> LunarAnalogueDataGenerator:
+        return LunarAnalogueDataGenerator(
+            str(self.root), 'train/*.jpeg', 'test/**/*.jpeg',
+            batch_size=2, train_fraction=0.8, num_workers=2, prefetch_batches=prefetch_batches)
+
+    def test_batches_match_samples(self):
+        for prefetch_batches in (1, 3):
+            generator = self.generator(prefetch_batches)
+            for stage, n_batches in (('train', 2), ('val', 1)):
+                batches = list(generator.trainval_generator(stage))
+                idxs = generator._train_idxs if stage == 'train' else generator._val_idxs
+                # The split is contiguous and a trailing partial batch is dropped
+                self.assertTrue(np.array_equal(np.concatenate([generator._train_idxs, generator._val_idxs]),
+                                               np.arange(7)))
+                self.assertEqual(len(batches), n_batches)
+                for batch_nb, batch in enumerate(batches):
+                    self.assertEqual(batch.dtype, np.float32)
+                    expected = [generator._trainval_set[idx][0] for idx in idxs[2 * batch_nb: 2 * batch_nb + 2]]
+                    self.assertTrue(np.array_equal(batch, np.stack(expected)))
+
+    def test_unknown_parameters_are_rejected(self):
+        with self.assertRaises(TypeError):
+            LunarAnalogueDataGenerator(
+                str(self.root), 'train/*.jpeg', 'test/**/*.jpeg', prefetch_batchs=4)
+
+    def test_test_batches_carry_labels(self):
+        generator = self.generator(prefetch_batches=2)
+        batches = list(generator.test_generator())
+        self.assertEqual(len(batches), 1)
+        images, labels = batches[0]
+        self.assertEqual(labels.dtype, np.int64)
+        self.assertTrue(np.array_equal(labels, generator._test_set.labels[:2]))
+        self.assertTrue(np.array_equal(images, np.stack([generator._test_set[i][0] for i in range(2)])))
+
+
+class TestLunarAnalogueStream(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.source = Path(self.tmp_dir.name) / 'typical'
+        write_frames(self.source, ['img2_left.jpeg', 'img0_left.jpeg', 'img1_left.jpeg', 'img1_right.jpeg'])
+        # A frame that is still being written
+        (self.source / 'img3_left.jpeg').touch()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_tail_yields_complete_frames_once_in_order(self):
+        stream = LunarAnalogueStream(str(self.source), follow=False, poll_interval=0.01)
+        samples = list(stream)
+        self.assertEqual(len(samples), 3)
+        for (image, label), name in zip(samples, ['img0_left.jpeg', 'img1_left.jpeg', 'img2_left.jpeg']):
+            self.assertTrue(np.array_equal(image, cv.imread(str(self.source / name))[..., ::-1]))
+            self.assertEqual(label, 0)
+
+    def test_tail_splits_frames_across_workers(self):
+        stream = LunarAnalogueStream(str(self.source), follow=False, poll_interval=0.01)
+        frames = [list(stream._tail_directory(worker_id, 2)) for worker_id in range(2)]
+        # Every worker sees the same frames, and each frame is decoded by exactly one of them
+        self.assertEqual([name for name, _ in frames[0]], [name for name, _ in frames[1]])
+        for (_, image0), (_, image1) in zip(*frames):
+            self.assertTrue((image0 is None) != (image1 is None))
+
+
 if __name__ == '__main__':
     unittest.main()
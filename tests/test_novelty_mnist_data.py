@@ -1,9 +1,15 @@
+import io
+import tempfile
 import unittest
 import torch
+import numpy as np
 
 from pathlib import Path
 from utils import tools, supported_preprocessing_transforms
 from datasets import supported_datamodules
+from contextlib import redirect_stdout
+from torch.utils.data.dataloader import default_collate
+from datasets.novelty_mnist import NoveltyMNISTDataset
 from models.cae_baseline import BaselineCAE
 
 
@@ -65,5 +71,83 @@ class TestNoveltyMNISTData(unittest.TestCase):
     # TODO: Write test for other models (AAE, VAE, PCA)
 
 
+class TestNoveltyMNISTDataset(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        generator = torch.Generator().manual_seed(0)
+        images = torch.randint(0, 256, (50, 28, 28), dtype=torch.uint8, generator=generator)
+        class_labels = torch.arange(50) % 10
+        for split in ('trainval', 'test'):
+            torch.save((images, class_labels), Path(self.tmp_dir.name) / f'{split}.pt')
+        self.transforms = supported_preprocessing_transforms['NoveltyMNISTPreprocessing']
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_get_split_matches_samples(self):
+        ds = NoveltyMNISTDataset(self.tmp_dir.name, data_transforms=self.transforms)
+        ds.SPLIT_CHUNK_SIZE = 16
+        expected = torch.stack([ds[idx][0] for idx in range(len(ds))]).numpy()
+
+        images, labels = ds.get_split()
+        self.assertTrue(np.allclose(images, expected, atol=1e-6))
+        self.assertTrue(np.array_equal(labels, [ds.get_label(idx) for idx in range(len(ds))]))
+
+        mmap_images, _ = ds.get_split(mmap_path=str(Path(self.tmp_dir.name) / 'trainval_split.npy'))
+        self.assertIsInstance(mmap_images, np.memmap)
+        self.assertTrue(np.array_equal(mmap_images, images))
+
+    def test_get_batch_matches_collated_samples(self):
+        ds = NoveltyMNISTDataset(self.tmp_dir.name, data_transforms=self.transforms)
+        idxs = [7, 0, 31, 12]
+        images, labels = ds.get_batch(idxs)
+        expected_images, expected_labels = default_collate([ds[idx] for idx in idxs])
+        self.assertEqual(images.shape, (4, 1, 28, 28))
+        self.assertTrue(torch.allclose(images, expected_images, atol=1e-6))
+        self.assertTrue(torch.equal(labels, expected_labels))
+
+    def test_in_memory_batches_shuffle_train_only(self):
+        dm = supported_datamodules['NoveltyMNISTDataModule'](
+            root_data_path=self.tmp_dir.name, data_transforms=self.transforms, batch_size=4, in_memory_batches=True)
+        dm.setup('train')
+        train_sampler = dm.train_dataloader().sampler
+        self.assertIsInstance(train_sampler.sampler, torch.utils.data.RandomSampler)
+        self.assertIsInstance(dm.val_dataloader().sampler.sampler, torch.utils.data.SequentialSampler)
+
+        torch.manual_seed(0)
+        train_idxs = np.concatenate(list(train_sampler))
+        self.assertEqual(sorted(train_idxs), list(range(dm.train_size)))
+        self.assertNotEqual(list(train_idxs), list(range(dm.train_size)))
+
+    def test_dataloader_options(self):
+        dm = supported_datamodules['NoveltyMNISTDataModule'](
+            root_data_path=self.tmp_dir.name, data_transforms=self.transforms, batch_size=4, in_memory_batches=False,
+            num_workers=2, pin_memory=False, prefetch_factor=3)
+        dm.setup('train')
+        loader = dm.train_dataloader()
+        self.assertEqual((loader.num_workers, loader.pin_memory, loader.prefetch_factor), (2, False, 3))
+        self.assertTrue(loader.persistent_workers)
+
+        with self.assertRaises(AssertionError):
+            supported_datamodules['NoveltyMNISTDataModule'](
+                root_data_path=self.tmp_dir.name, data_transforms=self.transforms, num_workers=0,
+                persistent_workers=True)
+
+    def test_report_throughput(self):
+        dm = supported_datamodules['NoveltyMNISTDataModule'](
+            root_data_path=self.tmp_dir.name, data_transforms=self.transforms, batch_size=4, num_workers=0,
+            report_throughput=True)
+        output = io.StringIO()
+        with redirect_stdout(output):
+            dm.setup('train')
+        lines = output.getvalue().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[0].startswith('NoveltyMNISTDataModule train loader: '))
+        self.assertIn('(40 samples, num_workers=0)', lines[0])
+        self.assertTrue(lines[1].startswith('NoveltyMNISTDataModule val loader: '))
+        self.assertIn('samples/sec', lines[1])
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,35 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+import torch
+
+from models.cae_baseline import BaselineCAE
+from modules.cae_base_module import CAEBaseModule
+from modules.novelty_scorer import NoveltyScorer
+
+
+class TestNoveltyScorer(unittest.TestCase):
+
+    def setUp(self):
+        torch.manual_seed(0)
+        self.module = CAEBaseModule(BaselineCAE(torch.Size([3, 64, 64]))).eval()
+        self.batch = torch.rand(4, 3, 64, 64)
+
+    def test_scores_match_test_step(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            ckpt_path = os.path.join(tmp_dir, 'val_loss.ckpt')
+            torch.save({'state_dict': self.module.state_dict()}, ckpt_path)
+            scorer = NoveltyScorer.from_checkpoint(BaselineCAE(torch.Size([3, 64, 64])), ckpt_path, device='cpu')
+
+        expected = self.module.test_step((self.batch, torch.zeros(4)), 0)['scores'].detach().numpy()
+        scores, maps = scorer(self.batch.numpy(), return_maps=True)
+
+        self.assertFalse(scorer.model.training)
+        self.assertTrue(np.allclose(scores, expected, atol=1e-6))
+        self.assertEqual(maps.shape, (4, 3, 64, 64))
+        self.assertTrue(np.allclose(maps.mean(axis=(1, 2, 3)), scores, atol=1e-6))
+
+
+if __name__ == '__main__':
+    unittest.main()
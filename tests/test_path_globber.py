@@ -0,0 +1,64 @@
+import os
+import tempfile
+import unittest
+
+from pathlib import Path
+from unittest import mock
+from utils.tools import PathGlobber
+
+
+class TestPathGlobber(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp_dir.name) / 'data'
+        self.cache_dir = str(Path(self.tmp_dir.name) / 'cache')
+        for name in ('trainval/typical/img0.jpeg', 'trainval/typical/sub/img1.jpeg', 'trainval/img2.jpeg',
+                     'trainval/notes.txt', 'test/novel/img3.jpeg'):
+            self.touch(name)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def touch(self, name: str):
+        pth = self.root / name
+        pth.parent.mkdir(parents=True, exist_ok=True)
+        pth.write_bytes(b'')
+
+    def test_matches_path_glob(self):
+        for pattern in ('trainval/**/*.jpeg', 'test/*/*.jpeg', '**/*.txt', 'trainval/*'):
+            expected = list(self.root.glob(pattern))
+            self.assertEqual(PathGlobber(str(self.root), cache_dir=self.cache_dir).glob(pattern), expected)
+            # Then from the manifest
+            self.assertEqual(PathGlobber(str(self.root), cache_dir=self.cache_dir).glob(pattern), expected)
+
+    def test_fresh_manifest_is_reused(self):
+        paths = PathGlobber(str(self.root), cache_dir=self.cache_dir).glob('trainval/**/*.jpeg')
+
+        globber = PathGlobber(str(self.root), cache_dir=self.cache_dir)
+        with mock.patch.object(globber, '_scan', side_effect=AssertionError('The directories were scanned')):
+            self.assertEqual(globber.glob('trainval/**/*.jpeg'), paths)
+
+    def test_added_file_invalidates_manifest(self):
+        globber = PathGlobber(str(self.root), cache_dir=self.cache_dir)
+        self.assertEqual(len(globber.glob('trainval/**/*.jpeg')), 3)
+
+        self.touch('trainval/typical/sub/img4.jpeg')
+        # Directory mtimes can have a coarse resolution, so make sure the change is visible
+        sub_dir = self.root / 'trainval/typical/sub'
+        os.utime(sub_dir, ns=(0, os.stat(sub_dir).st_mtime_ns + 1_000_000_000))
+
+        paths = globber.glob('trainval/**/*.jpeg')
+        self.assertEqual(len(paths), 4)
+        self.assertIn(self.root / 'trainval/typical/sub/img4.jpeg', paths)
+
+    def test_created_base_invalidates_manifest(self):
+        globber = PathGlobber(str(self.root), cache_dir=self.cache_dir)
+        self.assertEqual(globber.glob('val/*.jpeg'), [])
+        self.touch('val/img5.jpeg')
+        os.utime(self.root, ns=(0, os.stat(self.root).st_mtime_ns + 1_000_000_000))
+        self.assertEqual(globber.glob('val/*.jpeg'), [self.root / 'val/img5.jpeg'])
+
+
+if __name__ == '__main__':
+    unittest.main()
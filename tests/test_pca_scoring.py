@@ -0,0 +1,138 @@
+import pickle
+import subprocess
+import sys
+import tempfile
+import unittest
+import torch
+import yaml
+import numpy as np
+
+from pathlib import Path
+from datasets import supported_datamodules
+from models import supported_models
+from models.pca import load_archived_pca, load_pca, save_pca
+from modules.pca_base_module import PCABaseModule
+from utils import supported_preprocessing_transforms
+
+
+class TestPCAScoring(unittest.TestCase):
+
+    def setUp(self):
+        self.images = np.random.default_rng(0).random((64, 3, 8, 8)).astype(np.float32)
+        self.flat = self.images.reshape(len(self.images), -1)
+
+    def test_scores_match_reconstruction_error(self):
+        for name in ('StandardPCA', 'IncrementalPCA'):
+            model = supported_models[name](n_components=8).fit(self.flat)
+            reconstructions = model.inverse_transform(model.transform(self.flat))
+            expected = np.mean((self.flat - reconstructions) ** 2, axis=1)
+
+            scores, maps = PCABaseModule(model).score(self.images, return_maps=True)
+            self.assertTrue(np.allclose(scores, expected, rtol=1e-4, atol=1e-7))
+            self.assertEqual(maps.shape, self.images.shape)
+            self.assertTrue(np.allclose(maps.mean(axis=(1, 2, 3)), expected, rtol=1e-4, atol=1e-7))
+
+    def test_randomized_pca_matches_standard_pca(self):
+        # Like images, the data has a decaying spectrum, which is where a randomized SVD is accurate
+        rng = np.random.default_rng(0)
+        scales = np.geomspace(10, 0.01, 16)[:, None]
+        flat = (rng.standard_normal((64, 16)) @ (scales * rng.standard_normal((16, 192)))).astype(np.float32)
+        images = flat.reshape(64, 3, 8, 8)
+
+        standard = supported_models['StandardPCA'](n_components=8).fit(flat)
+        randomized = supported_models['RandomizedPCA'](n_components=8).fit(flat)
+        self.assertTrue(np.allclose(randomized.explained_variance_, standard.explained_variance_, rtol=1e-3))
+
+        # Incremental fits only approximate the batch fit, so partial_fit is compared to IncrementalPCA's
+        incremental = supported_models['RandomizedPCA'](n_components=8)
+        reference = supported_models['IncrementalPCA'](n_components=8)
+        for start in range(0, len(flat), 16):
+            incremental.partial_fit(flat[start:start + 16])
+            reference.partial_fit(flat[start:start + 16])
+        self.assertTrue(np.allclose(incremental.mean_, standard.mean_, atol=1e-5))
+
+        # Scores only depend on the spanned subspace, not on the sign or order of the components
+        expected = PCABaseModule(standard).score(images)
+        self.assertTrue(np.allclose(PCABaseModule(randomized).score(images), expected, rtol=1e-2, atol=1e-6))
+        self.assertTrue(np.allclose(
+            PCABaseModule(incremental).score(images), PCABaseModule(reference).score(images), rtol=1e-2, atol=1e-6))
+
+    def test_saved_pca_scores_like_fitted_pca(self):
+        for name in ('StandardPCA', 'IncrementalPCA', 'RandomizedPCA'):
+            model = supported_models[name](n_components=8).fit(self.flat)
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                save_pca(model, tmp_dir)
+                loaded = load_pca(tmp_dir)
+
+                self.assertIsInstance(loaded.components_, np.memmap)
+                self.assertEqual(loaded.components_.dtype, np.float32)
+                self.assertEqual(loaded.n_components_, 8)
+                self.assertEqual(loaded.n_samples_seen_, 64)
+                self.assertTrue(np.allclose(
+                    PCABaseModule(loaded).score(self.images), PCABaseModule(model).score(self.images),
+                    rtol=1e-4, atol=1e-7))
+                self.assertTrue(np.allclose(
+                    loaded.inverse_transform(loaded.transform(self.flat)),
+                    model.inverse_transform(model.transform(self.flat)), atol=1e-5))
+                del loaded
+
+    def test_sklearn_pca_does_not_import_torch(self):
+        code = ("import sys; from models import supported_models; supported_models['StandardPCA']; "
+                "supported_models['IncrementalPCA']; print('torch' in sys.modules)")
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+        self.assertEqual(output.strip(), 'False')
+
+    def test_archived_pca_falls_back_to_pickle(self):
+        model = supported_models['StandardPCA'](n_components=8).fit(self.flat)
+        expected = PCABaseModule(model).score(self.images)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # Runs archived before save_pca only have the pickled estimator
+            with open(Path(tmp_dir) / 'fitted_model.p', 'wb') as f:
+                pickle.dump(model, f)
+            self.assertTrue(np.allclose(PCABaseModule(load_archived_pca(tmp_dir)).score(self.images), expected))
+
+            save_pca(model, Path(tmp_dir) / 'fitted_model')
+            loaded = load_archived_pca(tmp_dir)
+            self.assertIsInstance(loaded.components_, np.memmap)
+            self.assertTrue(np.allclose(PCABaseModule(loaded).score(self.images), expected, rtol=1e-4, atol=1e-7))
+            del loaded
+
+    def test_configs_name_supported_preprocessing(self):
+        for config_path in sorted(Path('configs/pca').glob('*.yaml')):
+            with open(config_path, 'r') as f:
+                data_params = yaml.full_load(f)['data-parameters']
+            self.assertIn(data_params['preprocessing'], supported_preprocessing_transforms)
+
+
+class TestPCAChunkedFit(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        generator = torch.Generator().manual_seed(0)
+        for split in ('trainval', 'test'):
+            images = torch.randint(0, 256, (50, 28, 28), dtype=torch.uint8, generator=generator)
+            torch.save((images, torch.arange(50) % 10), Path(self.tmp_dir.name) / f'{split}.pt')
+        self.datamodule = supported_datamodules['NoveltyMNISTDataModule'](
+            root_data_path=self.tmp_dir.name, data_transforms=lambda image: image)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_chunked_fit_matches_incremental_pca(self):
+        images, _ = self.datamodule.split(train=True)
+        flat = images.reshape(len(images), -1)
+        reference = supported_models['IncrementalPCA'](n_components=5)
+        for start in range(0, len(flat), 10):
+            reference.partial_fit(flat[start:start + 10])
+        whole = PCABaseModule(reference).transform_pipeline(self.datamodule)
+
+        for mmap_dir in (None, str(Path(self.tmp_dir.name) / 'mmap')):
+            module = PCABaseModule(supported_models['IncrementalPCA'](n_components=5), chunk_size=10, mmap_dir=mmap_dir)
+            module.fit_pipeline(self.datamodule)
+            self.assertTrue(np.allclose(module.model.mean_, reference.mean_))
+            self.assertTrue(np.allclose(module.model.components_, reference.components_, atol=1e-6))
+            self.assertTrue(np.allclose(module.transform_pipeline(self.datamodule), whole, rtol=1e-5))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import unittest
+import torch
+import cv2 as cv
+import numpy as np
+
+from utils import preprocessing
+
+
+class TestDeferredNormalization(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.curiosity_images = rng.integers(0, 4096, size=(4, 64, 64, 6)).astype(np.uint16)
+        self.mnist_images = torch.from_numpy(rng.integers(0, 256, size=(4, 1, 28, 28)).astype(np.uint8))
+
+    def test_curiosity_deferred_matches_per_image(self):
+        eager = preprocessing.CuriosityPreprocessingPipeline()
+        deferred = preprocessing.CuriosityPreprocessingPipeline(defer_normalization=True)
+
+        expected = np.stack([eager(image) for image in self.curiosity_images]).transpose(0, 3, 1, 2)
+        raw = torch.stack([preprocessing.ToTensorRaw()(deferred(image)) for image in self.curiosity_images])
+        result = deferred.normalize_batch(raw)
+
+        self.assertEqual(result.dtype, torch.float32)
+        self.assertTrue(np.allclose(result.numpy(), expected, atol=1e-5))
+
+    def test_mnist_deferred_keeps_uint8(self):
+        eager = preprocessing.NoveltyMNISTPreprocessingPipeline()
+        deferred = preprocessing.NoveltyMNISTPreprocessingPipeline(defer_normalization=True)
+
+        raw = torch.stack([deferred(image) for image in self.mnist_images])
+        self.assertEqual(raw.dtype, torch.uint8)
+
+        expected = torch.stack([eager(image) for image in self.mnist_images])
+        self.assertTrue(torch.allclose(deferred.normalize_batch(raw), expected, atol=1e-5))
+
+    def test_apply_batched_normalizes_deferred_pipelines(self):
+        eager = preprocessing.Compose([preprocessing.CuriosityPreprocessingPipeline(), preprocessing.ToTensor()])
+        deferred = preprocessing.Compose([
+            preprocessing.CuriosityPreprocessingPipeline(defer_normalization=True),
+            preprocessing.ToTensorRaw()
+        ])
+        self.assertTrue(np.allclose(
+            preprocessing.apply_batched(eager, self.curiosity_images),
+            preprocessing.apply_batched(deferred, self.curiosity_images),
+            atol=1e-5))
+
+    def test_apply_batched_matches_per_image(self):
+        curiosity = preprocessing.Compose([preprocessing.CuriosityPreprocessingPipeline(), preprocessing.ToTensor()])
+        expected = torch.stack([curiosity(image) for image in self.curiosity_images])
+        self.assertTrue(np.allclose(
+            preprocessing.apply_batched(curiosity, self.curiosity_images), expected.numpy(), atol=1e-5))
+
+        mnist = preprocessing.NoveltyMNISTPreprocessingPipeline()
+        expected = torch.stack([mnist(image) for image in self.mnist_images])
+        self.assertTrue(np.allclose(
+            np.asarray(preprocessing.apply_batched(mnist, self.mnist_images)), expected.numpy(), atol=1e-5))
+
+
+class TestRegionCrops(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.image = cv.GaussianBlur(rng.random((160, 240, 3)).astype(np.float32), (5, 5), 0)
+        # Upscaled, downscaled and same size boxes
+        self.crop_bboxes = np.array([[10, 20, 40, 30], [100, 50, 64, 64], [0, 0, 200, 150], [30, 40, 17, 90]], float)
+
+    def test_crops_match_cv_resize(self):
+        crops = preprocessing.RegionProposal(return_tensor=False).crop(self.image, self.crop_bboxes)
+        self.assertEqual(crops.dtype, np.float32)
+        for crop, (x, y, w, h) in zip(crops, self.crop_bboxes.astype(int)):
+            expected = cv.resize(self.image[y:y + h, x:x + w], (64, 64), interpolation=cv.INTER_CUBIC)
+            self.assertTrue(np.array_equal(crop, expected))
+
+        tensor_crops = preprocessing.RegionProposal().crop(self.image, self.crop_bboxes)
+        self.assertEqual(tensor_crops.dtype, torch.float32)
+        self.assertEqual(tensor_crops.shape, (4, 3, 64, 64))
+        self.assertTrue(tensor_crops.is_contiguous())
+        self.assertTrue(torch.equal(tensor_crops, torch.from_numpy(crops).permute(0, 3, 1, 2)))
+
+    def test_non_square_regions(self):
+        # region_shape is (width, height, channels), like the dsize of cv.resize
+        proposer = preprocessing.RegionProposal(region_shape=(48, 32, 3))
+        tensor_crops = proposer.crop(self.image, self.crop_bboxes)
+        self.assertEqual(tensor_crops.shape, (4, 3, 32, 48))
+        x, y, w, h = self.crop_bboxes[0].astype(int)
+        expected = cv.resize(self.image[y:y + h, x:x + w], (48, 32), interpolation=cv.INTER_CUBIC)
+        self.assertTrue(np.array_equal(tensor_crops[0].permute(1, 2, 0).numpy(), expected))
+
+        batched = preprocessing.with_batched_crops(proposer).transforms[0].crop(self.image, self.crop_bboxes)
+        self.assertEqual(batched.shape, (4, 3, 32, 48))
+
+    def test_batched_crops_match_away_from_box_edges(self):
+        crops = preprocessing.RegionProposal(return_tensor=False).crop(self.image, self.crop_bboxes)
+        batched = preprocessing.RegionProposal(return_tensor=False, batched_crops=True).crop(
+            self.image, self.crop_bboxes)
+        self.assertEqual(batched.dtype, np.float32)
+        self.assertEqual(batched.shape, crops.shape)
+
+        for crop, batched_crop, (_, _, w, h) in zip(crops, batched, self.crop_bboxes):
+            # Output pixels whose 4x4 bicubic kernel lies within the box, where both warps read the same pixels
+            def interior(size):
+                src = np.floor((np.arange(64) + 0.5) * size / 64 - 0.5)
+                return (src - 1 >= 0) & (src + 2 <= size - 1)
+            mask = interior(h)[:, None] & interior(w)[None, :]
+            self.assertTrue(mask.any())
+            self.assertTrue(np.allclose(batched_crop[mask], crop[mask], atol=1e-5))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+import os
+import pickle
+import subprocess
+import sys
+import tempfile
+import unittest
+import cv2 as cv
+import numpy as np
+
+from pathlib import Path
+from utils import proposals, supported_preprocessing_transforms
+from utils.preprocessing import RegionProposal, RegionProposalBING, RegionProposalSS, with_region_clustering
+from datasets.lunar_analogue import LunarAnalogueDataset
+
+
+def synthetic_terrain(seed: int = 0, shape: tuple = (160, 240, 3)) -> np.ndarray:
+    """A flat background with overlapping discs of random colours, which gives plenty of region proposals"""
+    rng = np.random.default_rng(seed)
+    image = np.full(shape, 90, dtype=np.uint8)
+    for _ in range(25):
+        centre = (int(rng.integers(0, shape[1])), int(rng.integers(0, shape[0])))
+        cv.circle(image, centre, int(rng.integers(4, 30)), tuple(int(v) for v in rng.integers(0, 255, 3)), -1)
+    return image
+
+
+class TestProposalStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp_dir.name) / 'data'
+        (self.root / 'test' / 'typical').mkdir(parents=True)
+        self.paths = []
+        for i in range(3):
+            self.paths.append(self.root / 'test' / 'typical' / f'img{i}_left.jpeg')
+            # The preprocessing scales images down by 5 before proposing regions
+            cv.imwrite(str(self.paths[-1]), cv.resize(synthetic_terrain(seed=i), None, fx=5, fy=5))
+        self.cache_dir = str(Path(self.tmp_dir.name) / 'cache')
+        self.transforms = supported_preprocessing_transforms['LunarAnalogueRegionProposalBING']
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_pickled_proposer_is_rebuilt(self):
+        proposer = RegionProposalBING()
+        unpickled = pickle.loads(pickle.dumps(proposer))
+        self.assertEqual(repr(unpickled), repr(proposer))
+        image = synthetic_terrain()
+        self.assertTrue(np.array_equal(unpickled.propose(image), proposer.propose(image)))
+
+    def test_put_get(self):
+        store = proposals.ProposalStore(self.cache_dir, self.transforms)
+        crop_bboxes = np.arange(64, dtype=np.float64).reshape(16, 4)
+        self.assertNotIn(self.paths[0], store)
+        self.assertIsNone(store.get(self.paths[0]))
+
+        store.put(self.paths[0], crop_bboxes)
+        self.assertIn(self.paths[0], store)
+        self.assertTrue(np.array_equal(store.get(self.paths[0]), crop_bboxes))
+
+        # Proposals of other proposer parameters are kept apart
+        other = proposals.ProposalStore(
+            self.cache_dir, proposals.Compose([RegionProposalBING(n_regions=8)]))
+        self.assertNotIn(self.paths[0], other)
+
+    def test_executor_fills_store(self):
+        executor = proposals.RegionProposalExecutor(self.transforms, self.cache_dir, max_workers=2, max_in_flight=2)
+        self.assertEqual(executor.run(self.paths), 3)
+        # Stored images are skipped unless overwritten
+        self.assertEqual(executor.run(self.paths), 0)
+        self.assertEqual(executor.run(self.paths[:1], overwrite=True), 1)
+
+        preprocessing_transforms, proposer = proposals.split_proposer(self.transforms)
+        for pth in self.paths:
+            expected = proposer.propose(preprocessing_transforms(cv.cvtColor(cv.imread(str(pth)), cv.COLOR_BGR2RGB)))
+            self.assertTrue(np.array_equal(executor.store.get(pth), expected))
+
+    def test_command_line(self):
+        result = subprocess.run(
+            [sys.executable, '-m', 'utils.proposals', str(self.root), 'test/**/*.jpeg', self.cache_dir,
+             'LunarAnalogueRegionProposalBING', '1'],
+            capture_output=True, text=True, cwd=Path(__file__).resolve().parents[1], env=os.environ)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertIn('Computed region proposals for 3 of 3 images', result.stdout)
+
+        store = proposals.ProposalStore(self.cache_dir, self.transforms)
+        self.assertTrue(all(pth in store for pth in self.paths))
+
+    def test_dataset_reuses_stored_proposals(self):
+        ds = LunarAnalogueDataset(str(self.root), 'test/**/*.jpeg', train=False, data_transforms=self.transforms,
+                                  cache_dir=self.cache_dir)
+        _, label = ds[0]
+        store = proposals.ProposalStore(self.cache_dir, self.transforms)
+        self.assertTrue(np.array_equal(store.get(ds._list_of_image_paths[0]), label['cr_bboxes']))
+
+        # Once stored, the proposals are read rather than recomputed
+        stored = np.tile([[0., 0., 16., 16.]], (16, 1))
+        store.put(ds._list_of_image_paths[0], stored)
+        regions, label = ds[0]
+        self.assertTrue(np.array_equal(label['cr_bboxes'], stored))
+        self.assertEqual(tuple(regions.shape), (16, 3, 64, 64))
+
+    def test_warm_start_proposals_are_not_stored(self):
+        warm_start = with_region_clustering(self.transforms, 'warm_start')
+        with self.assertRaises(AssertionError):
+            proposals.ProposalStore(self.cache_dir, warm_start)
+
+        ds = LunarAnalogueDataset(str(self.root), 'test/**/*.jpeg', train=False, data_transforms=warm_start,
+                                  cache_dir=self.cache_dir)
+        self.assertIsNone(ds._proposal_store)
+        _, label = ds[0]
+        self.assertEqual(label['cr_bboxes'].shape, (16, 4))
+
+
+class TestRegionProposal(unittest.TestCase):
+
+    def test_quantile_filter(self):
+        proposer = RegionProposal(area_quantiles=(0.25, 1.), aspect_quantiles=(0., 1.))
+        w = np.arange(1., 9.)
+        rects = np.stack([np.zeros(8), np.zeros(8), w, np.ones(8)], axis=1)
+        # The bounds are exclusive, the smallest areas and the extreme aspect ratios are dropped
+        kept = proposer._filter(rects, w, w)
+        self.assertTrue(np.array_equal(kept[:, 2], np.arange(3., 8.)))
+
+        proposer = RegionProposal(area_quantiles=(0., 0.5), aspect_quantiles=(0., 1.))
+        self.assertTrue(np.array_equal(proposer._filter(rects, w, w)[:, 2], np.arange(2., 5.)))
+
+    def test_seeded_clustering_is_reproducible(self):
+        image = synthetic_terrain()
+        first = RegionProposalBING(random_state=1).propose(image)
+        self.assertEqual(first.shape, (16, 4))
+        self.assertTrue(np.array_equal(RegionProposalBING(random_state=1).propose(image), first))
+
+    def test_clustering_methods_give_n_regions(self):
+        image = synthetic_terrain()
+        for clustering in RegionProposal.SUPPORTED_CLUSTERING:
+            for proposer in (RegionProposalBING(n_regions=8, clustering=clustering),
+                             RegionProposalSS(n_regions=8, clustering=clustering)):
+                crop_bboxes = proposer.propose(image)
+                self.assertEqual(crop_bboxes.shape, (8, 4), f'{proposer!r}')
+                self.assertTrue((crop_bboxes[:, 2:] > 0).all())
+                self.assertEqual(proposer.reproducible, clustering != 'warm_start')
+
+    def test_parameters_are_fingerprinted(self):
+        default = repr(RegionProposalSS())
+        self.assertEqual(repr(RegionProposalSS()), default)
+        for params in ({'area_quantiles': (0.1, 1.)}, {'aspect_quantiles': (0., 0.8)}, {'random_state': 1}):
+            self.assertNotEqual(repr(RegionProposalSS(**params)), default)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,25 @@
+import unittest
+import torch
+
+from models.cae_baseline import BaselineCAE
+from utils import export, quantization
+
+
+class TestQuantization(unittest.TestCase):
+
+    def test_int8_reconstruction_is_close(self):
+        torch.manual_seed(0)
+        model = BaselineCAE(torch.Size([3, 64, 64])).eval()
+        calibration = [torch.rand(8, 3, 64, 64) for _ in range(4)]
+        quantized = quantization.quantize_static(model, calibration, (3, 64, 64))
+
+        batch = torch.rand(4, 3, 64, 64)
+        with torch.inference_mode():
+            expected = export.Reconstruction(model)(batch)
+            result = quantized(batch)
+        self.assertEqual(result.shape, expected.shape)
+        self.assertLess((result - expected).abs().max().item(), 0.05)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import importlib
+import unittest
+import warnings
+
+import utils
+import models
+import datasets
+
+
+class TestRegistries(unittest.TestCase):
+
+    def test_every_supported_name_resolves(self):
+        for package, registry in ((utils, utils.supported_preprocessing_transforms),
+                                  (models, models.supported_models),
+                                  (datasets, datasets.supported_datamodules)):
+            for name in registry:
+                with self.subTest(name=name):
+                    self.assertIsNotNone(registry[name])
+                    # Every lookup, and the package attribute, give the same object
+                    self.assertIs(registry[name], registry[name])
+                    self.assertIs(getattr(package, name), registry[name])
+
+    def test_region_proposal_ss_is_the_region_extractor(self):
+        transforms = utils.supported_preprocessing_transforms
+        self.assertIs(transforms['LunarAnalogueRegionProposalSS'], transforms['LunarAnalogueRegionExtractor'])
+
+    def test_deprecated_alias(self):
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            transform = utils.NoveltyMNISTPreproccesing
+        self.assertIs(transform, utils.supported_preprocessing_transforms['NoveltyMNISTPreprocessing'])
+        self.assertTrue(any(issubclass(warning.category, DeprecationWarning) for warning in caught))
+
+    def test_star_import(self):
+        for package_name in ('utils', 'models', 'datasets'):
+            namespace = {}
+            exec(f'from {package_name} import *', namespace)
+            package = importlib.import_module(package_name)
+            for name in package.__all__:
+                self.assertIn(name, namespace)
+        namespace = {}
+        exec('from utils import *', namespace)
+        self.assertIn('CuriosityPreprocessing', namespace)
+        self.assertIn('LunarAnaloguePreprocessingPipeline', namespace)
+
+    def test_unknown_attribute(self):
+        with self.assertRaises(AttributeError):
+            getattr(utils, 'NotATransform')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import tempfile
+import unittest
+import numpy as np
+
+from datasets.base import split_indices, shard_indices
+
+
+class TestSplitIndices(unittest.TestCase):
+
+    def test_split_is_deterministic(self):
+        train_idxs, val_idxs = split_indices(103, 0.8, seed=7)
+        train_again, val_again = split_indices(103, 0.8, seed=7)
+        self.assertTrue(np.array_equal(train_idxs, train_again))
+        self.assertTrue(np.array_equal(val_idxs, val_again))
+
+        other_train, _ = split_indices(103, 0.8, seed=8)
+        self.assertFalse(np.array_equal(train_idxs, other_train))
+
+    def test_split_is_disjoint_and_covers_every_index(self):
+        for shuffle in (True, False):
+            train_idxs, val_idxs = split_indices(103, 0.8, shuffle=shuffle)
+            self.assertEqual(len(train_idxs), 82)
+            self.assertEqual(len(np.intersect1d(train_idxs, val_idxs)), 0)
+            self.assertTrue(np.array_equal(np.sort(np.concatenate([train_idxs, val_idxs])), np.arange(103)))
+
+    def test_unshuffled_split_is_contiguous(self):
+        train_idxs, val_idxs = split_indices(10, 0.7, shuffle=False)
+        self.assertTrue(np.array_equal(train_idxs, np.arange(7)))
+        self.assertTrue(np.array_equal(val_idxs, np.arange(7, 10)))
+
+    def test_cached_split_matches(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            for shuffle in (True, False):
+                split = split_indices(50, 0.5, cache_dir=cache_dir, key_parts=('data',), shuffle=shuffle)
+                cached = split_indices(50, 0.5, cache_dir=cache_dir, key_parts=('data',), shuffle=shuffle)
+                self.assertTrue(np.array_equal(split[0], cached[0]))
+                self.assertTrue(np.array_equal(split[1], cached[1]))
+                self.assertTrue(np.array_equal(split[0], split_indices(50, 0.5, shuffle=shuffle)[0]))
+
+    def test_shards_are_disjoint_and_equal_sized(self):
+        train_idxs, _ = split_indices(103, 0.8)
+        shards = [shard_indices(train_idxs, rank, 3) for rank in range(3)]
+        self.assertEqual({len(shard) for shard in shards}, {82 // 3})
+        self.assertEqual(len(np.unique(np.concatenate(shards))), 3 * (82 // 3))
+
+
+if __name__ == '__main__':
+    unittest.main()
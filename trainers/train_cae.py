@@ -61,6 +61,8 @@ def main():
 
     # Initialize the Trainer object
     trainer = pl.Trainer(
+        # Sharded datamodules already hand every rank its own samples, which a DistributedSampler would re-split
+        replace_sampler_ddp=not data_params.get('shard_across_ranks'),
         gpus=1,
         logger=logger,
         max_epochs=1000,
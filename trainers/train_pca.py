@@ -9,12 +9,11 @@ Uses:
     Dataset: LunarAnalogueDataGenerator
     Configuration: pca_incremental_lunar_analogue-OLD.yaml
 """
-import pickle
-
 from pathlib import Path
 from utils import tools, supported_preprocessing_transforms
 from datasets import supported_datamodules
 from models import supported_models
+from models.pca import save_pca
 from modules.pca_base_module import PCABaseModule
 
 
@@ -32,16 +31,16 @@ def main():
     # Set up preprocessing routine
     preprocessing_transforms = supported_preprocessing_transforms[data_params['preprocessing']]
 
-    # Initialize datagenerator
+    # Initialize datagenerator, chunk_size and mmap_dir are options of the PCABaseModule rather than the data
     datamodule = supported_datamodules[exp_params['datamodule']](
         data_transforms=preprocessing_transforms,
-        **data_params)
+        **{key: value for key, value in data_params.items() if key not in ('preprocessing', 'chunk_size', 'mmap_dir')})
 
     # Initialize model. With n_component=None the number of features will autoscale to the batch size
     model = supported_models[exp_params['model']](**module_params)
 
     # Initialize experimental module
-    module = PCABaseModule(model)
+    module = PCABaseModule(model, chunk_size=data_params.get('chunk_size'), mmap_dir=data_params.get('mmap_dir'))
 
     # Fit training set with PCA
     module.fit_pipeline(datamodule)
@@ -49,8 +48,8 @@ def main():
     # Do some serializing
     log_path, version_str, version_nb = tools.prepare_log_path(**exp_params)
     tools.save_object_to_version(config, version=version_nb, filename='configuration.yaml', **exp_params)
-    with open(log_path / version_str / 'fitted_model.p', 'wb') as f:
-        pickle.dump(module.model, f)
+    # The fitted arrays are saved as memory-mappable files rather than a pickle of the model, see models/pca.py
+    save_pca(module.model, log_path / version_str / 'fitted_model')
 
 
 if __name__ == '__main__':
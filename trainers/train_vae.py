@@ -59,6 +59,8 @@ def main():
     # Initialize the Trainer object
     print('[INFO] Initializing trainer..')
     trainer = pl.Trainer(
+        # Sharded datamodules already hand every rank its own samples, which a DistributedSampler would re-split
+        replace_sampler_ddp=not data_params.get('shard_across_ranks'),
         weights_summary=None,
         gpus=1,
         logger=logger,
@@ -1,41 +1,110 @@
-from .preprocessing import *
+"""
+The preprocessing transforms below are only built when they are first looked up in
+supported_preprocessing_transforms, so importing utils stays cheap (no OpenCV, scikit-learn,
+matplotlib, or BING model files are loaded until a transform is actually used).
+"""
+from .registry import LazyRegistry, module_getattr, module_all
 
-from torchvision import transforms
 
+def _curiosity_preprocessing():
+    from torchvision import transforms
+    from .preprocessing import CuriosityPreprocessingPipeline
+    return transforms.Compose([
+        CuriosityPreprocessingPipeline(),
+        transforms.ToTensor()
+    ])
 
-CuriosityPreprocessing = transforms.Compose([
-    CuriosityPreprocessingPipeline(),
-    transforms.ToTensor()
-])
 
-LunarAnalogueWholeImage = transforms.Compose([
-    LunarAnaloguePreprocessingPipeline(normalize='standard'),
-    transforms.ToTensor()
-])
+def _lunar_analogue_whole_image():
+    from torchvision import transforms
+    from .preprocessing import LunarAnaloguePreprocessingPipeline
+    return transforms.Compose([
+        LunarAnaloguePreprocessingPipeline(normalize='standard'),
+        transforms.ToTensor()
+    ])
+
 
 # Because of the fancy labelling and collation, ToTensor cannot be applied to this
 # transform. Formatting and type casting of tensors is handled in the NovelRegion
-LunarAnalogueRegionExtractor = transforms.Compose([
-    LunarAnaloguePreprocessingPipeline(normalize='zero_to_one'),
-    RegionProposalSS(return_tensor=True),
-])
+def _lunar_analogue_region_extractor():
+    from torchvision import transforms
+    from .preprocessing import LunarAnaloguePreprocessingPipeline, RegionProposalSS
+    return transforms.Compose([
+        LunarAnaloguePreprocessingPipeline(normalize='zero_to_one'),
+        RegionProposalSS(return_tensor=True),
+    ])
+
+
+def _lunar_analogue_region_proposal_bing():
+    from torchvision import transforms
+    from .preprocessing import LunarAnaloguePreprocessingPipeline, RegionProposalBING
+    return transforms.Compose([
+        LunarAnaloguePreprocessingPipeline(normalize='zero_to_one'),
+        RegionProposalBING(return_tensor=True),
+    ])
 
-LunarAnalogueRegionProposalBING = transforms.Compose([
-    LunarAnaloguePreprocessingPipeline(normalize='zero_to_one'),
-    RegionProposalBING(return_tensor=True),
-])
 
 # Novelty MNIST doesn't need to be transformed to a Tensor because the data
 # is already in Tensor format upon importing
-NoveltyMNISTPreproccesing = transforms.Compose([
-    NoveltyMNISTPreprocessingPipeline()
-])
-
-supported_preprocessing_transforms = {
-    'NoveltyMNISTPreprocessing': NoveltyMNISTPreproccesing,
-    'CuriosityPreprocessing': CuriosityPreprocessing,
-    'LunarAnalogueWholeImage': LunarAnalogueWholeImage,
-    'LunarAnalogueRegionExtractor': LunarAnalogueRegionExtractor,
-    'LunarAnalogueRegionProposalSS': LunarAnalogueRegionExtractor,
-    'LunarAnalogueRegionProposalBING': LunarAnalogueRegionProposalBING
+def _novelty_mnist_preprocessing():
+    from torchvision import transforms
+    from .preprocessing import NoveltyMNISTPreprocessingPipeline
+    return transforms.Compose([
+        NoveltyMNISTPreprocessingPipeline()
+    ])
+
+
+# Batched variants of the above: workers only decode and resize, leaving uint8 images (float32 for Curiosity),
+# and the normalization is applied to whole batches on the target device. See BaseDataModule.on_after_batch_transfer
+def _curiosity_preprocessing_batched():
+    from torchvision import transforms
+    from .preprocessing import CuriosityPreprocessingPipeline, ToTensorRaw
+    return transforms.Compose([
+        CuriosityPreprocessingPipeline(defer_normalization=True),
+        ToTensorRaw()
+    ])
+
+
+def _lunar_analogue_whole_image_batched():
+    from torchvision import transforms
+    from .preprocessing import LunarAnaloguePreprocessingPipeline, ToTensorRaw
+    return transforms.Compose([
+        LunarAnaloguePreprocessingPipeline(normalize='standard', defer_normalization=True),
+        ToTensorRaw()
+    ])
+
+
+def _novelty_mnist_preprocessing_batched():
+    from torchvision import transforms
+    from .preprocessing import NoveltyMNISTPreprocessingPipeline
+    return transforms.Compose([
+        NoveltyMNISTPreprocessingPipeline(defer_normalization=True)
+    ])
+
+
+supported_preprocessing_transforms = LazyRegistry({
+    'NoveltyMNISTPreprocessing': _novelty_mnist_preprocessing,
+    'CuriosityPreprocessing': _curiosity_preprocessing,
+    'LunarAnalogueWholeImage': _lunar_analogue_whole_image,
+    'LunarAnalogueRegionExtractor': _lunar_analogue_region_extractor,
+    'LunarAnalogueRegionProposalSS': lambda: supported_preprocessing_transforms['LunarAnalogueRegionExtractor'],
+    'LunarAnalogueRegionProposalBING': _lunar_analogue_region_proposal_bing,
+    'NoveltyMNISTPreprocessingBatched': _novelty_mnist_preprocessing_batched,
+    'CuriosityPreprocessingBatched': _curiosity_preprocessing_batched,
+    'LunarAnalogueWholeImageBatched': _lunar_analogue_whole_image_batched
+})
+
+_lazy_modules = {
+    name: 'utils.preprocessing' for name in (
+        'RegionProposal', 'RegionProposalBING', 'RegionProposalSS', 'LunarAnaloguePreprocessingPipeline',
+        'CuriosityPreprocessingPipeline', 'NoveltyMNISTPreprocessingPipeline', 'ToTensorRaw',
+        'with_region_clustering', 'with_batched_crops', 'split_deterministic', 'deferred_normalization',
+        'apply_batched')
 }
+
+# The transforms and the public names of utils.preprocessing remain available as attributes of the package,
+# including the misspelled NoveltyMNISTPreproccesing under which the MNIST transform used to be exported
+__getattr__ = module_getattr(
+    __name__, supported_preprocessing_transforms, _lazy_modules,
+    deprecated={'NoveltyMNISTPreproccesing': 'NoveltyMNISTPreprocessing'})
+__all__ = module_all(supported_preprocessing_transforms, _lazy_modules, eager=('supported_preprocessing_transforms',))
@@ -0,0 +1,90 @@
+"""
+On-disk caches for deterministic, expensive-to-recompute artefacts (e.g. preprocessed images).
+
+Entries are keyed by short SHA-1 fingerprints and written atomically (temporary file + rename),
+so concurrent DataLoader workers never read a partially written entry.
+"""
+import os
+import hashlib
+import tempfile
+import numpy as np
+
+from pathlib import Path
+
+# Version of the cached artefacts, part of every cache path. Bump it whenever the layout of the entries, or the output
+# of a cached computation (e.g. a preprocessing transform), changes without the parameters in its namespace changing,
+# so that the stale entries are never read again
+CACHE_VERSION = 1
+
+
+def fingerprint(*parts) -> str:
+    """Returns a short, stable hex digest of any number of str()-able parts"""
+    h = hashlib.sha1()
+    for part in parts:
+        h.update(str(part).encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()[:20]
+
+
+def file_fingerprint(path) -> str:
+    """Fingerprint of a file's identity and contents version (resolved path, mtime and size)"""
+    stat = os.stat(path)
+    return fingerprint(Path(path).resolve(), stat.st_mtime_ns, stat.st_size)
+
+
+class ArrayCache:
+    """
+    Stores one .npy file per key under <cache_dir>/v<CACHE_VERSION>/<namespace>/. Use a namespace that encodes
+    everything the cached values depend on (e.g. a fingerprint of the transform parameters),
+    that way a change in configuration only invalidates the entries it affects.
+    """
+    def __init__(self, cache_dir: str, namespace: str):
+        self.path = Path(cache_dir) / f'v{CACHE_VERSION}' / namespace
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    def _entry(self, key: str) -> Path:
+        # Fan entries out over subdirectories to keep directory listings small
+        return self.path / key[:2] / f'{key}.npy'
+
+    def __contains__(self, key: str) -> bool:
+        return self._entry(key).is_file()
+
+    def get(self, key: str, mmap_mode: str = 'c'):
+        """
+        Returns the cached array, or None on a miss. By default the array is memory-mapped
+        copy-on-write, so reads come straight from the page cache while the result stays writable.
+        """
+        try:
+            return np.load(self._entry(key), mmap_mode=mmap_mode)
+        except FileNotFoundError:
+            return None
+
+    def put(self, key: str, array: np.ndarray) -> None:
+        entry = self._entry(key)
+        entry.parent.mkdir(exist_ok=True)
+        atomic_write(entry, lambda f: np.save(f, np.ascontiguousarray(array)))
+
+    def get_arrays(self, key: str):
+        """Returns a dict of the arrays stored with put_arrays, or None on a miss"""
+        try:
+            with np.load(self._entry(key).with_suffix('.npz')) as arrays:
+                return dict(arrays)
+        except FileNotFoundError:
+            return None
+
+    def put_arrays(self, key: str, **arrays) -> None:
+        entry = self._entry(key).with_suffix('.npz')
+        entry.parent.mkdir(exist_ok=True)
+        atomic_write(entry, lambda f: np.savez(f, **arrays))
+
+
+def atomic_write(path, write_fn) -> None:
+    """Calls write_fn on a temporary file object and then moves it into place at path"""
+    fd, tmp_path = tempfile.mkstemp(dir=Path(path).parent, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write_fn(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
@@ -10,8 +10,6 @@ import torch
 import torchvision
 import pytorch_lightning as pl
 import torchvision.utils as vutils
-import logging
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 
 from utils import tools
 
@@ -0,0 +1,228 @@
+"""
+Export of the reconstruction based models (CAE, AAE and VAE) to TorchScript and ONNX, for inference without the
+model classes of this repo:
+
+    python -m utils.export <path_to_archived_model> <export_dir> [<C,H,W>]
+
+Before tracing, the models are prepared for inference: dropout is removed and batch-norm is folded into the
+preceding conv or transposed conv. The exported graph maps a (N, C, H, W) batch to its reconstruction, and a
+<name>.json file next to it records what is needed to score with it (see NoveltyScorer.from_export).
+"""
+import copy
+import json
+import sys
+import torch
+import torch.nn as nn
+
+from utils.dtypes import *
+
+
+class FoldedBlock(nn.Module):
+    """
+    An EncodingBlock or DecodingBlock (conv -> dropout -> LeakyReLU -> batch-norm) for inference. As the LeakyReLU
+    is positively homogeneous, LeakyReLU(scale * x) = scale * LeakyReLU(x) for scale > 0, so the batch-norm scale is
+    folded into the conv and only its per-channel shift remains, added after the activation.
+    """
+    def __init__(self, conv: nn.Module, activation: nn.Module, shift: Tensor):
+        super().__init__()
+        self.conv = conv
+        self.activation = activation
+        self.register_buffer('shift', shift.reshape(1, -1, 1, 1))
+
+    def forward(self, x):
+        return self.activation(self.conv(x)) + self.shift
+
+
+def _bn_scale_shift(bn: nn.BatchNorm2d) -> Tuple[Tensor, Tensor]:
+    scale = torch.rsqrt(bn.running_var + bn.eps)
+    if bn.weight is not None:
+        scale = scale * bn.weight
+    shift = -bn.running_mean * scale
+    if bn.bias is not None:
+        shift = shift + bn.bias
+    return scale.detach(), shift.detach()
+
+
+def _scale_conv(conv: nn.Module, scale: Tensor, shift: Optional[Tensor] = None) -> nn.Module:
+    """Returns a copy of a Conv2d or ConvTranspose2d whose output is multiplied by scale, plus shift if given"""
+    assert conv.groups == 1, 'Only convolutions without groups can be folded'
+    conv = copy.deepcopy(conv)
+    # Output channels are the first weight dim of Conv2d, and the second of ConvTranspose2d
+    channel_dim = 1 if isinstance(conv, nn.ConvTranspose2d) else 0
+    view = [1] * conv.weight.dim()
+    view[channel_dim] = -1
+    bias = conv.bias.detach() if conv.bias is not None else torch.zeros_like(scale)
+
+    with torch.no_grad():
+        conv.weight.mul_(scale.reshape(view))
+        bias = bias * scale + (shift if shift is not None else 0)
+    conv.bias = nn.Parameter(bias)
+    return conv
+
+
+def _fold_block(block: nn.Module) -> nn.Module:
+    conv = block.conv if hasattr(block, 'conv') else block.transconv
+    scale, shift = _bn_scale_shift(block.bn)
+    if not isinstance(block.activation, nn.LeakyReLU) or not bool((scale > 0).all()):
+        # Then the scale can't be moved through the activation, only the dropout is removed
+        return nn.Sequential(conv, block.activation, block.bn)
+    return FoldedBlock(_scale_conv(conv, scale), block.activation, shift)
+
+
+def _is_block(module: nn.Module) -> bool:
+    """EncodingBlock and DecodingBlock are defined in several model files, so they are recognized by their layers"""
+    return (hasattr(module, 'conv') or hasattr(module, 'transconv')) and hasattr(module, 'bn') \
+        and hasattr(module, 'activation') and hasattr(module, 'drop')
+
+
+def _fold_sequential(sequential: nn.Sequential) -> nn.Sequential:
+    """Folds every batch-norm that directly follows a conv or transposed conv into it"""
+    layers = []
+    for layer in sequential:
+        if isinstance(layer, nn.BatchNorm2d) and layers and isinstance(layers[-1], (nn.Conv2d, nn.ConvTranspose2d)):
+            layers[-1] = _scale_conv(layers[-1], *_bn_scale_shift(layer))
+        else:
+            layers.append(layer)
+    return nn.Sequential(*layers)
+
+
+def _prepare(module: nn.Module) -> nn.Module:
+    if isinstance(module, (nn.Dropout, nn.Dropout2d, nn.Dropout3d)):
+        return nn.Identity()
+    if _is_block(module):
+        return _fold_block(module)
+    for name, child in module.named_children():
+        setattr(module, name, _prepare(child))
+    if isinstance(module, nn.Sequential):
+        return _fold_sequential(module)
+    return module
+
+
+def prepare_for_inference(model: nn.Module) -> nn.Module:
+    """
+    Returns a copy of model in eval mode with dropout removed and batch-norm folded into the preceding conv or
+    transposed conv where possible. The copy computes the same outputs as model.eval(), up to rounding.
+    """
+    return _prepare(copy.deepcopy(model).eval()).eval()
+
+
+class Reconstruction(nn.Module):
+    """
+    Maps a batch to its reconstruction with the encoder and decoder of a model, bypassing its forward (and the
+    Python checks in it). Variational models are reconstructed from the mean of q(z|x).
+    """
+    def __init__(self, model: nn.Module):
+        super().__init__()
+        self.model = model
+        self._variational = hasattr(model, 'encode') and hasattr(model, 'decode')
+
+    def forward(self, x):
+        if self._variational:
+            mu, _ = self.model.encode(x)
+            return self.model.decode(mu)
+        return self.model.decoder(self.model.encoder(x))
+
+
+def export_model(
+        model: nn.Module,
+        in_shape: Iterable[int],
+        export_dir: Union[str, Path],
+        name: str,
+        formats: Iterable[str] = ('torchscript', 'onnx'),
+        metadata: Optional[dict] = None) -> List[Path]:
+    """
+    Traces the reconstruction of model (see prepare_for_inference and Reconstruction) for (N, *in_shape) batches,
+    and saves it to export_dir as <name>.pt (TorchScript) and/or <name>.onnx (ONNX, requires the onnx package),
+    both with a dynamic batch dim. The metadata is saved to <name>.json along with the in_shape.
+    Returns the paths of the exported files.
+    """
+    export_dir = Path(export_dir)
+    export_dir.mkdir(parents=True, exist_ok=True)
+    in_shape = [int(s) for s in in_shape]
+
+    reconstruction = Reconstruction(prepare_for_inference(model)).cpu().eval()
+    example = torch.rand(2, *in_shape)
+    paths = []
+
+    for fmt in formats:
+        if fmt == 'torchscript':
+            with torch.no_grad():
+                traced = torch.jit.freeze(torch.jit.trace(reconstruction, example))
+            paths.append(export_dir / f'{name}.pt')
+            traced.save(str(paths[-1]))
+        elif fmt == 'onnx':
+            paths.append(export_dir / f'{name}.onnx')
+            torch.onnx.export(
+                reconstruction,
+                example,
+                str(paths[-1]),
+                input_names=['images'],
+                output_names=['reconstructions'],
+                dynamic_axes={'images': {0: 'batch'}, 'reconstructions': {0: 'batch'}},
+                opset_version=11)
+        else:
+            raise ValueError(f'Unknown export format {fmt!r}, expected one of: torchscript, onnx')
+
+    save_export_metadata(export_dir / f'{name}.json', in_shape, metadata)
+    return paths
+
+
+class OnnxReconstruction:
+    """Runs an exported <name>.onnx graph with onnxruntime on the CPU, taking and returning tensors"""
+    def __init__(self, path: Union[str, Path], num_threads: Optional[int] = None):
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        if num_threads is not None:
+            options.intra_op_num_threads = num_threads
+        self._session = onnxruntime.InferenceSession(str(path), options, providers=['CPUExecutionProvider'])
+
+    def __call__(self, batch_in: Tensor) -> Tensor:
+        (batch_rc,) = self._session.run(None, {'images': batch_in.detach().cpu().numpy()})
+        return torch.from_numpy(batch_rc)
+
+
+def load_exported(path: Union[str, Path], device: Union[str, torch.device] = 'cpu') -> Callable:
+    """
+    Loads an exported reconstruction graph, a TorchScript <name>.pt or an ONNX <name>.onnx (CPU only, requires
+    onnxruntime). The returned callable maps a (N, C, H, W) tensor to its reconstruction.
+    """
+    path = Path(path)
+    if path.suffix == '.onnx':
+        return OnnxReconstruction(path)
+    return torch.jit.load(str(path), map_location=device).eval()
+
+
+def save_export_metadata(path: Union[str, Path], in_shape: Iterable[int], metadata: Optional[dict] = None) -> None:
+    """Saves the metadata of an exported graph next to it, as <name>.json"""
+    with open(Path(path).with_suffix('.json'), 'w') as f:
+        json.dump({**(metadata or {}), 'in_shape': [int(s) for s in in_shape]}, f, indent=2)
+
+
+def load_export_metadata(path: Union[str, Path]) -> dict:
+    """Returns the metadata saved next to an exported graph"""
+    with open(Path(path).with_suffix('.json'), 'r') as f:
+        return json.load(f)
+
+
+if __name__ == '__main__':
+    import importlib.util
+    from modules.novelty_scorer import NoveltyScorer
+
+    if not 3 <= len(sys.argv) <= 4:
+        raise ValueError('Usage: python -m utils.export <path_to_archived_model> <export_dir> [<C,H,W>]')
+    archive, export_dir = Path(sys.argv[1]), sys.argv[2]
+    in_shape = [int(s) for s in sys.argv[3].split(',')] if len(sys.argv) > 3 else None
+
+    scorer = NoveltyScorer.from_archive(archive, in_shape=in_shape, device='cpu')
+    in_shape = scorer.in_shape
+    formats = ['torchscript'] + (['onnx'] if importlib.util.find_spec('onnx') is not None else [])
+
+    paths = export_model(
+        scorer.model,
+        in_shape,
+        export_dir,
+        name=f'{archive.parent.name}_{archive.name}',
+        formats=formats,
+        metadata=scorer.export_metadata())
+    print(f'Exported {archive} to: {", ".join(str(p) for p in paths)}')
@@ -3,7 +3,6 @@ Set of objets that can be imported as custom losses.
 Losses can be both pytorch specific and numpy specific.
 '''
 import numpy as np
-import matplotlib.pyplot as plt
 import torch
 from utils import tools
 
@@ -12,6 +11,8 @@ def squared_error(x, x_hat, show_plot: bool = False, return_map: bool = True):
     if isinstance(x, np.ndarray):
         x_err = (x - x_hat)**2
         if show_plot:
+            import matplotlib.pyplot as plt
+
             x_stats = tools.BatchStatistics(x)
             x_hat_stats = tools.BatchStatistics(x_hat)
             x_err_stats = tools.BatchStatistics(x_err)
@@ -55,6 +56,47 @@ def mse_loss(x, x_hat):
     return mse_loss_sum
 
 
+def novelty_error(x, x_hat, metric: str = 'mse', channel_weights=None):
+    """
+    Returns the reconstruction error map of each image, from which the novelty scores are reduced
+
+    INPUT:
+    x: Tensor (B, C, ...) -> source images
+    x_hat: Tensor (B, C, ...) -> reconstructions
+    metric: str -> 'mse' for the squared error, 'l1' for the absolute error
+    channel_weights: sequence (C,) or None -> relative weight of the error of each channel,
+                     normalized to a mean of 1 so that scores stay on the scale of the unweighted metric
+
+    OUTPUT:
+    error: Tensor (B, C, ...) -> (weighted) error of each element
+    """
+    if metric == 'mse':
+        error = (x_hat - x) ** 2
+    elif metric == 'l1':
+        error = (x_hat - x).abs()
+    else:
+        raise ValueError(f'Unknown novelty metric {metric!r}, expected one of: mse, l1')
+
+    if channel_weights is not None:
+        weights = torch.as_tensor(channel_weights, dtype=error.dtype, device=error.device)
+        assert weights.shape == (error.shape[1],), \
+            f'Need one channel weight per channel ({error.shape[1]}), got {tuple(weights.shape)}'
+        weights = weights / weights.mean()
+        error = error * weights.view(1, -1, *([1] * (error.dim() - 2)))
+    return error
+
+
+def novelty_scores(x, x_hat, metric: str = 'mse', channel_weights=None):
+    """
+    Returns the novelty score of each image, the mean reconstruction error over all of its elements,
+    computed for the whole batch with a single reduction (see novelty_error for the arguments)
+
+    OUTPUT:
+    scores: Tensor (B,) -> novelty score of each image
+    """
+    return novelty_error(x, x_hat, metric, channel_weights).flatten(1).mean(dim=1)
+
+
 def recons_probability(x_hat):
     """
     Returns the sum of the probabilities of each pixel in the image
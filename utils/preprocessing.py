@@ -1,75 +1,184 @@
 import cv2 as cv
 import torch
+import torch.nn.functional as F
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
 
-from sklearn.cluster import KMeans
+from torchvision.transforms import Compose, ToTensor
 
 # import logging
 # logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 
 
-class RegionProposalBING:
+class RegionProposal:
     """
-    This class uses Binarized normed gradients (BING) to compute unsupervised region proposals.
-    Original literature can be found at: https://mmcheng.net/bing/
+    Base class of the region proposal transforms. Subclasses implement propose(), which returns the
+    (n_regions, 4) bounding boxes (x, y, w, h) of the regions to extract from an image. Calling the
+    transform crops and warps those regions to region_shape and returns (warped_crops, crop_bboxes).
+    Proposed rectangles are kept if their area and aspect ratios lie within the given quantiles of all proposals.
+    The kept rectangles are then reduced to n_regions boxes by one of the following clustering methods:
+        'kmeans': k-means with the default number of initializations (most robust, slowest)
+        'minibatch': mini-batch k-means
+        'single': k-means with a single k-means++ initialization
+        'warm_start': k-means with a single initialization, started from the previous image's centres. Suited to
+            sequential imagery, note the result then depends on the order images are processed in
+        'topk': no clustering, the n_regions highest ranked rectangles (by objectness for BING) are kept
+    Clustering is seeded with random_state, so with the exception of warm_start the same image always gives the
+    same regions (see reproducible). The state of warm_start is kept per transform object, i.e. per DataLoader
+    worker or process, so its proposals are never stored (see utils/proposals.py).
     """
+    SUPPORTED_CLUSTERING = ('kmeans', 'minibatch', 'single', 'warm_start', 'topk')
+
+    # Names of members that cannot be pickled, these are recreated by _build() after unpickling
+    _unpicklable = ()
+
     def __init__(
             self,
             n_regions: int = 16,
             region_shape: tuple = (64, 64, 3),
             return_tensor: bool = True,
-            view_region_proposals: bool = False):
+            view_region_proposals: bool = False,
+            area_quantiles: tuple = (0., 1.),
+            aspect_quantiles: tuple = (0., 1.),
+            random_state: int = 0,
+            clustering: str = 'kmeans',
+            batched_crops: bool = False):
         super().__init__()
+        assert clustering in self.SUPPORTED_CLUSTERING, \
+            f'Unsupported clustering method, must be one of: {", ".join(self.SUPPORTED_CLUSTERING)}'
 
         self.n_regions = n_regions
         self.region_shape = region_shape
+        self.area_quantiles = tuple(area_quantiles)
+        self.aspect_quantiles = tuple(aspect_quantiles)
+        self.random_state = random_state
+        self.clustering = clustering
         self._return_tensor = return_tensor
         self._view_region_proposals = view_region_proposals
-
-        self._saliency_obj = cv.saliency.ObjectnessBING_create()
-        self._saliency_obj.setTrainingPath('models/_bing_trained_models')
-        self._kmeans = KMeans(n_clusters=n_regions)
+        self._batched_crops = batched_crops
+
+        # scikit-learn is only imported by the transforms that need it
+        from sklearn.cluster import KMeans, MiniBatchKMeans
+
+        self._previous_centres = None
+        if clustering == 'kmeans':
+            self._kmeans = KMeans(n_clusters=n_regions, random_state=random_state)
+        elif clustering == 'minibatch':
+            self._kmeans = MiniBatchKMeans(n_clusters=n_regions, random_state=random_state)
+        elif clustering == 'single':
+            self._kmeans = KMeans(n_clusters=n_regions, n_init=1, random_state=random_state)
+
+    def get_params(self) -> dict:
+        """Parameters that determine the proposed regions, enough to rebuild an equivalent proposer"""
+        return {
+            'n_regions': self.n_regions,
+            'region_shape': tuple(self.region_shape),
+            'area_quantiles': self.area_quantiles,
+            'aspect_quantiles': self.aspect_quantiles,
+            'random_state': self.random_state,
+            'clustering': self.clustering
+        }
+
+    @property
+    def reproducible(self) -> bool:
+        """Whether an image always gives the same regions, regardless of the images proposed before it"""
+        return self.clustering != 'warm_start'
+
+    def __repr__(self):
+        # Used to fingerprint stored proposals (see utils/proposals.py)
+        params = ', '.join(f'{k}={v!r}' for k, v in self.get_params().items())
+        return f'{self.__class__.__name__}({params})'
+
+    def __getstate__(self):
+        # OpenCV algorithm objects cannot be pickled, drop them so the transform can be sent to other processes
+        state = self.__dict__.copy()
+        for key in self._unpicklable:
+            state.pop(key, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._build()
+
+    def _build(self) -> None:
+        """(Re)creates the unpicklable members"""
+        return
 
     def __call__(self, image: np.ndarray):
-        # TODO: Set up asserts to ensure data is general correct upon importing
-        
-        # Compute saliency boxes
-        success, raw_rects = self._saliency_obj.computeSaliency(image)
-        rects = np.empty((len(raw_rects), 4))
-        areas = np.empty(len(raw_rects))
-        whaspects = np.empty(len(raw_rects))
-        
-        for i, (x1, y1, x2, y2) in enumerate(raw_rects.reshape(-1, 4)):
-            w, h = x2 - x1, y2 - y1
-            rects[i] = [x1, y1, w, h]
-            areas[i] = w * h
-            whaspects[i] = w / h
-
-        area_low, area_high = np.quantile(areas, [0.9, 1.00])
-        whaspect_low, whaspect_high = np.quantile(whaspects, [0., 0.7])
-        hwaspect_low, hwaspect_high = np.quantile(1/whaspects, [0., 0.7])
-        
-        keep_rects = rects[
+        crop_bboxes = self.propose(image)
+        return self.crop(image, crop_bboxes), crop_bboxes
+
+    def propose(self, image: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+    def _filter(self, rects: np.ndarray, areas: np.ndarray, whaspects: np.ndarray) -> np.ndarray:
+        """Keeps the rectangles whose area and aspect ratios lie within the configured quantiles"""
+        area_low, area_high = np.quantile(areas, self.area_quantiles)
+        whaspect_low, whaspect_high = np.quantile(whaspects, self.aspect_quantiles)
+        hwaspect_low, hwaspect_high = np.quantile(1/whaspects, self.aspect_quantiles)
+
+        return rects[
             (areas > area_low) & (areas < area_high) &
             (whaspects > whaspect_low) & (whaspects < whaspect_high) &
             ((1/whaspects) > hwaspect_low) & ((1/whaspects) < hwaspect_high)
-            ]
-                
-        self._kmeans.fit(keep_rects)
-        warped_crops = np.empty((self.n_regions, *self.region_shape))
-        crop_bboxes = np.empty((self.n_regions, 4))
-
-        for i, (x, y, w, h) in enumerate(self._kmeans.cluster_centers_):
-            x, y, w, h = int(x), int(y), int(w), int(h)
-            crop = image[y:y+h, x:x+w]
-            warped_crop = cv.resize(crop, (self.region_shape[0], self.region_shape[1]), interpolation=cv.INTER_CUBIC)
+        ]
 
-            crop_bboxes[i] = np.array([x, y, w, h])
-            warped_crops[i] = warped_crop
+    def _cluster(self, keep_rects: np.ndarray) -> np.ndarray:
+        """Reduces the filtered rectangles to n_regions boxes, truncated to integer pixel coordinates"""
+        if len(keep_rects) < self.n_regions:
+            raise ValueError(f'Only {len(keep_rects)} region proposals were kept, at least {self.n_regions} are needed')
+
+        if self.clustering == 'topk':
+            # Proposals are ranked best first, which the filtering preserves
+            centres = keep_rects[:self.n_regions]
+        elif self.clustering == 'warm_start':
+            from sklearn.cluster import KMeans
+
+            init = self._previous_centres if self._previous_centres is not None else 'k-means++'
+            kmeans = KMeans(n_clusters=self.n_regions, init=init, n_init=1, random_state=self.random_state)
+            centres = kmeans.fit(keep_rects).cluster_centers_
+            self._previous_centres = centres
+        else:
+            centres = self._kmeans.fit(keep_rects).cluster_centers_
+        return np.asarray(centres).astype(int).astype(float)
+
+    def crop(self, image: np.ndarray, crop_bboxes: np.ndarray):
+        """
+        Crops the given (x, y, w, h) boxes out of the image and warps them to region_shape with bicubic
+        interpolation (cv.resize), into a float32 (n_regions, C, H, W) tensor, or a float32 (n_regions, H, W, C)
+        array if return_tensor is False. Every warped crop is written straight into the output buffer.
+
+        With batched_crops (the region_batched_crops data-parameter), all boxes are instead resampled at once with
+        grid_sample. This is faster for many regions but not identical: near the edges of a box the bicubic kernel
+        reads the image pixels around it, where cv.resize replicates the edge of the crop. Away from the edges
+        both agree up to float32 rounding.
+        """
+        img_h, img_w = image.shape[:2]
+        # Like slicing, clip the boxes to the image, keeping at least one pixel
+        x, y, w, h = np.asarray(crop_bboxes, dtype=np.float64).astype(int).T
+        x = np.clip(x, 0, img_w - 1)
+        y = np.clip(y, 0, img_h - 1)
+        w = np.clip(np.minimum(w, img_w - x), 1, None)
+        h = np.clip(np.minimum(h, img_h - y), 1, None)
+
+        if self._batched_crops:
+            warped_crops = self._warp_batched(image, x, y, w, h)
+        else:
+            # region_shape is given as cv.resize's dsize, i.e. (width, height, channels)
+            out_w, out_h, n_channels = self.region_shape
+            if self._return_tensor:
+                warped_crops = torch.empty((len(x), n_channels, out_h, out_w), dtype=torch.float32)
+                # (R, H, W, C) view of the buffer, which each crop is resized into
+                crops_out = warped_crops.permute(0, 2, 3, 1).numpy()
+            else:
+                warped_crops = crops_out = np.empty((len(x), out_h, out_w, n_channels), dtype=np.float32)
+            for i in range(len(x)):
+                crop = image[y[i]:y[i] + h[i], x[i]:x[i] + w[i]]
+                crops_out[i] = cv.resize(crop, (out_w, out_h), interpolation=cv.INTER_CUBIC).reshape(out_h, out_w, -1)
 
         if self._view_region_proposals:
+            import matplotlib.pyplot as plt
+            import matplotlib.patches as patches
+
             fig, ax = plt.subplots()
             ax.imshow(image)
             for crop in crop_bboxes:
@@ -77,33 +186,96 @@ class RegionProposalBING:
                 ax.add_patch(rect)
             plt.show()
 
-        if self._return_tensor:
-            warped_crops = torch.tensor(warped_crops).permute(0, 3, 1, 2).to(dtype=torch.float32)
-        return warped_crops, crop_bboxes
+        if self._batched_crops and not self._return_tensor:
+            return warped_crops.permute(0, 2, 3, 1).numpy()
+        return warped_crops
+
+    def _warp_batched(self, image: np.ndarray, x, y, w, h) -> torch.Tensor:
+        img_h, img_w = image.shape[:2]
+        # Affine maps from each output region to its box, in the normalized [-1, 1] coordinates of the
+        # image. With align_corners=False, pixel centres are mapped the same way cv.resize maps them.
+        theta = np.zeros((len(x), 2, 3), dtype=np.float32)
+        theta[:, 0, 0] = w / img_w
+        theta[:, 0, 2] = (2 * x + w) / img_w - 1
+        theta[:, 1, 1] = h / img_h
+        theta[:, 1, 2] = (2 * y + h) / img_h - 1
+
+        # region_shape is given as cv.resize's dsize, i.e. (width, height, channels)
+        out_w, out_h, n_channels = self.region_shape
+        image_t = torch.from_numpy(np.ascontiguousarray(image, dtype=np.float32)).permute(2, 0, 1)[None]
+        grid = F.affine_grid(torch.from_numpy(theta), [len(x), n_channels, out_h, out_w], align_corners=False)
+        return F.grid_sample(
+            image_t.expand(len(x), -1, -1, -1), grid, mode='bicubic', padding_mode='border', align_corners=False)
+
+
+class RegionProposalBING(RegionProposal):
+    """
+    This class uses Binarized normed gradients (BING) to compute unsupervised region proposals.
+    Original literature can be found at: https://mmcheng.net/bing/
+    """
+    _unpicklable = ('_saliency_obj',)
 
+    def __init__(
+            self,
+            n_regions: int = 16,
+            region_shape: tuple = (64, 64, 3),
+            return_tensor: bool = True,
+            view_region_proposals: bool = False,
+            area_quantiles: tuple = (0.9, 1.),
+            aspect_quantiles: tuple = (0., 0.7),
+            random_state: int = 0,
+            clustering: str = 'kmeans',
+            batched_crops: bool = False):
+        super().__init__(
+            n_regions, region_shape, return_tensor, view_region_proposals,
+            area_quantiles, aspect_quantiles, random_state, clustering, batched_crops)
+        self._build()
+
+    def _build(self) -> None:
+        self._saliency_obj = cv.saliency.ObjectnessBING_create()
+        self._saliency_obj.setTrainingPath('models/_bing_trained_models')
+
+    def propose(self, image: np.ndarray) -> np.ndarray:
+        # TODO: Set up asserts to ensure data is general correct upon importing
+
+        # Compute saliency boxes
+        success, raw_rects = self._saliency_obj.computeSaliency(image)
+        x1, y1, x2, y2 = raw_rects.reshape(-1, 4).astype(np.float64).T
+        w, h = x2 - x1, y2 - y1
+        rects = np.stack([x1, y1, w, h], axis=1)
+        areas = w * h
+        whaspects = w / h
+
+        return self._cluster(self._filter(rects, areas, whaspects))
 
-class RegionProposalSS:
+
+class RegionProposalSS(RegionProposal):
     """
     Conceptually this class would be called after another preprocessing
     pipeline is applied first, such as LunarAnaloguePreprocessingPipeline
     """
+    _unpicklable = ('_ss',)
+
     def __init__(
             self,
             n_regions: int = 16,
             region_shape: tuple = (64, 64, 3),
             return_tensor: bool = True,
-            view_region_proposals: bool = False):
-        super().__init__()
-
-        self.n_regions = n_regions
-        self.region_shape = region_shape
-        self._return_tensor = return_tensor
-        self._view_region_proposals = view_region_proposals
-
+            view_region_proposals: bool = False,
+            area_quantiles: tuple = (0.2, 1.),
+            aspect_quantiles: tuple = (0., 0.9),
+            random_state: int = 0,
+            clustering: str = 'kmeans',
+            batched_crops: bool = False):
+        super().__init__(
+            n_regions, region_shape, return_tensor, view_region_proposals,
+            area_quantiles, aspect_quantiles, random_state, clustering, batched_crops)
+        self._build()
+
+    def _build(self) -> None:
         self._ss = cv.ximgproc.segmentation.createSelectiveSearchSegmentation()
-        self._kmeans = KMeans(n_clusters=n_regions)
 
-    def __call__(self, image: np.ndarray):
+    def propose(self, image: np.ndarray) -> np.ndarray:
         # Currently, images are assumed to be in RGB form with intensities in the range [0, 1]
 
         # Initialize selective search algorithm with fast search strategy
@@ -112,47 +284,12 @@ class RegionProposalSS:
 
         # Get the predicted rectangles in (x, y, w, h) form
         rects = self._ss.process()
+        w, h = rects[:, 2].astype(np.float64), rects[:, 3].astype(np.float64)
+        areas = w * h
+        whaspects = w / h
 
-        # Filter rectangles according to total area between defined quantiles
-        areas = np.empty(len(rects))
-        whaspects = np.empty(len(rects))
-        for i, (_, _, w, h) in enumerate(rects):
-            areas[i] = w * h
-            whaspects[i] = w / h
-
-        area_low, area_high = np.quantile(areas, [0.2, 1.])
-        whaspect_low, whaspect_high = np.quantile(whaspects, [0., 0.9])
-        hwaspect_low, hwaspect_high = np.quantile(1/whaspects, [0., 0.9])
-
-        keep_rects = rects[
-            (areas > area_low) & (areas < area_high) &
-            (whaspects > whaspect_low) & (whaspects < whaspect_high)
-            & ((1/whaspects) > hwaspect_low) & ((1/whaspects) < hwaspect_high)
-        ]
-
-        self._kmeans.fit(keep_rects)
-        warped_crops = np.empty((self.n_regions, *self.region_shape))
-        crop_bboxes = np.empty((self.n_regions, 4))
-
-        for i, (x, y, w, h) in enumerate(self._kmeans.cluster_centers_):
-            x, y, w, h = int(x), int(y), int(w), int(h)
-            crop = image[y:y+h, x:x+w]
-            warped_crop = cv.resize(crop, (self.region_shape[0], self.region_shape[1]), interpolation=cv.INTER_CUBIC)
-
-            crop_bboxes[i] = np.array([x, y, w, h])
-            warped_crops[i] = warped_crop
-
-        if self._view_region_proposals:
-            fig, ax = plt.subplots()
-            ax.imshow(image)
-            for crop in crop_bboxes:
-                rect = patches.Rectangle((crop[0], crop[1]), crop[2], crop[3], facecolor='none', edgecolor='r')
-                ax.add_patch(rect)
-            plt.show()
-
-        if self._return_tensor:
-            warped_crops = torch.tensor(warped_crops).permute(0, 3, 1, 2).to(dtype=torch.float32)
-        return warped_crops, crop_bboxes
+        # Filter rectangles according to area and aspect ratio between the defined quantiles
+        return self._cluster(self._filter(rects, areas, whaspects))
 
 
 class LunarAnaloguePreprocessingPipeline:
@@ -165,15 +302,25 @@ class LunarAnaloguePreprocessingPipeline:
         4) channelwise standardization
     See the slides from: https://cedar.buffalo.edu/~srihari/CSE676/12.2%20Computer%20Vision.pdf
     for more information on the steps used here.
+    With defer_normalization=True step 4 is skipped and uint8 images are returned, the normalization is
+    then applied to whole collated batches with normalize_batch (see BaseDataModule.on_after_batch_transfer).
     """
+    # Same input always gives the same output, so results may be cached (see split_deterministic)
+    deterministic = True
 
-    def __init__(self, normalize: str = 'standard', scale: float = 1/5):
+    def __init__(self, normalize: str = 'standard', scale: float = 1/5, defer_normalization: bool = False):
         assert any( (normalize == rout for rout in ('standard', 'zero_to_one')) ), \
             'Unsupported normalization routine, must be one of: standard, zero_to_one'
         assert (0. <= scale <= 1.), \
             'Scaling factor must be between 0 and 1'
         self._normalize = normalize
         self._scale = scale
+        self.defer_normalization = defer_normalization
+
+    def __repr__(self):
+        # Used to fingerprint cached outputs, so must include every parameter affecting the output
+        return (f'{self.__class__.__name__}(normalize={self._normalize!r}, scale={self._scale!r}, '
+                f'defer_normalization={self.defer_normalization!r})')
 
     def __call__(self, image: np.ndarray) -> np.ndarray:
         assert (len(image.shape) == 3), \
@@ -197,6 +344,9 @@ class LunarAnaloguePreprocessingPipeline:
         # Minor Gaussian blurring
         image = cv.medianBlur(image, 3)
 
+        if self.defer_normalization:
+            return image
+
         # Convert image dtype to float
         image = np.float32(image)
 
@@ -209,24 +359,42 @@ class LunarAnaloguePreprocessingPipeline:
 
         return image
 
+    def normalize_batch(self, images: torch.Tensor) -> torch.Tensor:
+        """Normalizes an (N, C, H, W) batch of images returned with defer_normalization=True"""
+        images = images.to(dtype=torch.float32)
+        if self._normalize == 'standard':
+            dims = (2, 3)
+            return (images - images.mean(dim=dims, keepdim=True)) / images.std(dim=dims, keepdim=True, unbiased=False)
+        else:
+            i_min = images.amin(dim=(1, 2, 3), keepdim=True)
+            i_max = images.amax(dim=(1, 2, 3), keepdim=True)
+            return (images - i_min) / (i_max - i_min)
+
 
 class CuriosityPreprocessingPipeline:
     """
     Standard image preprocessing pipeline for Curiosity data.
     1) Convert data to numpy.float32
     2) Channelwise standardization
+    With defer_normalization=True step 2 is left to normalize_batch.
     """
+    deterministic = True
 
-    def __init__(self):
-        return
+    def __init__(self, defer_normalization: bool = False):
+        self.defer_normalization = defer_normalization
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(defer_normalization={self.defer_normalization!r})'
 
     def __call__(self, image: np.ndarray) -> np.ndarray:
         assert image.shape == (64, 64, 6), \
             'Dataset not in correct format for pre-processing'
         n_channels = image.shape[-1]
 
-        # Convert image dtype to float
-        image = np.float32(image)
+        # Convert image dtype to float, always copying so read-only (e.g. memory-mapped) inputs are never modified
+        image = image.astype(np.float32)
+        if self.defer_normalization:
+            return image
 
         # Standardize image
         for c in range(n_channels):
@@ -234,19 +402,45 @@ class CuriosityPreprocessingPipeline:
 
         return image
 
+    def batch(self, images: np.ndarray) -> np.ndarray:
+        """Vectorised equivalent of calling the pipeline on each image of an (N, H, W, C) batch"""
+        assert images.shape[1:] == (64, 64, 6), \
+            'Dataset not in correct format for pre-processing'
+
+        images = images.astype(np.float32)
+        if self.defer_normalization:
+            return images
+        images -= images.mean(axis=(1, 2), keepdims=True)
+        images /= images.std(axis=(1, 2), keepdims=True)
+        return images
+
+    def normalize_batch(self, images: torch.Tensor) -> torch.Tensor:
+        """Standardizes an (N, C, H, W) batch of images returned with defer_normalization=True"""
+        images = images.to(dtype=torch.float32)
+        dims = (2, 3)
+        return (images - images.mean(dim=dims, keepdim=True)) / images.std(dim=dims, keepdim=True, unbiased=False)
+
 
 class NoveltyMNISTPreprocessingPipeline:
     """
     Standard image preprocessing pipeline for Novelty MNIST data.
     1) Convert data to torch.float32
     2) Standardization
+    With defer_normalization=True the uint8 images are passed through untouched and both steps are left
+    to normalize_batch.
     """
+    deterministic = True
 
-    def __init__(self):
-        return
+    def __init__(self, defer_normalization: bool = False):
+        self.defer_normalization = defer_normalization
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(defer_normalization={self.defer_normalization!r})'
 
     def __call__(self, image: torch.Tensor) -> torch.Tensor:
         assert image.shape == (1, 28, 28), 'Dataset not in correct format for pre-processing'
+        if self.defer_normalization:
+            return image
 
         # Convert image dtype to float
         image = image.to(dtype=torch.float32)
@@ -256,6 +450,120 @@ class NoveltyMNISTPreprocessingPipeline:
 
         return image
 
+    def batch(self, images: torch.Tensor) -> torch.Tensor:
+        """Vectorised equivalent of calling the pipeline on each image of an (N, 1, 28, 28) batch"""
+        assert images.shape[1:] == (1, 28, 28), 'Dataset not in correct format for pre-processing'
+        if self.defer_normalization:
+            return images
+        return self.normalize_batch(images)
+
+    def normalize_batch(self, images: torch.Tensor) -> torch.Tensor:
+        """Standardizes an (N, 1, 28, 28) batch of images"""
+        images = images.to(dtype=torch.float32)
+        dims = (1, 2, 3)
+        return (images - images.mean(dim=dims, keepdim=True)) / images.std(dim=dims, keepdim=True)
+
+
+class ToTensorRaw:
+    """
+    Converts an (H, W, C) numpy image into a (C, H, W) tensor without changing its dtype or scaling it
+    (unlike torchvision's ToTensor, which maps uint8 images to [0, 1] floats). Used with the deferred
+    normalization pipelines, so that workers hand over compact uint8 batches.
+    """
+    def __repr__(self):
+        return f'{self.__class__.__name__}()'
+
+    def __call__(self, image: np.ndarray) -> torch.Tensor:
+        return torch.from_numpy(np.ascontiguousarray(image.transpose(2, 0, 1)))
+
+
+def with_region_clustering(transforms, clustering: str):
+    """
+    Returns a copy of an NRE transform whose region proposal step uses the given clustering method (see
+    RegionProposal), the original transform is left untouched
+    """
+    return _with_region_proposal(transforms, clustering=clustering)
+
+
+def with_batched_crops(transforms, batched_crops: bool = True):
+    """
+    Returns a copy of an NRE transform whose region proposal step warps its crops all at once with grid_sample
+    (see RegionProposal.crop), the original transform is left untouched
+    """
+    return _with_region_proposal(transforms, batched_crops=batched_crops)
+
+
+def _with_region_proposal(transforms, clustering: str = None, batched_crops: bool = None):
+    steps = transforms.transforms if isinstance(transforms, Compose) else [transforms]
+    new_steps = []
+    for step in steps:
+        if isinstance(step, RegionProposal):
+            params = step.get_params()
+            if clustering is not None:
+                params['clustering'] = clustering
+            step = type(step)(
+                return_tensor=step._return_tensor, view_region_proposals=step._view_region_proposals,
+                batched_crops=step._batched_crops if batched_crops is None else batched_crops, **params)
+        new_steps.append(step)
+    return Compose(new_steps)
+
+
+def split_deterministic(transforms) -> tuple:
+    """
+    Splits a transform (or Compose) into its leading run of deterministic steps and the remainder,
+    returned as (deterministic, remainder). Either may be None. The output of the deterministic part
+    only depends on its input and repr(), which makes it safe to cache on disk.
+    """
+    if transforms is None:
+        return None, None
+    steps = transforms.transforms if isinstance(transforms, Compose) else [transforms]
+
+    n_deterministic = 0
+    while n_deterministic < len(steps) and getattr(steps[n_deterministic], 'deterministic', False):
+        n_deterministic += 1
+
+    deterministic = Compose(steps[:n_deterministic]) if n_deterministic > 0 else None
+    remainder = Compose(steps[n_deterministic:]) if n_deterministic < len(steps) else None
+    return deterministic, remainder
+
+
+def deferred_normalization(transforms):
+    """
+    Returns the normalize_batch method of the step in transforms that defers its normalization, or None if
+    there is no such step. The returned callable takes and returns (N, C, H, W) tensors.
+    """
+    if transforms is None:
+        return None
+    steps = transforms.transforms if isinstance(transforms, Compose) else [transforms]
+    for step in steps:
+        if getattr(step, 'defer_normalization', False):
+            return step.normalize_batch
+    return None
+
+
+def apply_batched(transforms, images):
+    """
+    Applies transforms to a whole stacked batch of images at once. Steps defining a .batch() method are
+    vectorised, ToTensor and ToTensorRaw are replaced by the equivalent NHWC -> NCHW conversion, and any other
+    step falls back to being called on each image in turn. Deferred normalization is applied at the end, so
+    the output is always fully normalized.
+    """
+    steps = transforms.transforms if isinstance(transforms, Compose) else [transforms]
+    for step in steps:
+        if hasattr(step, 'batch'):
+            images = step.batch(images)
+        elif isinstance(step, (ToTensor, ToTensorRaw)):
+            if images.dtype == np.uint8 and isinstance(step, ToTensor):
+                images = images.astype(np.float32) / 255
+            images = np.ascontiguousarray(images.transpose(0, 3, 1, 2))
+        else:
+            images = np.stack([np.asarray(step(image)) for image in images])
+
+    normalize_batch = deferred_normalization(transforms)
+    if normalize_batch is not None:
+        images = normalize_batch(torch.as_tensor(images)).numpy()
+    return images
+
 
 if __name__ == '__main__':
     from utils import tools
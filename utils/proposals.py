@@ -0,0 +1,139 @@
+"""
+Precomputation of region proposals for the novel region extraction (NRE) transforms.
+
+Region proposal (selective search or BING, followed by a KMeans fit) is by far the slowest preprocessing step,
+so it can be run ahead of time over a whole directory by a pool of worker processes:
+
+    python -m utils.proposals <root_data_path> <glob_pattern> <cache_dir> [<preprocessing>] [<max_workers>] \
+        [<region_clustering>]
+
+The resulting crop_bboxes of each image are kept in a ProposalStore under <cache_dir>/v<CACHE_VERSION>/proposals/ (see utils/cache.py).
+"""
+import os
+import sys
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from skimage import io
+from torchvision.transforms import Compose
+from utils import cache, tools
+from utils.preprocessing import RegionProposal, with_region_clustering
+from utils.dtypes import Iterable, Optional
+
+
+def split_proposer(transforms) -> tuple:
+    """
+    Splits an NRE transform into (preprocessing, proposer), where preprocessing holds the steps applied before the
+    region proposal step (None if there are none). Raises a ValueError if the transform proposes no regions.
+    """
+    steps = transforms.transforms if isinstance(transforms, Compose) else [transforms]
+    for i, step in enumerate(steps):
+        if isinstance(step, RegionProposal):
+            return (Compose(steps[:i]) if i > 0 else None), step
+    raise ValueError('The transforms do not contain a region proposal step')
+
+
+class ProposalStore:
+    """
+    Stores the (n_regions, 4) crop_bboxes proposed for each image, keyed by the image file (path, mtime and size).
+    The namespace is a fingerprint of the preprocessing and proposer parameters, so proposals computed with one
+    configuration are never returned for another. Only reproducible proposers can be stored, since the proposals
+    of the others (warm_start clustering) depend on the order in which images were processed.
+    """
+    def __init__(self, cache_dir: str, transforms):
+        preprocessing, proposer = split_proposer(transforms)
+        assert proposer.reproducible, \
+            f'Proposals clustered with {proposer.clustering!r} depend on the processing order and cannot be stored'
+        self._cache = cache.ArrayCache(
+            cache_dir, f'proposals/{cache.fingerprint(repr(preprocessing), repr(proposer))}')
+
+    def __contains__(self, path) -> bool:
+        return cache.file_fingerprint(path) in self._cache
+
+    def get(self, path) -> Optional[np.ndarray]:
+        """Returns the stored crop_bboxes of the image at path, or None if there are none"""
+        return self._cache.get(cache.file_fingerprint(path), mmap_mode=None)
+
+    def put(self, path, crop_bboxes: np.ndarray) -> None:
+        self._cache.put(cache.file_fingerprint(path), np.asarray(crop_bboxes, dtype=np.float64))
+
+
+# Per-process state of the executor's workers, set by _init_worker
+_worker_preprocessing = None
+_worker_proposer = None
+
+
+def _init_worker(transforms) -> None:
+    global _worker_preprocessing, _worker_proposer
+    _worker_preprocessing, _worker_proposer = split_proposer(transforms)
+
+
+def _propose(path: str) -> tuple:
+    image = io.imread(path)
+    if _worker_preprocessing is not None:
+        image = _worker_preprocessing(image)
+    return path, _worker_proposer.propose(image)
+
+
+class RegionProposalExecutor:
+    """
+    Computes region proposals with a pool of worker processes and saves them to a ProposalStore. At most
+    max_in_flight images are queued at any time, which bounds memory use on large directories and lets the
+    results be stored as soon as they are ready.
+    """
+    def __init__(
+            self,
+            transforms,
+            cache_dir: str,
+            max_workers: Optional[int] = None,
+            max_in_flight: Optional[int] = None):
+        self._transforms = transforms
+        self.store = ProposalStore(cache_dir, transforms)
+        self._max_workers = max_workers if max_workers is not None else os.cpu_count()
+        self._max_in_flight = max_in_flight if max_in_flight is not None else 2 * self._max_workers
+
+    def run(self, paths: Iterable, overwrite: bool = False) -> int:
+        """Computes and stores the proposals of all images in paths, returns the number of images processed"""
+        pending = (str(p) for p in paths if overwrite or p not in self.store)
+        n_done = 0
+
+        with ProcessPoolExecutor(
+                max_workers=self._max_workers,
+                initializer=_init_worker,
+                initargs=(self._transforms,)) as executor:
+            in_flight = set()
+            for path in pending:
+                in_flight.add(executor.submit(_propose, path))
+                if len(in_flight) < self._max_in_flight:
+                    continue
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                n_done += self._store_results(done)
+            n_done += self._store_results(in_flight)
+
+        return n_done
+
+    def _store_results(self, futures) -> int:
+        for future in futures:
+            path, crop_bboxes = future.result()
+            self.store.put(path, crop_bboxes)
+        return len(futures)
+
+
+if __name__ == '__main__':
+    from utils import supported_preprocessing_transforms
+
+    if not 4 <= len(sys.argv) <= 7:
+        raise ValueError(
+            'Usage: python -m utils.proposals <root_data_path> <glob_pattern> <cache_dir> '
+            '[<preprocessing>] [<max_workers>] [<region_clustering>]')
+    root_data_path, glob_pattern, cache_dir = sys.argv[1:4]
+    preprocessing = sys.argv[4] if len(sys.argv) > 4 else 'LunarAnalogueRegionProposalBING'
+    max_workers = int(sys.argv[5]) if len(sys.argv) > 5 else None
+    transforms = supported_preprocessing_transforms[preprocessing]
+    if len(sys.argv) > 6:
+        transforms = with_region_clustering(transforms, sys.argv[6])
+
+    paths = tools.PathGlobber(root_data_path, cache_dir=cache_dir).glob(glob_pattern)
+    executor = RegionProposalExecutor(transforms, cache_dir, max_workers)
+    n_done = executor.run(paths)
+    print(f'Computed region proposals for {n_done} of {len(paths)} images with {preprocessing}')
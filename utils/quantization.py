@@ -0,0 +1,132 @@
+"""
+Post-training static int8 quantization of the reconstruction based models, for scoring on CPUs:
+
+    python -m utils.quantization <path_to_archived_model> [<n_calibration_batches>] [<export_dir>] [<backend>]
+
+The model is first prepared for inference (see utils/export.py), then quantized with FX graph mode quantization.
+Activation ranges are calibrated on the training set of the model's datamodule, which only holds typical samples.
+The fp32 and int8 models then score the test set, and the AUROC of each (see utils.metrics.roc) is reported along
+with their throughput, so the accuracy given up for the speed up is known before deploying the int8 model.
+"""
+import sys
+import time
+import torch
+import torch.nn as nn
+
+from utils import export
+from utils.dtypes import *
+
+
+def quantization_config(backend: str = 'x86'):
+    """
+    Returns the QConfigMapping used for a quantized engine. The default mapping quantizes conv weights per channel,
+    which quantized transposed convs don't support, so these are quantized per tensor.
+    """
+    from torch.ao.quantization import QConfig, get_default_qconfig_mapping
+    from torch.ao.quantization.observer import HistogramObserver, MinMaxObserver
+
+    per_tensor = QConfig(
+        activation=HistogramObserver.with_args(reduce_range=backend in ('x86', 'fbgemm')),
+        weight=MinMaxObserver.with_args(dtype=torch.qint8, qscheme=torch.per_tensor_symmetric))
+    return get_default_qconfig_mapping(backend).set_object_type(nn.ConvTranspose2d, per_tensor)
+
+
+def quantize_static(
+        model: nn.Module,
+        calibration_batches: Iterable[Tensor],
+        in_shape: Iterable[int],
+        backend: str = 'x86') -> nn.Module:
+    """
+    Returns an int8 module computing the reconstruction of (N, *in_shape) batches with model (see
+    export.Reconstruction). Activation ranges are observed on the calibration_batches, which should be normalized
+    like the inputs the module will receive. The returned module runs on the CPU with the given quantized engine.
+    """
+    from torch.ao.quantization import quantize_fx
+
+    assert backend in torch.backends.quantized.supported_engines, \
+        f'Quantized engine {backend} is not supported here, expected one of: {torch.backends.quantized.supported_engines}'
+    torch.backends.quantized.engine = backend
+
+    reconstruction = export.Reconstruction(export.prepare_for_inference(model)).cpu().eval()
+    example = (torch.rand(1, *[int(s) for s in in_shape]),)
+    prepared = quantize_fx.prepare_fx(reconstruction, quantization_config(backend), example)
+
+    with torch.inference_mode():
+        for batch_in in calibration_batches:
+            prepared(batch_in.cpu().float())
+    return quantize_fx.convert_fx(prepared)
+
+
+def calibration_batches(datamodule, n_batches: Optional[int] = None) -> Iterable[Tensor]:
+    """
+    Yields up to n_batches (all if None) normalized image batches of the training set of a datamodule that has
+    been set up for training. Region extraction batches are merged into (N * R, C, H, W).
+    """
+    for i, batch in enumerate(datamodule.train_dataloader()):
+        if n_batches is not None and i == n_batches:
+            break
+        images, _ = datamodule.on_after_batch_transfer(batch)
+        yield images.flatten(0, 1) if images.dim() == 5 else images
+
+
+def evaluate(scorer, dataloader: DataLoader) -> dict:
+    """Returns the AUROC and the throughput (samples/sec) of a NoveltyScorer on the labelled batches of dataloader"""
+    from utils import metrics
+
+    start = time.perf_counter()
+    scores, labels = scorer.score_dataloader(dataloader)
+    elapsed = time.perf_counter() - start
+    _, _, _, auroc = metrics.roc(scores, labels)
+    return {'auroc': auroc, 'samples_per_sec': len(scores) / elapsed}
+
+
+if __name__ == '__main__':
+    import yaml
+    from datasets import supported_datamodules
+    from modules.novelty_scorer import NoveltyScorer
+    from utils import supported_preprocessing_transforms
+
+    if not 2 <= len(sys.argv) <= 5:
+        raise ValueError(
+            'Usage: python -m utils.quantization <path_to_archived_model> [<n_calibration_batches>] '
+            '[<export_dir>] [<backend>]')
+    archive = Path(sys.argv[1])
+    n_batches = int(sys.argv[2]) if len(sys.argv) > 2 else 32
+    export_dir = sys.argv[3] if len(sys.argv) > 3 else None
+    backend = sys.argv[4] if len(sys.argv) > 4 else 'x86'
+
+    with open(archive / 'configuration.yaml', 'r') as f:
+        config = yaml.full_load(f)
+    data_params = config['data-parameters']
+    datamodule = supported_datamodules[config['experiment-parameters']['datamodule']](
+        data_transforms=supported_preprocessing_transforms[data_params['preprocessing']],
+        **data_params)
+    datamodule.setup('train')
+    datamodule.setup('test')
+
+    fp32_scorer = NoveltyScorer.from_archive(archive, in_shape=datamodule.data_shape, device='cpu')
+    int8_model = quantize_static(
+        fp32_scorer.model, calibration_batches(datamodule, n_batches), fp32_scorer.in_shape, backend)
+    int8_scorer = NoveltyScorer(
+        int8_model,
+        data_transforms=datamodule._data_transforms,
+        novelty_metric=fp32_scorer.novelty_metric,
+        channel_weights=fp32_scorer.channel_weights,
+        device='cpu',
+        exported=True)
+
+    fp32 = evaluate(fp32_scorer, datamodule.test_dataloader())
+    int8 = evaluate(int8_scorer, datamodule.test_dataloader())
+    print(f'fp32: AUROC {fp32["auroc"]:.4f}, {fp32["samples_per_sec"]:.1f} samples/sec')
+    print(f'int8: AUROC {int8["auroc"]:.4f}, {int8["samples_per_sec"]:.1f} samples/sec')
+    print(f'AUROC delta (int8 - fp32): {int8["auroc"] - fp32["auroc"]:+.4f}, '
+          f'speed up: {int8["samples_per_sec"] / fp32["samples_per_sec"]:.2f}x')
+
+    if export_dir is not None:
+        with torch.inference_mode():
+            traced = torch.jit.freeze(torch.jit.trace(int8_model, torch.rand(2, *fp32_scorer.in_shape)))
+        Path(export_dir).mkdir(parents=True, exist_ok=True)
+        path = Path(export_dir) / f'{archive.parent.name}_{archive.name}_int8.pt'
+        traced.save(str(path))
+        export.save_export_metadata(path, fp32_scorer.in_shape, fp32_scorer.export_metadata())
+        print(f'Exported the int8 model to: {path}')
@@ -0,0 +1,72 @@
+"""
+Registries that resolve their entries on first lookup, so that importing a package doesn't import (or build)
+everything it can provide. Only uses the standard library to keep it cheap to import.
+"""
+import importlib
+import warnings
+
+from collections.abc import Mapping
+
+
+class LazyRegistry(Mapping):
+    """
+    Read-only mapping from names to objects which are only created when they are looked up. Each entry is either
+    a 'package.module:attribute' string, or a callable taking no arguments that returns the object. Resolved
+    objects are kept, so every lookup of a name returns the same object.
+    """
+    def __init__(self, entries: dict):
+        self._entries = dict(entries)
+        self._resolved = {}
+
+    def __getitem__(self, name: str):
+        if name not in self._resolved:
+            entry = self._entries[name]
+            if isinstance(entry, str):
+                module_name, attribute = entry.split(':')
+                self._resolved[name] = getattr(importlib.import_module(module_name), attribute)
+            else:
+                self._resolved[name] = entry()
+        return self._resolved[name]
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, name) -> bool:
+        return name in self._entries
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({list(self._entries)})'
+
+
+def module_getattr(module_name: str, registry: LazyRegistry, lazy_modules: dict = None, deprecated: dict = None):
+    """
+    Returns a module level __getattr__ (PEP 562) that looks up missing attributes of a package in its registry,
+    or in the modules of lazy_modules (which maps attribute names to the module defining them). Deprecated maps
+    old attribute names to the name they were renamed to, looking them up warns with a DeprecationWarning.
+    """
+    lazy_modules = lazy_modules if lazy_modules is not None else {}
+    deprecated = deprecated if deprecated is not None else {}
+
+    def __getattr__(name: str):
+        if name in deprecated:
+            warnings.warn(f'{module_name}.{name} is deprecated, use {module_name}.{deprecated[name]}',
+                          DeprecationWarning, stacklevel=2)
+            name = deprecated[name]
+        if name in registry:
+            return registry[name]
+        if name in lazy_modules:
+            return getattr(importlib.import_module(lazy_modules[name]), name)
+        raise AttributeError(f'module {module_name!r} has no attribute {name!r}')
+
+    return __getattr__
+
+
+def module_all(registry: LazyRegistry, lazy_modules: dict = None, eager: tuple = ()) -> list:
+    """
+    Returns the __all__ of a package using module_getattr, so that a star import also provides the lazy attributes
+    (which resolves all of them). Deprecated names are left out.
+    """
+    return [*eager, *registry, *(lazy_modules if lazy_modules is not None else {})]
@@ -1,6 +1,9 @@
 """
 A mix and match of useful tools for the repo
 """
+import os
+import re
+import json
 import numpy as np
 import torch.nn.functional as F
 import sys
@@ -10,10 +13,7 @@ from pathlib import Path
 from pprint import pprint
 
 from utils.dtypes import *
-from utils import dtypes
-
-import matplotlib.legend as mlegend
-from matplotlib.patches import Rectangle
+from utils import dtypes, cache
 
 
 def load_config(default_config: str, silent=False):
@@ -49,7 +49,8 @@ def save_object_to_version(obj, version: int, filename: str, log_dir='logs', mod
         f = open(save_path / filename, 'wt')
         f.write(obj)
         f.close()
-    elif isinstance(obj, dtypes.Figure):
+    elif hasattr(obj, 'savefig'):
+        # A matplotlib figure
         obj.savefig(save_path / filename, format='eps')
     elif isinstance(obj, dict):
         with open(str(save_path / filename), 'w') as f:
@@ -73,18 +74,119 @@ class Flatten(torch.nn.Module):
 
 
 class PathGlobber:
-    def __init__(self, path: str):
+    """
+    Globs files relative to a root path. If a cache_dir is given, the resolved file list of each pattern is stored
+    in a manifest along with the mtimes of all directories the pattern can reach. Since adding, removing, or renaming
+    an entry updates its directory's mtime, the manifest is reused for as long as none of those directories changed,
+    which turns a recursive directory scan into a handful of stat calls.
+    """
+    def __init__(self, path: str, cache_dir: Optional[str] = None):
         self.path = Path(path)
+        self._manifest_path = None
+        if cache_dir is not None:
+            manifest_dir = Path(cache_dir) / 'manifests'
+            manifest_dir.mkdir(parents=True, exist_ok=True)
+            self._manifest_path = manifest_dir / f'{cache.fingerprint(self.path.resolve())}.json'
 
     def glob(self, pattern: str):
-        return list(self.path.glob(pattern))
+        if self._manifest_path is None:
+            return list(self.path.glob(pattern))
+
+        manifest = self._read_manifest()
+        entry = manifest.get(pattern)
+        if entry is not None and self._is_fresh(entry['dirs']):
+            return [self.path / f for f in entry['files']]
+
+        # Directory mtimes are recorded before their entries are listed, so changes made during the scan
+        # invalidate the entry
+        paths, dirs = self._scan(pattern)
+        manifest[pattern] = {'files': [str(p.relative_to(self.path)) for p in paths], 'dirs': dirs}
+        cache.atomic_write(self._manifest_path, lambda f: f.write(json.dumps(manifest).encode('utf-8')))
+        return paths
 
     def multiglob(self, patterns: Iterable[str]):
         list_of_paths = []
         for pat in patterns:
-            list_of_paths.extend(self.path.glob(pat))
+            list_of_paths.extend(self.glob(pat))
         return list_of_paths
 
+    def _read_manifest(self) -> dict:
+        try:
+            with open(self._manifest_path, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _scan(self, pattern: str) -> tuple:
+        """
+        Walks every directory below the fixed (wildcard-free) prefix of the pattern once, and returns the paths
+        matching it, in the order Path.glob yields them, along with the mtimes of the directories walked
+        """
+        prefix = []
+        for part in Path(pattern).parts[:-1]:
+            if any(c in part for c in '*?['):
+                break
+            prefix.append(part)
+        base = self.path.joinpath(*prefix)
+        regex = _glob_regex(pattern)
+
+        # A depth-first walk with the entries of each directory in scandir order, like Path.glob
+        paths, dirs = [], {}
+        stack = [base] if base.is_dir() else []
+        while stack:
+            directory = stack.pop()
+            rel_dir = os.path.relpath(directory, self.path)
+            dirs[rel_dir] = os.stat(directory).st_mtime_ns
+            subdirs = []
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    rel_path = Path(rel_dir, entry.name).as_posix()
+                    if regex.fullmatch(rel_path):
+                        paths.append(self.path / rel_path)
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+            stack.extend(reversed(subdirs))
+        if not dirs:
+            # The base doesn't exist (yet), so watch the closest existing parent for its creation
+            while not base.is_dir() and base != self.path:
+                base = base.parent
+            dirs[os.path.relpath(base, self.path)] = os.stat(base).st_mtime_ns
+        return paths, dirs
+
+    def _is_fresh(self, dirs: dict) -> bool:
+        try:
+            return all(os.stat(self.path / d).st_mtime_ns == mtime for d, mtime in dirs.items())
+        except FileNotFoundError:
+            return False
+
+
+def _glob_regex(pattern: str):
+    """Compiles a glob pattern, relative and with '/' separators, to a regex matching the paths Path.glob matches"""
+    regex = ''
+    parts = Path(pattern).parts
+    for i, part in enumerate(parts):
+        if part == '**':
+            regex += '(?:[^/]+/)*'
+            continue
+        j = 0
+        while j < len(part):
+            c = part[j]
+            if c == '*':
+                regex += '[^/]*'
+            elif c == '?':
+                regex += '[^/]'
+            elif c == '[' and ']' in part[j + 1:]:
+                end = part.index(']', j + 1)
+                chars = part[j + 1:end].replace('\\', '\\\\')
+                regex += '[' + ('^' + chars[1:] if chars.startswith('!') else chars) + ']'
+                j = end
+            else:
+                regex += re.escape(c)
+            j += 1
+        if i < len(parts) - 1:
+            regex += '/'
+    return re.compile(regex)
+
 
 def unstandardize_batch(batch_in: torch.Tensor, tol: float = 0.001):
     '''